@@ -15,10 +15,22 @@ urlpatterns = patterns('',
 
     url( r'^tasks/process_file_from_rapid/$',  'rapid_app.views.process_file_from_rapid', name='process_file_from_rapid_url' ),
 
+    url( r'^tasks/jobs/(?P<job_id>\d+)/$',  'rapid_app.views.job_status', name='job_status_url' ),
+
+    url( r'^tasks/jobs/(?P<job_id>\d+)/events/$',  'rapid_app.views.job_events', name='job_events_url' ),
+
+    url( r'^tasks/plan_titles_update/$',  'rapid_app.views.plan_titles_update', name='plan_titles_update_url' ),
+
     url( r'^tasks/update_titles_table/$',  'rapid_app.views.update_titles_table', name='update_titles_url' ),
 
     url( r'^tasks/create_ss_file/$',  'rapid_app.views.create_ss_file', name='create_ss_file_url' ),
 
+    url( r'^tasks/downloads/ss_file/$',  'rapid_app.views.download_ss_file', name='download_ss_file_url' ),
+
+    url( r'^tasks/downloads/holdings/$',  'rapid_app.views.download_holdings', name='download_holdings_url' ),
+
+    url( r'^api/holdings/$',  'rapid_app.views.holdings_api', name='holdings_api_url' ),
+
     url( r'^$',  RedirectView.as_view(pattern_name='tasks_url') ),
 
     )
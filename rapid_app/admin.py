@@ -2,24 +2,78 @@
 
 from __future__ import unicode_literals
 from django.contrib import admin
-from rapid_app.models import PrintTitleDev, ProcessorTracker
+from rapid_app.lib.title_search import TitleFacets, TitleSearchIndex
+from rapid_app.models import PrintTitleDev, ProcessorTracker, RunHistory, SSExportGeneration, SyncPlan
+
+
+class FacetCountsFilter( admin.SimpleListFilter ):
+    """ Lists a field's values with their row-counts, from lib.title_search.TitleFacets' cache rather than a DISTINCT on each page-load. """
+    facets = TitleFacets()
+
+    def lookups( self, request, model_admin ):
+        return [ ( value, '{value} ({count})'.format(value=value, count=count) ) for ( value, count ) in self.facets.get_counts(self.parameter_name) ]
+
+    def queryset( self, request, queryset ):
+        if self.value():
+            return queryset.filter( **{self.parameter_name: self.value()} )
+        return queryset
+
+
+class BuildingFilter( FacetCountsFilter ):
+    title = 'building'
+    parameter_name = 'building'
+
+
+class LocationFilter( FacetCountsFilter ):
+    title = 'other--location'
+    parameter_name = 'location'
 
 
 class PrintTitleDevAdmin( admin.ModelAdmin ):
     ordering = [ 'key' ]
-    date_hierarchy = 'date_updated'
     list_display = [
         'key', 'issn', 'start', 'end', 'call_number', 'building', 'location', 'title', 'url', 'date_updated' ]
-    search_fields = list_display
+    search_fields = [ 'key', 'issn', 'title', 'call_number', 'url' ]  # used only without a full-text index; see get_search_results()
     # readonly_fields = list_display
-    list_filter = [ 'building', 'location', 'title', 'issn' ]
+    list_filter = [ BuildingFilter, LocationFilter ]
+    show_full_result_count = False  # skips a second, unfiltered count on searched and filtered pages
+    search_index = TitleSearchIndex()
+
+    def get_search_results( self, request, queryset, search_term ):
+        """ Matches `key` and `issn` prefixes and full-text words, all from indexes; falls back to the default icontains-search without a full-text index. """
+        if not search_term.strip():
+            return ( queryset, False )
+        if not self.search_index.is_available():
+            return super( PrintTitleDevAdmin, self ).get_search_results( request, queryset, search_term )
+        return ( self.search_index.search(queryset, search_term), False )
 
 
 class ProcessorTrackerAdmin( admin.ModelAdmin ):
     list_display = [
-        'current_status', 'processing_started', 'processing_ended', 'recent_processing' ]
+        'id', 'job_type', 'current_status', 'queued_at', 'processing_started', 'processing_ended', 'heartbeat', 'attempts', 'recent_processing', 'error' ]
+    readonly_fields = list_display
+
+
+class SyncPlanAdmin( admin.ModelAdmin ):
+    list_display = [
+        'id', 'status', 'created', 'add_count', 'change_count', 'delete_count', 'unchanged_count', 'estimated_statements', 'estimated_seconds', 'applied', 'applied_seconds' ]
+    readonly_fields = list_display + [ 'delta' ]
+
+
+class RunHistoryAdmin( admin.ModelAdmin ):
+    list_display = [
+        'id', 'job', 'status', 'started', 'ended', 'source_bytes', 'total_seconds' ]
+    readonly_fields = list_display + [ 'stages' ]
+
+
+class SSExportGenerationAdmin( admin.ModelAdmin ):
+    list_display = [
+        'id', 'created', 'row_count', 'new_count', 'changed_count', 'deleted_count', 'wrote_full_file', 'wrote_delta_file' ]
     readonly_fields = list_display
 
 
 admin.site.register( PrintTitleDev, PrintTitleDevAdmin )
 admin.site.register( ProcessorTracker, ProcessorTrackerAdmin )
+admin.site.register( SyncPlan, SyncPlanAdmin )
+admin.site.register( RunHistory, RunHistoryAdmin )
+admin.site.register( SSExportGeneration, SSExportGenerationAdmin )
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import cPickle, hashlib, logging, os, time, zlib
+from rapid_app import settings_app
+
+log = logging.getLogger(__name__)
+
+
+class ParseCheckpointer( object ):
+    """ Saves and loads parse-checkpoints: a byte-offset in the utf8-file, plus a compressed snapshot of the partial holdings.
+        A checkpoint is only used by a run over the same extract, judged by a hash of the extract's size, mtime, and sampled blocks.
+        Snapshot-cost grows with the holdings, so a save is also held back until the parse has gone as many rows past the last save as that snapshot held.
+        Non-django class. """
+
+    sample_size = 65536  # bytes hashed at each sample-point
+    sample_points = 5  # evenly spaced, including the start and the end
+
+    def __init__( self, source_filepath, checkpoint_path=None, interval_seconds=None ):
+        self.source_filepath = source_filepath  # the extract from rapid
+        self.checkpoint_path = checkpoint_path if checkpoint_path else settings_app.CHECKPOINT_PATH
+        self.interval_seconds = interval_seconds if interval_seconds is not None else settings_app.CHECKPOINT_SECONDS
+        ( self.extract_hash, self.last_save ) = ( None, time.time() )
+        ( self.last_save_rows, self.last_snapshot_size ) = ( 0, 0 )  # rows parsed at, and holdings in, the last save
+
+    def make_extract_hash( self ):
+        """ Returns hex-digest of the extract's size, mtime, and sampled blocks; a few reads, so the parse stays the one pass over the file.
+            A re-sent extract gets a new mtime, so it doesn't resume a checkpoint made against the old one.
+            Called by load() and save() """
+        if self.extract_hash is None:
+            stat = os.stat( self.source_filepath )
+            hasher = hashlib.sha1( '{size}:{mtime!r}'.format(size=stat.st_size, mtime=stat.st_mtime) )
+            with open( self.source_filepath, 'rb' ) as f:
+                for i in range( self.sample_points ):
+                    f.seek( max(0, (stat.st_size - self.sample_size) * i // (self.sample_points - 1)) )
+                    hasher.update( f.read(self.sample_size) )
+            self.extract_hash = hasher.hexdigest()
+        return self.extract_hash
+
+    def load( self ):
+        """ Returns the checkpoint's state dct if it was made against this extract, otherwise None.
+            Called by RapidFileProcessor.parse_file_from_rapid() """
+        if not os.path.isfile( self.checkpoint_path ):
+            return None
+        try:
+            with open( self.checkpoint_path, 'rb' ) as f:
+                state = cPickle.loads( zlib.decompress(f.read()) )
+        except Exception as e:
+            log.warning( 'ignoring unreadable checkpoint, `{}`'.format(unicode(repr(e))) )
+            return None
+        if state.get( 'extract_hash' ) != self.make_extract_hash():
+            log.info( 'ignoring checkpoint made against a different extract' )
+            return None
+        log.info( 'resuming from checkpoint at byte-offset, `{offset}`; holdings, `{count}`'.format(offset=state['offset'], count=len(state['holdings_dct'])) )
+        return state
+
+    def is_due( self, rows_parsed ):
+        """ Returns True if `interval_seconds` have passed since the last save, and the parse is at least as many rows past it as that save's snapshot held.
+            Called by HoldingsDctBuilder """
+        return time.time() - self.last_save >= self.interval_seconds and rows_parsed - self.last_save_rows >= self.last_snapshot_size
+
+    def save( self, state, rows_parsed ):
+        """ Writes the state dct, stamped with the extract-hash; the temp-file rename means a crash mid-write leaves the previous checkpoint intact.
+            Called by HoldingsDctBuilder.save_checkpoint() """
+        start = time.time()
+        state['extract_hash'] = self.make_extract_hash()
+        temp_path = '%s.tmp' % self.checkpoint_path
+        with open( temp_path, 'wb' ) as f:
+            f.write( zlib.compress(cPickle.dumps(state, cPickle.HIGHEST_PROTOCOL)) )
+        os.rename( temp_path, self.checkpoint_path )
+        ( self.last_save, self.last_save_rows, self.last_snapshot_size ) = ( time.time(), rows_parsed, len(state['holdings_dct']) )
+        log.debug( 'saved checkpoint at byte-offset, `{offset}`; seconds, `{seconds:.2f}`'.format(offset=state['offset'], seconds=self.last_save - start) )
+        return
+
+    def clear( self ):
+        """ Removes the checkpoint once the run no longer needs it.
+            Called by RapidFileProcessor.parse_file_from_rapid() """
+        if os.path.isfile( self.checkpoint_path ):
+            os.remove( self.checkpoint_path )
+        return
+
+    # end class ParseCheckpointer
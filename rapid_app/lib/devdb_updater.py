@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import datetime, logging
+from django.db import connection, transaction
+from rapid_app import settings_app
+from rapid_app.lib.fingerprint import Fingerprinter
+from rapid_app.lib.heartbeat import Heartbeat
+from rapid_app.lib.sync_planner import SyncPlanner
+from rapid_app.lib.title_search import TitleSearchIndex
+from rapid_app.models import PrintTitleDev
+
+log = logging.getLogger(__name__)
+
+
+class DevDbUpdater( object ):
+    """ Brings the PrintTitleDev preview-table in line with a processed holdings-list.
+        Works as a diff: one query loads existing fingerprints, sets give the adds/changes/deletes, and batched statements apply them in one transaction; changed rows are updated in place.
+        Main controller: update() """
+
+    fields = [ 'key', 'issn', 'title', 'url', 'location', 'building', 'call_number', 'start', 'end' ]  # fingerprinted, in this order
+    defs_labels = { 'call_number': 'callnumber', 'start': 'year_start', 'end': 'year_end' }  # field-names that differ from holdings_defs_dct labels
+
+    def __init__( self, holdings_defs_dct, batch_size=None, heartbeat=None ):
+        self.field_positions = [  # [ (field, position in a holdings-list row), ... ]
+            ( field, holdings_defs_dct[self.defs_labels.get(field, field)] ) for field in self.fields ]
+        self.batch_size = batch_size if batch_size else settings_app.DEV_DB_BATCH_SIZE
+        self.fingerprinter = Fingerprinter()
+        self.search_index = TitleSearchIndex()
+        self.heartbeat = heartbeat if heartbeat else Heartbeat()  # stamped between batches
+
+    def update( self, holdings_lst ):
+        """ Diffs and applies; returns counts dct.
+            Called by RapidFileProcessor.update_dev_db() """
+        new_titles = self.make_new_titles( holdings_lst )
+        existing_fingerprints = self.load_existing_fingerprints()
+        ( add_keys, change_keys, delete_keys ) = self.diff_keys( new_titles, existing_fingerprints )
+        with transaction.atomic():
+            self.run_deletes( delete_keys )
+            self.run_changes( [ new_titles[key][1] for key in sorted(change_keys) ] )
+            self.run_adds( [ new_titles[key][1] for key in sorted(add_keys) ] )
+            self.search_index.sync_keys( delete_keys | change_keys, add_keys | change_keys )
+            if add_keys or change_keys or delete_keys:
+                SyncPlanner().supersede_pending()
+        counts = { 'added': len(add_keys), 'changed': len(change_keys), 'deleted': len(delete_keys), 'unchanged': len(new_titles) - len(add_keys) - len(change_keys) }
+        log.info( 'dev-db update counts, ```{}```'.format(counts) )
+        return counts
+
+    def make_new_titles( self, holdings_lst ):
+        """ Returns { key: (fingerprint, unsaved-PrintTitleDev) }; like the old row-by-row save(), a later row with the same key wins.
+            Called by update() """
+        new_titles = {}
+        for row in holdings_lst:
+            title = PrintTitleDev( **dict( (field, row[position]) for (field, position) in self.field_positions ) )
+            new_titles[title.key] = ( self.make_title_fingerprint(title), title )
+        return new_titles
+
+    def make_title_fingerprint( self, title ):
+        """ Fingerprints a PrintTitleDev instance.
+            Called by make_new_titles() """
+        return self.fingerprinter.make_fingerprint( [getattr(title, field) for field in self.fields] )
+
+    def load_existing_fingerprints( self ):
+        """ Returns { key: fingerprint } for the current table, from one query.
+            Called by update() """
+        fingerprints = {}
+        for values in PrintTitleDev.objects.values_list( *self.fields ).iterator():
+            fingerprints[values[0]] = self.fingerprinter.make_fingerprint( values )
+        log.debug( 'existing dev-db rows, `{}`'.format(len(fingerprints)) )
+        return fingerprints
+
+    def diff_keys( self, new_titles, existing_fingerprints ):
+        """ Returns ( add_keys, change_keys, delete_keys ) sets.
+            Called by update() """
+        ( new_keys, existing_keys ) = ( set(new_titles), set(existing_fingerprints) )
+        add_keys = new_keys - existing_keys
+        delete_keys = existing_keys - new_keys
+        change_keys = set( key for key in (new_keys & existing_keys) if new_titles[key][0] != existing_fingerprints[key] )
+        return ( add_keys, change_keys, delete_keys )
+
+    def run_deletes( self, keys ):
+        """ Deletes rows in chunked `key IN (...)` statements.
+            Called by update() """
+        keys = sorted( keys )
+        for i in range( 0, len(keys), self.batch_size ):
+            PrintTitleDev.objects.filter( key__in=keys[i:i+self.batch_size] ).delete()
+            self.heartbeat.beat()
+        return
+
+    def run_changes( self, titles ):
+        """ Rewrites changed rows in place with chunked executemany() UPDATEs; `date_updated` is set as auto_now would.
+            Called by update() """
+        qn = connection.ops.quote_name
+        columns = self.fields[1:] + [ 'date_updated' ]
+        sql = 'UPDATE {table} SET {assignments} WHERE {key} = %s'.format(
+            table=qn(PrintTitleDev._meta.db_table), assignments=', '.join(['%s = %%s' % qn(column) for column in columns]), key=qn('key') )
+        now = datetime.datetime.now()
+        with connection.cursor() as cursor:
+            for i in range( 0, len(titles), self.batch_size ):
+                params = [ [ getattr(title, field) for field in self.fields[1:] ] + [ now, title.key ] for title in titles[i:i+self.batch_size] ]
+                cursor.executemany( sql, params )
+                self.heartbeat.beat()
+        return
+
+    def run_adds( self, titles ):
+        """ Inserts rows with chunked bulk_create(); `date_updated` is set by auto_now.
+            Called by update() """
+        for i in range( 0, len(titles), self.batch_size ):
+            PrintTitleDev.objects.bulk_create( titles[i:i+self.batch_size] )
+            self.heartbeat.beat()
+        return
+
+    # end class DevDbUpdater
+
+
+class ShadowTableLoader( object ):
+    """ Loads the processed holdings-list into a shadow copy of the PrintTitleDev table, then swaps it in.
+        The live table isn't written during the load; secondary indexes are built after the rows are in; the swap is one atomic rename.
+        Main controller: load() """
+
+    def __init__( self, holdings_defs_dct, batch_size=None, heartbeat=None ):
+        self.diff_updater = DevDbUpdater( holdings_defs_dct, batch_size, heartbeat )  # reused for row-building
+        ( self.batch_size, self.heartbeat ) = ( self.diff_updater.batch_size, self.diff_updater.heartbeat )
+        self.live_table = PrintTitleDev._meta.db_table
+        self.shadow_table = '%s_shadow' % self.live_table
+        self.old_table = '%s_old' % self.live_table
+        self.columns = DevDbUpdater.fields + [ 'date_updated' ]
+        self.search_index = self.diff_updater.search_index
+
+    def load( self, holdings_lst ):
+        """ Builds, fills, indexes, and publishes the shadow table; returns the row count.
+            Called by RapidFileProcessor.update_dev_db() """
+        new_titles = self.diff_updater.make_new_titles( holdings_lst )
+        with connection.cursor() as cursor:
+            index_defs = self.get_index_defs( cursor )
+            self.drop_table( cursor, self.shadow_table )
+            self.create_shadow_table( cursor, index_defs )
+            self.insert_rows( cursor, [ title for (fingerprint, title) in new_titles.itervalues() ] )
+            self.create_indexes( cursor, index_defs )
+            self.search_index.load_shadow( cursor, self.shadow_table )
+            self.swap_tables( cursor )
+        SyncPlanner().supersede_pending()
+        log.info( 'shadow-table with `{count}` rows now live as `{table}`'.format(count=len(new_titles), table=self.live_table) )
+        return len( new_titles )
+
+    def get_index_defs( self, cursor ):
+        """ Returns [ (index_name, [columns]), ... ] for the live table's plain secondary indexes.
+            Called by load() """
+        constraints = connection.introspection.get_constraints( cursor, self.live_table )
+        index_defs = [
+            ( name, dct['columns'] ) for ( name, dct ) in constraints.items()
+            if dct['index'] and not dct['unique'] and not dct['primary_key'] ]
+        log.debug( 'index_defs, ```{}```'.format(index_defs) )
+        return sorted( index_defs )
+
+    def create_shadow_table( self, cursor, index_defs ):
+        """ Creates an empty table with the live table's columns and primary key, but without its secondary indexes.
+            Called by load() """
+        qn = connection.ops.quote_name
+        if connection.vendor == 'sqlite':
+            cursor.execute( "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", [self.live_table] )
+            create_sql = cursor.fetchone()[0]  # secondary indexes are separate sqlite_master entries
+            cursor.execute( create_sql.replace(qn(self.live_table), qn(self.shadow_table), 1) )
+        elif connection.vendor == 'mysql':
+            cursor.execute( 'CREATE TABLE {shadow} LIKE {live}'.format(shadow=qn(self.shadow_table), live=qn(self.live_table)) )
+            for ( name, columns ) in index_defs:
+                cursor.execute( 'ALTER TABLE {shadow} DROP INDEX {index}'.format(shadow=qn(self.shadow_table), index=qn(name)) )
+        else:
+            raise Exception( 'shadow-table load not supported for db vendor, `{}`'.format(connection.vendor) )
+        return
+
+    def insert_rows( self, cursor, titles ):
+        """ Inserts rows with chunked executemany().
+            Called by load() """
+        qn = connection.ops.quote_name
+        sql = 'INSERT INTO {table} ({columns}) VALUES ({placeholders})'.format(
+            table=qn(self.shadow_table), columns=', '.join([qn(column) for column in self.columns]), placeholders=', '.join(['%s'] * len(self.columns)) )
+        now = datetime.datetime.now()
+        for i in range( 0, len(titles), self.batch_size ):
+            params = [ [ getattr(title, field) for field in DevDbUpdater.fields ] + [ now ] for title in titles[i:i+self.batch_size] ]
+            cursor.executemany( sql, params )
+            self.heartbeat.beat()
+        return
+
+    def create_indexes( self, cursor, index_defs ):
+        """ Builds the secondary indexes on the loaded shadow table.
+            Index names alternate between `name` and `name_s` on each load, since sqlite index-names are database-wide; mysql's search index is rebuilt as FULLTEXT.
+            Called by load() """
+        qn = connection.ops.quote_name
+        for ( name, columns ) in index_defs:
+            shadow_name = name[:-2] if name.endswith( '_s' ) else '%s_s' % name
+            cursor.execute( 'CREATE {kind}INDEX {index} ON {table} ({columns})'.format(
+                kind='FULLTEXT ' if self.search_index.is_fulltext_index(columns) else '',
+                index=qn(shadow_name), table=qn(self.shadow_table), columns=', '.join([qn(column) for column in columns])) )
+            self.heartbeat.beat()
+        return
+
+    def swap_tables( self, cursor ):
+        """ Publishes the shadow table, and on sqlite its fts table, in one atomic step, then drops the old table.
+            Called by load() """
+        qn = connection.ops.quote_name
+        ( live, shadow, old ) = ( qn(self.live_table), qn(self.shadow_table), qn(self.old_table) )
+        self.drop_table( cursor, self.old_table )
+        if connection.vendor == 'mysql':
+            cursor.execute( 'RENAME TABLE {live} TO {old}, {shadow} TO {live}'.format(live=live, old=old, shadow=shadow) )  # atomic in mysql
+        else:
+            with transaction.atomic():  # sqlite ddl is transactional
+                cursor.execute( 'ALTER TABLE {live} RENAME TO {old}'.format(live=live, old=old) )
+                cursor.execute( 'ALTER TABLE {shadow} RENAME TO {live}'.format(shadow=shadow, live=live) )
+                self.search_index.swap_shadow( cursor )
+        self.drop_table( cursor, self.old_table )
+        return
+
+    def drop_table( self, cursor, table ):
+        """ Drops a work-table if it exists.
+            Called by load() and swap_tables() """
+        cursor.execute( 'DROP TABLE IF EXISTS {}'.format(connection.ops.quote_name(table)) )
+        return
+
+    # end class ShadowTableLoader
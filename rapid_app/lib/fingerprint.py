@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import hashlib, logging
+
+log = logging.getLogger(__name__)
+
+
+class Fingerprinter( object ):
+    """ Makes stable row-fingerprints, so rows can be compared without comparing every column.
+        Non-django class. """
+
+    separator = '\x1f'  # ascii unit-separator; won't appear in rapid data
+    null_marker = '\x00'  # keeps None distinct from ''
+
+    def make_fingerprint( self, values ):
+        """ Returns a hex sha1 of the values; ints and strings with the same text hash the same.
+            Called by DevDbUpdater and others comparing row-content. """
+        parts = [ self.null_marker if value is None else unicode(value) for value in values ]
+        return hashlib.sha1( self.separator.join(parts).encode('utf-8') ).hexdigest()
+
+    # end class Fingerprinter
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import datetime, logging, time
+from django.db import connection
+from rapid_app import settings_app
+from rapid_app.models import ProcessorTracker
+
+log = logging.getLogger(__name__)
+
+
+class Heartbeat( object ):
+    """ Stamps the job's ProcessorTracker `heartbeat`, at most every `interval_seconds`, so JobQueue.clear_stale_jobs() sees the worker alive through every stage, not just the parse.
+        Inside a mysql transaction the stamp goes over a second connection, since the load's own writes aren't visible to the queue until it commits.
+        On sqlite, which takes one writer at a time, a stamp inside a transaction shows once it commits.
+        Non-django class. """
+
+    def __init__( self, job_id=None, interval_seconds=None ):
+        self.job_id = job_id  # None sends nothing
+        self.interval_seconds = interval_seconds if interval_seconds is not None else settings_app.HEARTBEAT_SECONDS
+        ( self.last_beat, self.side_connection ) = ( 0, None )
+
+    def beat( self, force=False ):
+        """ Stamps the heartbeat if `interval_seconds` have passed since the last one, or if forced.
+            Called by run_history.RunRecorder.stage(), processor.TitleMaker.resolve_pending_titles(), and the devdb_updater load loops """
+        now = time.time()
+        if self.job_id is None or ( not force and now - self.last_beat < self.interval_seconds ):
+            return
+        if connection.in_atomic_block and connection.vendor == 'mysql':
+            self.beat_on_side_connection()
+        else:
+            ProcessorTracker.objects.filter( pk=self.job_id ).update( heartbeat=datetime.datetime.now() )
+        self.last_beat = now
+        return
+
+    def beat_on_side_connection( self ):
+        """ Stamps the heartbeat over a second, autocommit, connection.
+            Called by beat() """
+        if self.side_connection is None:
+            self.side_connection = connection.copy()
+        qn = connection.ops.quote_name
+        with self.side_connection.cursor() as cursor:
+            cursor.execute( 'UPDATE {table} SET {heartbeat} = %s WHERE {id} = %s'.format(table=qn(ProcessorTracker._meta.db_table), heartbeat=qn('heartbeat'), id=qn('id')), [datetime.datetime.now(), self.job_id] )
+        return
+
+    def close( self ):
+        """ Closes the second connection, if one was opened.
+            Called by run_history.RunRecorder.save() """
+        if self.side_connection is not None:
+            self.side_connection.close()
+            self.side_connection = None
+        return
+
+    # end class Heartbeat
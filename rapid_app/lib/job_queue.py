@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import datetime, json, logging, time
+from django.db import transaction
+from django.db.models import F, Q
+from rapid_app import settings_app
+from rapid_app.lib.processor import RapidFileProcessor
+from rapid_app.models import ProcessorTracker
+
+log = logging.getLogger(__name__)
+
+
+class JobQueue( object ):
+    """ Db-backed queue of processing jobs; each job is a ProcessorTracker record.
+        Views enqueue; the `run_jobs` management command claims and runs jobs oldest-first, one at a time.
+        Non-django class. """
+
+    def __init__( self ):
+        self.job_runners = { 'process_file': self.run_process_file }  # job_type: runner
+
+    def enqueue( self, job_type='process_file' ):
+        """ Adds a queued job, carrying over recent-processing timings for time-left estimates; returns the job.
+            Called by viewhelper_processfile.ProcessFileFromRapidHelper.initiate_work() """
+        job = ProcessorTracker(
+            job_type=job_type, current_status='queued', queued_at=datetime.datetime.now(), recent_processing=self.make_recent_processing_jsn() )
+        job.save()
+        log.info( 'queued job, `{id}`; job_type, `{job_type}`'.format(id=job.id, job_type=job_type) )
+        return job
+
+    def make_recent_processing_jsn( self ):
+        """ Returns initial recent-processing json, with timings from the newest tracker record.
+            Called by enqueue() """
+        recent_processing_dct = { 'percent_done': 'N/A', 'time_left': 'N/A', 'recent_times_per_record': [], 'average_time_per_record': 0 }
+        previous = ProcessorTracker.objects.exclude( recent_processing=None ).first()
+        if previous:
+            previous_dct = json.loads( previous.recent_processing )
+            for field in [ 'recent_times_per_record', 'average_time_per_record' ]:
+                recent_processing_dct[field] = previous_dct.get( field, recent_processing_dct[field] )
+        return json.dumps( recent_processing_dct, sort_keys=True, indent=2 )
+
+    def claim_next( self ):
+        """ Marks the oldest queued job started and returns it, or None; the conditional update keeps two workers from claiming one job.
+            Called by run_pending() """
+        with transaction.atomic():
+            for job in ProcessorTracker.objects.filter( current_status='queued' ).order_by( 'queued_at', 'id' )[0:5]:
+                claimed = ProcessorTracker.objects.filter( pk=job.pk, current_status='queued' ).update(
+                    current_status='started', heartbeat=datetime.datetime.now(), attempts=F('attempts') + 1 )
+                if claimed:
+                    return ProcessorTracker.objects.get( pk=job.pk )
+        return None
+
+    def run_pending( self, once=False ):
+        """ Runs queued jobs in order; with `once`, returns when the queue is empty, otherwise polls.
+            Returns count of jobs run.
+            Called by management.commands.run_jobs.Command.handle() """
+        count = 0
+        while True:
+            self.clear_stale_jobs()
+            job = self.claim_next()
+            if job:
+                self.run_job( job )
+                count += 1
+            elif once:
+                return count
+            else:
+                time.sleep( settings_app.JOB_POLL_SECONDS )
+
+    def clear_stale_jobs( self ):
+        """ Re-queues running jobs whose worker stopped sending heartbeats, so they resume from their checkpoint; fails them after MAX_JOB_ATTEMPTS.
+            Re-queued jobs keep their queued_at, so they run next. Returns count cleared.
+            Called by run_pending() and viewhelper_tasks.TasksHelper """
+        now = datetime.datetime.now()
+        cutoff = now - datetime.timedelta( seconds=settings_app.STALE_JOB_SECONDS )
+        stale_jobs = ProcessorTracker.objects.filter( current_status__in=['started', 'in_process', 'loading'] ).filter(
+            Q(heartbeat__lt=cutoff) | Q(heartbeat=None, processing_started__lt=cutoff) )
+        count = 0
+        for job in stale_jobs:
+            note = 'worker stopped; no heartbeat since `{}`'.format( job.heartbeat or job.processing_started )
+            if job.attempts < settings_app.MAX_JOB_ATTEMPTS:
+                updates = { 'current_status': 'queued', 'error': note }
+            else:
+                updates = { 'current_status': 'failed', 'error': '{}; gave up after `{}` attempts'.format(note, job.attempts), 'processing_ended': now }
+            count += ProcessorTracker.objects.filter( pk=job.pk, current_status=job.current_status, heartbeat=job.heartbeat ).update( **updates )  # skips a job that just sent a heartbeat
+            log.warning( 'cleared stale job, `{id}`; now, `{status}`'.format(id=job.id, status=updates['current_status']) )
+        return count
+
+    def run_job( self, job ):
+        """ Runs a claimed job and records its final status; a failure is saved on the job rather than raised.
+            Called by run_pending() """
+        log.info( 'running job, `{id}`; job_type, `{job_type}`'.format(id=job.id, job_type=job.job_type) )
+        try:
+            self.job_runners[ job.job_type ]( job )
+            ( status, error ) = ( 'complete', None )
+        except Exception as e:
+            log.exception( 'job `{}` failed'.format(job.id) )
+            ( status, error ) = ( 'failed', unicode(repr(e)) )
+        now = datetime.datetime.now()
+        ProcessorTracker.objects.filter( pk=job.pk ).update( current_status=status, error=error, processing_ended=now, heartbeat=now )
+        log.info( 'job `{id}` finished with status, `{status}`'.format(id=job.id, status=status) )
+        return status
+
+    def run_process_file( self, job ):
+        """ Parses the file-from-rapid and loads the preview-table, reporting progress to the job's tracker record.
+            Called by run_job() """
+        processor = RapidFileProcessor( settings_app.FROM_RAPID_FILEPATH, settings_app.FROM_RAPID_UTF8_FILEPATH, job_id=job.id )
+        processor.parse_file_from_rapid()
+        return
+
+    def make_status_dct( self, job ):
+        """ Returns job-status dct for polling.
+            Called by viewhelper_processfile.JobStatusHelper """
+        recent_processing_dct = json.loads( job.recent_processing ) if job.recent_processing else {}
+        return {
+            'job_id': job.id,
+            'job_type': job.job_type,
+            'status': job.current_status,
+            'queue_position': self.get_queue_position( job ),
+            'percent_done': recent_processing_dct.get( 'percent_done' ),
+            'time_left': recent_processing_dct.get( 'time_left' ),
+            'queued_at': self.format_datetime( job.queued_at ),
+            'processing_started': self.format_datetime( job.processing_started ),
+            'processing_ended': self.format_datetime( job.processing_ended ),
+            'heartbeat': self.format_datetime( job.heartbeat ),
+            'attempts': job.attempts,
+            'error': job.error,
+            }
+
+    def get_queue_position( self, job ):
+        """ Returns 1-based position among queued jobs, or None if the job isn't queued.
+            Called by make_status_dct() """
+        if job.current_status != 'queued':
+            return None
+        return ProcessorTracker.objects.filter( current_status='queued', id__lte=job.id ).count()
+
+    def format_datetime( self, dt ):
+        """ Returns isoformat string or None.
+            Called by make_status_dct() """
+        return dt.isoformat() if dt else None
+
+    # end class JobQueue
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json, logging, os, re, time
+import requests
+from rapid_app import settings_app
+
+log = logging.getLogger(__name__)
+
+
+class LocationsResolver( object ):
+    """ Maps rapid location-codes to building names.
+        The locations json is kept in an on-disk cache, revalidated with its ETag once its max-age is up, and used stale if the service fails.
+        The json and the r/h/q prefix-rules are compiled into one flat { code: building } table.
+        Non-django class. """
+
+    prefix_rules = [ ('r', 'Rock'), ('h', 'Hay'), ('q', 'Annex') ]  # fallbacks for codes the locations json doesn't list
+    max_age_pattern = re.compile( r'max-age=(\d+)' )
+
+    def __init__( self, building_table=None, cache_path=None, default_max_age=None ):
+        self.cache_path = cache_path if cache_path else settings_app.LOCATIONS_CACHE_PATH
+        self.default_max_age = default_max_age if default_max_age is not None else settings_app.LOCATIONS_CACHE_MAX_AGE
+        self.building_table = building_table if building_table is not None else self.compile_table( self.load_locations_dct() )  # shard-workers are handed the parent's table
+
+    def resolve( self, location ):
+        """ Returns building for location-code; codes not yet in the table are worked out once and memoized.
+            Called by HoldingsDctBuilder._make_building() """
+        try:
+            return self.building_table[ location ]
+        except KeyError:
+            building = self.apply_prefix_rules( location )
+            self.building_table[ location ] = building
+            return building
+
+    def apply_prefix_rules( self, location ):
+        """ Returns building for an unlisted location-code.
+            Called by resolve() """
+        for ( prefix, building ) in self.prefix_rules:
+            if location.startswith( prefix ):
+                return building
+        log.warning( 'location code {} not recognized'.format(location) )
+        return location
+
+    def compile_table( self, locations_dct ):
+        """ Flattens the locations json to { code: building }.
+            Called by __init__() """
+        building_table = {}
+        for ( code, item ) in locations_dct['result']['items'].items():
+            if 'building' in item:
+                building_table[ code ] = item['building']
+        log.debug( 'compiled `{}` location-codes'.format(len(building_table)) )
+        return building_table
+
+    def load_locations_dct( self ):
+        """ Returns locations json from the cache if still fresh; otherwise revalidates, falling back to the stale copy on error.
+            Called by __init__() """
+        cached = self.read_cache()
+        if cached and time.time() - cached['fetched'] < cached['max_age']:
+            log.debug( 'using fresh cached locations' )
+            return cached['locations']
+        try:
+            return self.fetch_locations_dct( cached )
+        except Exception as e:
+            if not cached:
+                raise
+            log.warning( 'locations fetch failed; using stale cache, ```{}```'.format(unicode(repr(e))) )
+            return cached['locations']
+
+    def fetch_locations_dct( self, cached ):
+        """ Conditionally GETs the locations json; a 304 renews the cached copy, keeping the cached ETag if the 304 doesn't repeat it.
+            Called by load_locations_dct() """
+        headers = { 'If-None-Match': cached['etag'] } if ( cached and cached.get('etag') ) else {}
+        r = requests.get( settings_app.LOCATIONS_URL, headers=headers, timeout=settings_app.LOCATIONS_TIMEOUT )
+        if r.status_code == 304 and cached:
+            log.debug( 'cached locations still valid' )
+            ( locations_dct, etag ) = ( cached['locations'], r.headers.get('ETag') or cached.get('etag') )
+        else:
+            r.raise_for_status()
+            ( locations_dct, etag ) = ( r.json(), r.headers.get('ETag') )
+        self.write_cache( locations_dct, etag, self.parse_max_age(r.headers.get('Cache-Control')) )
+        return locations_dct
+
+    def parse_max_age( self, cache_control ):
+        """ Returns max-age seconds from a Cache-Control header, or the default.
+            Called by fetch_locations_dct() """
+        match = self.max_age_pattern.search( cache_control or '' )
+        return int( match.group(1) ) if match else self.default_max_age
+
+    def read_cache( self ):
+        """ Returns cache dct, or None if missing or unreadable.
+            Called by load_locations_dct() """
+        try:
+            with open( self.cache_path, 'r' ) as f:
+                return json.loads( f.read() )
+        except ( IOError, ValueError ) as e:
+            log.debug( 'no usable locations cache, ```{}```'.format(unicode(repr(e))) )
+            return None
+
+    def write_cache( self, locations_dct, etag, max_age ):
+        """ Saves the locations json with its validators; written to a temp file and renamed so readers never see a partial file.
+            Called by fetch_locations_dct() """
+        temp_path = '%s.tmp' % self.cache_path
+        with open( temp_path, 'w' ) as f:
+            f.write( json.dumps({'locations': locations_dct, 'etag': etag, 'max_age': max_age, 'fetched': time.time()}) )
+        os.rename( temp_path, self.cache_path )
+        return
+
+    # end class LocationsResolver
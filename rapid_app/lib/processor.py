@@ -2,10 +2,18 @@
 
 from __future__ import unicode_literals
 
-import codecs, csv, datetime, itertools, json, logging, operator, pprint, shutil, urllib
+import codecs, csv, datetime, itertools, json, logging, multiprocessing, os, pprint, re, time, urllib
 import requests
 from django.utils.http import urlquote_plus
+from multiprocessing.pool import ThreadPool
 from rapid_app import settings_app
+from rapid_app.lib.checkpoint import ParseCheckpointer
+from rapid_app.lib.devdb_updater import DevDbUpdater, ShadowTableLoader
+from rapid_app.lib.heartbeat import Heartbeat
+from rapid_app.lib.locations import LocationsResolver
+from rapid_app.lib.progress import ProgressReporter
+from rapid_app.lib.run_history import RunRecorder
+from rapid_app.lib.title_cache import TitleCache
 from rapid_app.models import PrintTitleDev, ProcessorTracker
 
 log = logging.getLogger(__name__)
@@ -15,9 +23,11 @@ class RapidFileProcessor( object ):
     """ Handles processing of file from Rapid.
         Main worker function: parse_file_from_rapid() """
 
-    def __init__(self, from_rapid_filepath, from_rapid_utf8_filepath ):
+    def __init__(self, from_rapid_filepath, from_rapid_utf8_filepath, parse_workers=None, job_id=None ):
         log.debug( 'initialized source-path, ```{source}```; destination-utf8-path, ```{destination}```'.format(source=from_rapid_filepath, destination=from_rapid_utf8_filepath) )
         self.from_rapid_utf8_filepath = from_rapid_utf8_filepath  # converted utf8-filepath
+        self.parse_workers = parse_workers if parse_workers else settings_app.PARSE_WORKERS  # more than 1 triggers sharded parsing
+        self.job_id = job_id  # ProcessorTracker job to report progress to; None means the latest tracker record
         self.updated_holdings_defs_dct = {
             'key': 0, 'issn': 1, 'title': 2, 'url': 3, 'location': 4, 'building': 5, 'callnumber': 6, 'year_start': 7, 'year_end': 8 }
         self.utf8_maker = Utf8Maker( from_rapid_filepath, from_rapid_utf8_filepath )
@@ -26,122 +36,80 @@ class RapidFileProcessor( object ):
         """ Extracts print holdings from the file-from-rapid.
             That file contains both print and online holdings.
             Steps...
-              - a file from-rapid is created that is known to be utf8-good
-              - iterates through that file looking for `Print` entries; for those entries...  # HoldingsDctBuilder.build_holdings_dct()
+              - streams the file from-rapid once; each line is validated, written to the utf8-copy, and parsed  # Utf8Maker.stream_utf8_lines()
+              - looks for `Print` entries; for those entries...  # HoldingsDctBuilder.build_holdings_dct()
                 - valid and massaged row-elements are obtained (sometimes a title contains unescaped commas)...  # HoldingsDctBuilder.process_file_row()
                 - if the entry doesn't exist, it's added to a holdings-dct (unique key on modified-issn & location & modified-callnumber)
               - a list is created from the dct of all print holdings, primarily making year-ranges  # build_holdings_lst()
               - the preview-db is updated  # update_dev_db()
               - the list is returned to the view in case the user requests a json response; othewise, the response is the preview admin screen.
-            Called by viewhelper_processfile.ProcessFileFromRapidHelper.initiate_work() """
+            Each stage's timing is saved to RunHistory, whether the run completes or fails.
+            The parse checkpoints periodically; a run over the same extract resumes from the last checkpoint, which is removed once a run completes.
+            Called by job_queue.JobQueue.run_job() """
         log.debug( 'starting parse' )
-        if self.utf8_maker.check_utf8() is False:
-            self.utf8_maker.make_utf8()
-        else:
-            self.utf8_maker.copy_utf8()
-        holdings_dct_builder = HoldingsDctBuilder( self.from_rapid_utf8_filepath )
-        holdings_dct = holdings_dct_builder.build_holdings_dct()
-        holdings_lst = self.build_holdings_lst( holdings_dct )
-        self.update_dev_db( holdings_lst )
+        run_recorder = RunRecorder( self.job_id )
+        checkpointer = ParseCheckpointer( self.utf8_maker.from_rapid_filepath )
+        checkpoint = checkpointer.load()
+        holdings_dct_builder = HoldingsDctBuilder( self.from_rapid_utf8_filepath, job_id=self.job_id, run_recorder=run_recorder, checkpointer=checkpointer )
+        try:
+            if self.parse_workers > 1 or checkpoint:
+                with run_recorder.stage( 'ingest' ):
+                    self.utf8_maker.write_utf8_copy()  # shards, and resumes, need the whole utf8-file on disk
+            if self.parse_workers > 1:
+                holdings_dct = holdings_dct_builder.build_holdings_dct_parallel( self.parse_workers, checkpoint=checkpoint )
+            elif checkpoint:
+                holdings_dct = holdings_dct_builder.build_holdings_dct( checkpoint=checkpoint )  # streams the utf8-copy from the checkpoint's offset
+            else:
+                holdings_dct = holdings_dct_builder.build_holdings_dct( utf8_maker=self.utf8_maker )  # single pass: validates, writes utf8-copy, and parses; the `ingest` stage is split out of the `parse` stage
+            with run_recorder.stage( 'aggregation', rows_in=len(holdings_dct) ) as stage:
+                holdings_lst = self.build_holdings_lst( holdings_dct )
+                stage['rows_out'] = len( holdings_lst )
+            with run_recorder.stage( 'db_load', rows_in=len(holdings_lst) ) as stage:
+                self.update_dev_db( holdings_lst, heartbeat=run_recorder.heartbeat )
+                stage['rows_out'] = PrintTitleDev.objects.count()
+        except Exception:
+            run_recorder.save( 'failed' )
+            raise
+        checkpointer.clear()
+        run_recorder.save( 'complete' )
         return holdings_lst
 
     def build_holdings_lst( self, holdings_dct ):
         """ Converts the holdings_dct into a list of entries ready for db update.
-            Main work is taking the multiple year entries and making ranges.
+            Main work is taking each holding's years and making ranges; HoldingRecord.year_ranges() computes them once per holding.
+            Entries are de-duplicated through a dict index, then sorted once.
             Called by parse_file_from_rapid() """
-        holdings_lst = []
-        for ( key, dct_val ) in holdings_dct.items():
-            year_lst = dct_val['years']
-            log.debug( 'year_lst, `%s`' % year_lst )
-            holdings_dct[key]['years_contig'] = self._contigify_list( year_lst )
-            holdings_dct[key]['years_held'] = self._build_years_held( holdings_dct[key]['years_contig'] )
-            holdings_lst = self._update_holdings_lst( holdings_lst, dct_val )
-        sorted_lst = sorted( holdings_lst )
-        log.info( 'holdings_lst, ```%s```' % pprint.pformat(sorted_lst) )
+        holdings_index = {}
+        for holding in holdings_dct.itervalues():
+            if not isinstance( holding, HoldingRecord ):  # a plain dct, as returned by HoldingRecord.to_dct()
+                holding = HoldingRecord.from_dct( holding )
+            self._update_holdings_index( holdings_index, holding )
+        sorted_lst = sorted( holdings_index.itervalues() )
+        log.info( 'len(holdings_lst), `%s`' % len(sorted_lst) )
+        if log.isEnabledFor( logging.DEBUG ):
+            log.debug( 'holdings_lst, ```%s```' % pprint.pformat(sorted_lst) )
         return sorted_lst
 
-    def _contigify_list( self, lst ):
-        """ Converts sorted list entries into sub-lists that are contiguous.
-            Eg: [ 1, 2, 4, 5 ] -> [ [1, 2], [4, 5] ]
-            Credit: <http://stackoverflow.com/questions/3149440/python-splitting-list-based-on-missing-numbers-in-a-sequence>
-            Called by build_holdings_list() """
-        contig_lst = []
-        if lst == ['']:
-            return contig_lst
-        int_lst = [ int(x) for x in lst ]
-        for k, g in itertools.groupby( enumerate(int_lst), lambda (i,x):i-x ):
-            contig_lst.append( map(operator.itemgetter(1), g) )
-        log.debug( 'contig_lst, `%s`' % contig_lst )
-        return contig_lst
-
-    def _build_years_held( self, contig_lst ):
-        """ Converts contig_list to list of [ {'start': year-a, 'end': 'year-b'}, {'start': year-c, 'end': 'year-d'} ] entries.
-            Called by build_holdings_list() """
-        years_held_lst = []
-        for lst in contig_lst:
-            for year in lst:
-                start = lst[0]
-                end = lst[-1]
-                # end = lst[-1] if lst[-1] is not start else ( lst[-1] + 1 )
-                start_end_dct = {'start': start, 'end':end}
-                if start_end_dct not in years_held_lst:
-                    years_held_lst.append( start_end_dct )
-        log.debug( 'years_held_lst, `%s`' % years_held_lst )
-        return years_held_lst
-
-    def _update_holdings_lst( self, holdings_lst, issn_dct ):
-        """ Builds final data lst entry.
+    def _update_holdings_index( self, holdings_index, holding ):
+        """ Adds a holding's final data lst entries to the index, keyed on the whole entry so identical entries collapse.
             Called by build_holdings_lst() """
-        ( issn, location, building ) = ( issn_dct['issn'], issn_dct['location'], issn_dct['building'] )
-        ( callnumber, title, url ) = ( issn_dct['call_number'], issn_dct['title'], issn_dct['url'] )
-        for period_dct in issn_dct['years_held']:
-            new_key = '%s%s' % ( issn.replace('-', ''), period_dct['start'] )
-            update_lst = [ new_key, issn, title, url, location, building, callnumber, period_dct['start'], period_dct['end'] ]
-            log.debug( 'update_lst, `%s`' % update_lst )
-            if update_lst not in holdings_lst:
-                log.debug( 'gonna update' )
-                holdings_lst.append( update_lst )
-        return holdings_lst
-
-    def update_dev_db( self, holdings_lst ):
-        """ Adds and removes dev-db title entries.
+        ( issn, location, building ) = ( holding.issn, holding.location, holding.building )
+        ( callnumber, title, url ) = ( holding.call_number, holding.title, holding.url )
+        normalized_issn = issn.replace( '-', '' )
+        for ( start, end ) in holding.year_ranges():
+            new_key = '%s%s' % ( normalized_issn, start )
+            update_lst = [ new_key, issn, title, url, location, building, callnumber, start, end ]
+            holdings_index.setdefault( tuple(update_lst), update_lst )
+        return holdings_index
+
+    def update_dev_db( self, holdings_lst, heartbeat=None ):
+        """ Adds, replaces, and removes dev-db title entries; the load's batch-loops stamp the job's heartbeat.
+            Default is a batched diff against the current table; the `shadow` load-mode instead loads a fresh table and swaps it in.
             Called by parse_file_from_rapid() """
-        self._run_dev_db_adds( holdings_lst )
-        self._run_dev_db_deletes( holdings_lst )
-        return
-
-    def _run_dev_db_adds( self, holdings_lst ):
-        """ Populates a db table that can be viewed before replacing the production db table.
-            Assumes an index on unique `key` field.
-            Called by update_dev_db() """
-        for row in holdings_lst:
-            log.debug( 'row, ```{}```'.format(pprint.pformat(row)) )
-            title = PrintTitleDev()
-            title.key = row[self.updated_holdings_defs_dct['key']]
-            title.issn = row[self.updated_holdings_defs_dct['issn']]
-            title.title = row[self.updated_holdings_defs_dct['title']]
-            title.url = row[self.updated_holdings_defs_dct['url']]
-            title.start = row[self.updated_holdings_defs_dct['year_start']]
-            title.end = row[self.updated_holdings_defs_dct['year_end']]
-            title.location = row[self.updated_holdings_defs_dct['location']]
-            title.building = row[self.updated_holdings_defs_dct['building']]
-            title.call_number = row[self.updated_holdings_defs_dct['callnumber']]
-            title.updated = unicode( datetime.date.today() )
-            title.save()
-        return
-
-    def _run_dev_db_deletes( self, holdings_lst ):
-        """ Removes outdated dev-db title entries.
-            Called by update_dev_db() """
-        key_list = []
-        for row in holdings_lst:
-            holdings_key = row[self.updated_holdings_defs_dct['key']]
-            if holdings_key not in key_list:
-                key_list.append( holdings_key )
-        titles = PrintTitleDev.objects.all()
-        for title in titles:
-            if title.key not in key_list:
-                title.delete()
+        if settings_app.DEV_DB_LOAD_MODE == 'shadow':
+            ShadowTableLoader( self.updated_holdings_defs_dct, heartbeat=heartbeat ).load( holdings_lst )
+        else:
+            DevDbUpdater( self.updated_holdings_defs_dct, heartbeat=heartbeat ).update( holdings_lst )
         return
 
     # end class RapidFileProcessor
@@ -154,11 +122,99 @@ class Utf8Maker( object ):
     def __init__(self, from_rapid_filepath, from_rapid_utf8_filepath ):
         self.from_rapid_filepath = from_rapid_filepath  # actual initial file from rapid
         self.from_rapid_utf8_filepath = from_rapid_utf8_filepath  # converted utf8-filepath
+        self.bytes_read = 0  # updated by stream_utf8_lines(); source-file bytes consumed so far
+        self.bytes_total = 0  # set by stream_utf8_lines(); source-file size
+        self.utf8_bytes = 0  # updated by stream_utf8_lines(); utf8 bytes yielded so far, so an offset into the utf8-copy
+        self.stream_seconds = 0.0  # updated by stream_utf8_lines(); time spent reading, validating, and writing, not counting the caller's work between lines
+
+    def stream_utf8_lines( self, write_copy=True, start=0 ):
+        """ Yields utf8 lines from the source file in a single pass.
+            Each line is validated as it's decoded (utf-16 source lines are transcoded), and is optionally written to the utf8-copy.
+            Updates self.bytes_read, so callers can track progress against self.bytes_total without a counting pre-pass.
+            `start` is a line-boundary byte-offset to resume from; it's only used on an already-utf8 file.
+            Called by HoldingsDctBuilder.build_holdings_dct() """
+        ( self.bytes_total, self.bytes_read, self.utf8_bytes, self.stream_seconds ) = ( os.path.getsize(self.from_rapid_filepath), 0, start, 0.0 )
+        resumed = time.time()
+        log.debug( 'streaming src-path, `%s`; bytes_total, `%s`; write_copy, `%s`' % (self.from_rapid_filepath, self.bytes_total, write_copy) )
+        output_file = open( self.from_rapid_utf8_filepath, 'wb' ) if write_copy else None
+        try:
+            with open( self.from_rapid_filepath, 'rb' ) as input_file:
+                encoding = self._detect_encoding( input_file )
+                if start:
+                    input_file.seek( start )
+                    self.bytes_read = start
+                raw_lines = input_file if encoding == 'utf-8' else self._iter_utf16_lines( input_file, encoding )
+                for raw_line in raw_lines:
+                    self.bytes_read += len( raw_line )
+                    utf8_line = self._make_utf8_line( raw_line, encoding )
+                    self.utf8_bytes += len( utf8_line )
+                    if output_file:
+                        output_file.write( utf8_line )
+                    self.stream_seconds += time.time() - resumed
+                    yield utf8_line
+                    resumed = time.time()
+        finally:
+            if output_file:
+                output_file.close()
+        log.debug( 'streamed `%s` bytes' % self.bytes_read )
+
+    def write_utf8_copy( self ):
+        """ Runs the streaming validate/transcode without parsing, leaving the utf8-copy on disk.
+            Called by RapidFileProcessor.parse_file_from_rapid() when parsing in parallel. """
+        for line in self.stream_utf8_lines( write_copy=True ):
+            pass
+        return
+
+    def _detect_encoding( self, input_file ):
+        """ Sniffs the byte-order-mark; consumes it for utf-16 files, otherwise rewinds.
+            Rapid sends utf-16 with a BOM; files already converted are utf-8.
+            Called by stream_utf8_lines() """
+        bom = input_file.read( 2 )
+        if bom == codecs.BOM_UTF16_LE:
+            ( encoding, self.bytes_read ) = ( 'utf-16-le', 2 )
+        elif bom == codecs.BOM_UTF16_BE:
+            ( encoding, self.bytes_read ) = ( 'utf-16-be', 2 )
+        else:
+            input_file.seek( 0 )
+            encoding = 'utf-8'
+        log.debug( 'detected encoding, `%s`' % encoding )
+        return encoding
+
+    def _iter_utf16_lines( self, input_file, encoding ):
+        """ Yields raw utf-16 lines, each ending on a complete newline code-unit.
+            readline() splits on any 0x0A byte, so partial lines are joined until the buffer ends on a real newline.
+            Called by stream_utf8_lines() """
+        newline = '\n\x00'.encode( 'latin-1' ) if encoding == 'utf-16-le' else '\x00\n'.encode( 'latin-1' )
+        buf = b''
+        while True:
+            chunk = input_file.readline()
+            if not chunk:
+                break
+            buf += chunk
+            if len( buf ) % 2 and encoding == 'utf-16-le':  # 0x0A was a low byte; pull in its high byte
+                buf += input_file.read( 1 )
+            if len( buf ) % 2 == 0 and buf.endswith( newline ):
+                yield buf
+                buf = b''
+        if buf:
+            yield buf
+
+    def _make_utf8_line( self, raw_line, encoding ):
+        """ Returns utf8 bytes for the raw line; raises on undecodable data.
+            Called by stream_utf8_lines() """
+        try:
+            if encoding == 'utf-8':
+                raw_line.decode( 'utf-8' )  # validation only; line is already utf8
+                return raw_line
+            return raw_line.decode( encoding ).encode( 'utf-8' )
+        except Exception as e:
+            log.error( 'exception decoding line near byte `%s`, `%s`' % (self.bytes_read, unicode(repr(e))) )
+            raise Exception( unicode(repr(e)) )
 
     def check_utf8( self, filepath=None ):
         """ Ensures file is utf-8 readable.
             Will error and return False if not.
-            Called by parse_file_from_rapid() """
+            Called by tests; stream_utf8_lines() validates each line as it's processed. """
         path = filepath if filepath else self.from_rapid_filepath
         log.debug( 'checked path, `%s`' % path )
         utf8 = False
@@ -172,38 +228,6 @@ class Utf8Maker( object ):
         log.debug( 'utf8 check, `{}`'.format(utf8) )
         return utf8
 
-    def make_utf8( self ):
-        """ Iterates through each line; ensures it can be converted to utf-8.
-            Called by parse_file_from_rapid() """
-        try:
-            log.debug( 'src-path, `%s`; dest-path, `%s`' % (self.from_rapid_filepath, self.from_rapid_utf8_filepath) )
-            with codecs.open( self.from_rapid_filepath, 'rb', 'utf-16' ) as input_file:
-                with open( self.from_rapid_utf8_filepath, 'wb' ) as output_file:
-                    self._run_utf8_write( input_file, output_file )
-            log.debug( 'utf8 file now at, `%s`' % self.from_rapid_utf8_filepath )
-        except Exception as e:
-            log.error( 'exception on source or destination file, `%s`' % unicode(repr(e)) )
-            raise Exception( unicode(repr(e)) )
-        return
-
-    def _run_utf8_write( self, input_file, output_file ):
-        """ Runs the line-by-line utf8 transform.
-            Called by make_utf8() """
-        for line in input_file:
-            try:
-                # assert( type(line) == unicode )
-                output_file.write( line.encode('utf-8') )
-            except Exception as e:
-                log.error( 'exception, `%s`' % unicode(repr(e)) )
-                raise Exception( unicode(repr(e)) )
-        return
-
-    def copy_utf8( self ):
-        """ Copies good utf8 source file to utf8-filepath.
-            Called by parse_file_from_rapid() """
-        shutil.copy2( self.from_rapid_filepath, self.from_rapid_utf8_filepath )
-        return
-
     # end class Utf8Maker
 
 
@@ -211,7 +235,7 @@ class HoldingsDctBuilder( object ):
     """ Builds dct of holdings from file.
         Non-django class. """
 
-    def __init__(self, from_rapid_utf8_filepath ):
+    def __init__(self, from_rapid_utf8_filepath, building_table=None, job_id=None, run_recorder=None, checkpointer=None ):
         self.from_rapid_utf8_filepath = from_rapid_utf8_filepath  # converted utf8-filepath
         self.defs_dct = {  # proper row field-definitions
             'library': 0,
@@ -227,70 +251,212 @@ class HoldingsDctBuilder( object ):
             'year': 10
             }
         self.row_fixer = RowFixer( self.defs_dct )
-        self.locations_dct = self.update_locations_dct()
-        self.tracker_updater = TrackerUpdater()
-        self.title_maker = TitleMaker()
-
-    def update_locations_dct( self ):
-        """ Populates class attribute with locations dct, used to populate `building` field.
-            Called by __init__() """
-        r = requests.get( settings_app.LOCATIONS_URL )
-        dct = r.json()
-        return dct
-
-    def build_holdings_dct( self ):
+        self.line_filter = PrintLineFilter()
+        self.locations_resolver = LocationsResolver( building_table )  # shard-workers are handed the parent's compiled table
+        self.tracker_updater = TrackerUpdater( job_id )  # start and finish bookkeeping
+        self.progress_reporter = ProgressReporter( job_id )  # throttled progress in between
+        self.run_recorder = run_recorder if run_recorder else RunRecorder( job_id )  # stage timings
+        ( self.checkpointer, self.saved_offset ) = ( checkpointer, None )  # no checkpointer, no checkpoints
+        self.title_maker = TitleMaker( heartbeat=self.run_recorder.heartbeat )
+
+    def build_holdings_dct( self, utf8_maker=None, checkpoint=None ):
         """ Iterates through file, grabbing normalized print holdings.
             Sample print entries:
                 `RBN,Main Library,sci,TR1 .P58,Photographic abstracts,Print,0031-8701,ISSN,,,1962`
                 `RBN,Main Library,qs,QP1 .E7,Ergebnisse der Physiologie, biologischen Chemie und experimentellen Pharmakologie...,Print,0080-2042,ISSN,1,69,1938`
             Note: there are unescaped commas in some of the titles. Grrr.
-            Builds and returns a dict like {
-                u'00029629sciR11A6': {
-                    u'call_number': 'R11 .A6',
-                    u'issn': '0002-9629',
-                    u'location': 'sci',
-                    u'years': ['1926', '1928'] },  # years are sorted
-                u'abc123': {
-                    ... },
+            Lines come from utf8_maker.stream_utf8_lines(), so the file is read once; if no utf8_maker is passed, the existing utf8-file is streamed.
+            With a checkpoint, the existing utf8-file is streamed from the checkpoint's offset, into the checkpoint's holdings.
+            Builds and returns a dict of HoldingRecord instances like {
+                u'00029629sciR11A6': <HoldingRecord>,  # .to_dct() gives { u'call_number': 'R11 .A6', u'issn': '0002-9629', u'location': 'sci', u'years': ['1926', '1928'], ... }
+                u'abc123': <HoldingRecord>,
                     }
             Called by RapidFileProcessor.parse_file_from_rapid() """
         log.debug( 'starting build_holdings_dct()' )
-        ( holdings_dct, csv_ref, entries_count ) = self.prep_holdings_dct_processing()
-        for (idx, row) in enumerate(csv_ref):  # row is type() `list`
-            self.track_row( idx, entries_count )
-            if 'Print' not in row:
-                continue
-            ( key, issn, title, location, building, callnumber, year ) = self.process_file_row( row )
-            holdings_dct = self.update_holdings_dct( holdings_dct, key, issn, title, location, building, callnumber, year )
+        ingest_fused = utf8_maker is not None  # the parse also writes the utf8-copy
+        ( holdings_dct, csv_ref, utf8_maker ) = self.prep_holdings_dct_processing( utf8_maker, checkpoint )
+        self.tracker_updater.update_db_tracker( 0, utf8_maker.bytes_total )
+        self.progress_reporter.start( fused_stages=['ingest'] if ingest_fused else [] )
+        with self.run_recorder.stage( 'parse' ) as stage:
+            for row in csv_ref:  # row is type() `list`
+                self.track_progress( utf8_maker.bytes_read, utf8_maker.bytes_total )
+                holdings_dct = self.add_row_to_holdings_dct( holdings_dct, row )
+                if self.checkpointer and self.checkpointer.is_due( self.line_filter.lines_kept ):
+                    self.save_checkpoint( utf8_maker.utf8_bytes, holdings_dct )  # csv.reader doesn't read ahead, so this is the next row's start
+            ( stage['rows_in'], stage['rows_out'] ) = ( self.line_filter.lines_seen, len(holdings_dct) )
+        if ingest_fused:
+            self.run_recorder.record_fused_stage( 'ingest', utf8_maker.stream_seconds, within='parse' )
+        self.run_recorder.source_bytes = utf8_maker.bytes_total  # known once streaming has started
+        holdings_dct = self.apply_solr_titles( holdings_dct )
+        self.tracker_updater.update_db_tracker( 100, utf8_maker.bytes_total )
+        self.line_filter.log_counts()
+        self.title_maker.title_cache.log_counts()
         log.info( 'non-matched unicode titles, ```{}```'.format(pprint.pformat(self.title_maker.non_matches)) )
-        log.debug( 'len(holdings_dct), `{len}`; holdings_dct, ```{dct}```'.format(len=len(holdings_dct), dct=pprint.pformat(holdings_dct)) )
+        log.debug( 'len(holdings_dct), `{}`'.format(len(holdings_dct)) )
         return holdings_dct
 
-    def prep_holdings_dct_processing( self ):
+    def prep_holdings_dct_processing( self, utf8_maker, checkpoint=None ):
         """ Sets initial vars.
+            No counting pre-pass; progress is measured in bytes consumed.
             Called by build_holdings_dct() """
-        log.debug( 'using utf8-filepath, ```{}```'.format(self.from_rapid_utf8_filepath) )
-        holdings_dct = {}
-        tmp_csv_ref = csv.reader( open(self.from_rapid_utf8_filepath), dialect=csv.excel, delimiter=','.encode('utf-8') )
-        entries_count = sum( 1 for row in tmp_csv_ref )  # runs through file, so have to open again
-        csv_ref = csv.reader( open(self.from_rapid_utf8_filepath), dialect=csv.excel, delimiter=','.encode('utf-8') )
-        log.debug( 'entries_count, `%s`' % entries_count )
-        return ( holdings_dct, csv_ref, entries_count )
-
-    def track_row( self, row_idx, entries_count ):
-        """ Logs progress and updates status-db.
-            Called by build_holdings_dct() """
-        tn_prcnt = int( entries_count * .1 )  # ten percent
-        if row_idx % tn_prcnt == 0:  # uses modulo
-            prcnt_done = row_idx / (tn_prcnt/10)
-            log.info( '%s percent done (on row %s of %s)' % (prcnt_done, row_idx+1, entries_count) )  # +1 for 0 index
-            self.tracker_updater.update_db_tracker( prcnt_done, entries_count )
-        elif row_idx == 0:
-            self.tracker_updater.update_db_tracker( 0, entries_count )
-        elif row_idx + 1 == entries_count:
-            self.tracker_updater.update_db_tracker( 100, entries_count )
+        ( holdings_dct, offset ) = self.restore_checkpoint( checkpoint ) if checkpoint else ( {}, 0 )
+        if utf8_maker is None:  # already-converted file; stream it without re-writing
+            utf8_maker = Utf8Maker( self.from_rapid_utf8_filepath, None )
+            lines = utf8_maker.stream_utf8_lines( write_copy=False, start=offset )
+        else:
+            lines = utf8_maker.stream_utf8_lines( write_copy=True )
+        log.debug( 'using source-filepath, ```{}```'.format(utf8_maker.from_rapid_filepath) )
+        csv_ref = csv.reader( self.line_filter.filter_lines(lines), dialect=csv.excel, delimiter=','.encode('utf-8') )
+        ( self.next_progress_bytes, self.logged_decile ) = ( 0, 0 )
+        return ( holdings_dct, csv_ref, utf8_maker )
+
+    def track_progress( self, bytes_read, bytes_total ):
+        """ Hands progress to the in-process reporter at each tenth-of-a-percent of bytes consumed; the reporter throttles db-writes.
+            Per row, this is one comparison. Also logs each ten-percent.
+            The 0 and 100 updates are made by build_holdings_dct().
+            Called by build_holdings_dct() and build_holdings_dct_parallel() """
+        if bytes_read < self.next_progress_bytes or bytes_total == 0:
+            return
+        permille_done = bytes_read * 1000 // bytes_total
+        if permille_done // 100 > self.logged_decile:
+            self.logged_decile = permille_done // 100
+            log.info( '%s percent done (%s of %s bytes)' % (self.logged_decile * 10, bytes_read, bytes_total) )
+        self.progress_reporter.report( bytes_read, bytes_total )
+        self.next_progress_bytes = ( (permille_done + 1) * bytes_total ) // 1000
+        return
+
+    def add_row_to_holdings_dct( self, holdings_dct, row ):
+        """ Adds a print row's data to the holdings dct; ignores other rows.
+            Called by build_holdings_dct() and build_shard_holdings_dct() """
+        if 'Print' not in row:
+            return holdings_dct
+        ( key, issn, title, location, building, callnumber, year ) = self.process_file_row( row )
+        return self.update_holdings_dct( holdings_dct, key, issn, title, location, building, callnumber, year )
+
+    def build_holdings_dct_parallel( self, workers, checkpoint=None ):
+        """ Parses newline-aligned byte-ranges of the utf8-file in a pool of processes, then merges the partial holdings dcts.
+            Shards are merged in file order, so the first-seen row still supplies a key's title/url, and the result matches build_holdings_dct().
+            With a checkpoint, only the bytes after its offset are sharded, and merged into its holdings.
+            Called by RapidFileProcessor.parse_file_from_rapid() """
+        log.debug( 'starting build_holdings_dct_parallel() with `%s` workers' % workers )
+        ( holdings_dct, offset ) = self.restore_checkpoint( checkpoint ) if checkpoint else ( {}, 0 )
+        bytes_total = os.path.getsize( self.from_rapid_utf8_filepath )
+        shards = self.make_shards( bytes_total, workers * 4, offset )  # extra shards even out slow ones
+        ( bytes_done, self.next_progress_bytes, self.logged_decile ) = ( offset, 0, 0 )
+        self.tracker_updater.update_db_tracker( 0, bytes_total )
+        self.progress_reporter.start()
+        self.run_recorder.source_bytes = bytes_total
+        with self.run_recorder.stage( 'parse' ) as stage:
+            pool = multiprocessing.Pool( workers, initializer=init_shard_worker, initargs=(self.from_rapid_utf8_filepath, self.locations_resolver.building_table) )
+            try:
+                for ( ( start, end ), ( partial_dct, pending_titles, non_matches, filter_counts, cache_counts ) ) in itertools.izip( shards, pool.imap(build_shard, shards) ):  # imap keeps shard order
+                    holdings_dct = self.merge_holdings_dcts( holdings_dct, partial_dct )
+                    self.title_maker.pending_titles.update( pending_titles )
+                    self.title_maker.non_matches.update( non_matches )
+                    self.line_filter.add_counts( filter_counts )
+                    self.title_maker.title_cache.add_counts( cache_counts )
+                    bytes_done += end - start
+                    self.track_progress( bytes_done, bytes_total )
+                    if self.checkpointer and self.checkpointer.is_due( self.line_filter.lines_kept ):
+                        self.save_checkpoint( end, holdings_dct )
+            finally:
+                pool.close()
+                pool.join()
+            ( stage['rows_in'], stage['rows_out'] ) = ( self.line_filter.lines_seen, len(holdings_dct) )
+        holdings_dct = self.apply_solr_titles( holdings_dct )
+        self.tracker_updater.update_db_tracker( 100, bytes_total )
+        self.line_filter.log_counts()
+        self.title_maker.title_cache.log_counts()
+        log.info( 'non-matched unicode titles, ```{}```'.format(pprint.pformat(self.title_maker.non_matches)) )
+        log.debug( 'len(holdings_dct), `{}`'.format(len(holdings_dct)) )
+        return holdings_dct
+
+    def apply_solr_titles( self, holdings_dct ):
+        """ Resolves the titles deferred during the parse in a few batched solr queries, then updates the affected holdings' title and url.
+            As with an immediate lookup, only holdings whose first-seen title was non-ascii are changed.
+            Called by build_holdings_dct() and build_holdings_dct_parallel() """
+        with self.run_recorder.stage( 'title_enrichment', rows_in=len(self.title_maker.pending_titles) ) as stage:
+            resolved_titles = self.title_maker.resolve_pending_titles()
+            stage['rows_out'] = len( resolved_titles ) if resolved_titles else 0
+        if not resolved_titles:
+            return holdings_dct
+        for holding in holdings_dct.itervalues():
+            if holding.issn in resolved_titles and not self.title_maker.is_ascii( holding.title ):
+                holding.title = resolved_titles[ holding.issn ]
+                holding.url = self._build_url( holding.title )
+        return holdings_dct
+
+    def make_shards( self, bytes_total, shard_count, offset=0 ):
+        """ Returns [ (start, end), ... ] byte-ranges covering the utf8-file from `offset`, a line-start, each ending just after a newline.
+            Called by build_holdings_dct_parallel() """
+        boundaries = [ offset ]
+        with open( self.from_rapid_utf8_filepath, 'rb' ) as f:
+            for i in range( 1, shard_count ):
+                target = max( offset + ((bytes_total - offset) * i) // shard_count, boundaries[-1] )
+                f.seek( target )
+                if target > offset:
+                    f.readline()  # finishes the line straddling the target
+                boundaries.append( min(f.tell(), bytes_total) )
+        boundaries.append( bytes_total )
+        shards = [ (start, end) for (start, end) in zip(boundaries[:-1], boundaries[1:]) if end > start ]
+        log.debug( 'shards, ```{}```'.format(shards) )
+        return shards
+
+    def restore_checkpoint( self, checkpoint ):
+        """ Restores the checkpoint's counters and pending titles; returns ( holdings_dct, offset ).
+            Called by prep_holdings_dct_processing() and build_holdings_dct_parallel() """
+        self.line_filter.add_counts( checkpoint['filter_counts'] )
+        self.title_maker.pending_titles.update( checkpoint['pending_titles'] )
+        self.title_maker.non_matches.update( checkpoint['non_matches'] )
+        self.title_maker.title_cache.add_counts( checkpoint['cache_counts'] )
+        self.saved_offset = checkpoint['offset']
+        return ( checkpoint['holdings_dct'], checkpoint['offset'] )
+
+    def save_checkpoint( self, offset, holdings_dct ):
+        """ Checkpoints the parse up to the utf8-file `offset`, unless there's no checkpointer or nothing new since the last save.
+            Called by build_holdings_dct() and build_holdings_dct_parallel() """
+        if self.checkpointer is None or offset == self.saved_offset:
+            return
+        self.checkpointer.save( {
+            'offset': offset, 'holdings_dct': holdings_dct, 'pending_titles': self.title_maker.pending_titles, 'non_matches': self.title_maker.non_matches,
+            'filter_counts': self.line_filter.get_counts(), 'cache_counts': self.title_maker.title_cache.get_counts() }, self.line_filter.lines_kept )
+        self.saved_offset = offset
         return
 
+    def build_shard_holdings_dct( self, start, end ):
+        """ Builds a partial holdings dct from the rows in the byte-range.
+            Called by build_shard() in a pool-worker. """
+        holdings_dct = {}
+        csv_ref = csv.reader( self.line_filter.filter_lines(self._iter_shard_lines(start, end)), dialect=csv.excel, delimiter=','.encode('utf-8') )
+        for row in csv_ref:
+            holdings_dct = self.add_row_to_holdings_dct( holdings_dct, row )
+        return holdings_dct
+
+    def _iter_shard_lines( self, start, end ):
+        """ Yields the lines of the utf8-file from start up to end.
+            Called by build_shard_holdings_dct() """
+        with open( self.from_rapid_utf8_filepath, 'rb' ) as f:
+            f.seek( start )
+            position = start
+            while position < end:
+                line = f.readline()
+                if not line:
+                    break
+                position += len( line )
+                yield line
+
+    def merge_holdings_dcts( self, holdings_dct, partial_dct ):
+        """ Folds a later shard's holdings into the running dct, unioning years per key.
+            Mirrors update_holdings_dct(): the first entry's data wins.
+            Called by build_holdings_dct_parallel() """
+        for ( key, partial_holding ) in partial_dct.iteritems():
+            holding = holdings_dct.get( key )
+            if holding is None:
+                holdings_dct[key] = partial_holding
+            else:
+                holding.merge_years( partial_holding )
+        return holdings_dct
+
     def process_file_row( self, row ):
         """ Fixes row if necessary and builds elements.
             Called by build_holdings_dct() """
@@ -305,7 +471,7 @@ class HoldingsDctBuilder( object ):
             Called by _process_file_row() """
         callnumber = row[self.defs_dct['callnumber']]
         issn = row[self.defs_dct['issn_num']]
-        title = self.title_maker.build_title( issn, row[self.defs_dct['title']] )
+        title = self.title_maker.build_title( issn, row[self.defs_dct['title']], defer_solr=True )  # solr lookups are batched by apply_solr_titles()
         location = row[self.defs_dct['location']]
         building = self._make_building( location )
         year = row[self.defs_dct['year']]
@@ -317,32 +483,16 @@ class HoldingsDctBuilder( object ):
     def _make_building( self, location ):
         """ Adds building-location.
             Called by _build_holdings_elements() """
-        building = None
-        try:
-            building = self.locations_dct['result']['items'][location]['building']
-        except KeyError:
-            if location.startswith('r'):
-                building = 'Rock'
-            elif location.startswith('h'):
-                building = 'Hay'
-            elif location.startswith('q'):
-                building = 'Annex'
-            else:
-                log.warning( 'location code {} not recognized'.format(location) )
-                building = location
-        return building
+        return self.locations_resolver.resolve( location )
 
     def update_holdings_dct( self, holdings, key, issn, title, location, building, callnumber, year ):
-        """ Updates holdings dct.
-            Called by: build_holdings_dct() """
-        if key not in holdings.keys():
-            holdings[key] = {
-                'issn': issn, 'title': title, 'url': self._build_url(title), 'location': location, 'building': building, 'call_number': callnumber, 'years': [year] }
-        else:
-            if year and year not in holdings[key]['years']:
-                holdings[key]['years'].append( year )
-                holdings[key]['years'].sort()
-        # log.debug( 'holdings, ```%s```' % pprint.pformat(holdings) )
+        """ Updates holdings dct; the first row for a key supplies its HoldingRecord's data, later rows only add years.
+            Called by: add_row_to_holdings_dct() """
+        holding = holdings.get( key )
+        if holding is None:
+            holding = HoldingRecord( issn, title, self._build_url(title), location, building, callnumber )
+            holdings[key] = holding
+        holding.add_year( year )
         return holdings
 
     def _build_url( self, title ):
@@ -374,34 +524,167 @@ class HoldingsDctBuilder( object ):
     # end class HoldingsDctBuilder
 
 
+class HoldingRecord( object ):
+    """ Compact aggregate for one holdings-key.
+        Years are kept as an integer bitset relative to the earliest year seen, so adding a year is O(1) and ranges are computed once at the end.
+        Non-django class. """
+
+    __slots__ = ( 'issn', 'title', 'url', 'location', 'building', 'call_number', 'base_year', 'year_bits' )
+
+    def __init__( self, issn, title, url, location, building, call_number ):
+        ( self.issn, self.title, self.url ) = ( issn, title, url )
+        ( self.location, self.building, self.call_number ) = ( location, building, call_number )
+        ( self.base_year, self.year_bits ) = ( 0, 0 )
+
+    def add_year( self, year ):
+        """ Sets the bit for a year-string; blank or non-numeric years are ignored.
+            Called by HoldingsDctBuilder.update_holdings_dct() """
+        if not year or not year.isdigit():
+            if year:
+                log.warning( 'ignoring year, `{year}` for issn, `{issn}`'.format(year=year, issn=self.issn) )
+            return
+        self._set_year( int(year) )
+        return
+
+    def _set_year( self, year ):
+        """ Sets the bit for an int year, re-basing the bitset when an earlier year arrives.
+            Called by add_year() and merge_years() """
+        if not self.year_bits:
+            ( self.base_year, self.year_bits ) = ( year, 1 )
+        elif year < self.base_year:
+            ( self.year_bits, self.base_year ) = ( (self.year_bits << (self.base_year - year)) | 1, year )
+        else:
+            self.year_bits |= 1 << ( year - self.base_year )
+        return
+
+    def merge_years( self, other ):
+        """ Unions another record's years into this one.
+            Called by HoldingsDctBuilder.merge_holdings_dcts() """
+        if not other.year_bits:
+            return
+        self._set_year( other.base_year )  # re-bases if needed
+        self.year_bits |= other.year_bits << ( other.base_year - self.base_year )
+        return
+
+    def years( self ):
+        """ Returns sorted int years.
+            Called by year_ranges() and to_dct() """
+        ( bits, year, years ) = ( self.year_bits, self.base_year, [] )
+        while bits:
+            if bits & 1:
+                years.append( year )
+            ( bits, year ) = ( bits >> 1, year + 1 )
+        return years
+
+    def year_ranges( self ):
+        """ Returns contiguous ( start, end ) int ranges.
+            Eg: years 1926, 1927, 1929 -> [ (1926, 1927), (1929, 1929) ]
+            Called by RapidFileProcessor._update_holdings_lst() """
+        ranges = []
+        for year in self.years():
+            if ranges and ranges[-1][1] == year - 1:
+                ranges[-1] = ( ranges[-1][0], year )
+            else:
+                ranges.append( (year, year) )
+        return ranges
+
+    def to_dct( self ):
+        """ Returns the plain-dct form, with sorted year-strings.
+            Called by __repr__() """
+        return {
+            'issn': self.issn, 'title': self.title, 'url': self.url, 'location': self.location, 'building': self.building,
+            'call_number': self.call_number, 'years': [ unicode(year) for year in self.years() ] }
+
+    @classmethod
+    def from_dct( cls, dct ):
+        """ Builds a record from the plain-dct form.
+            Called by RapidFileProcessor.build_holdings_lst() """
+        holding = cls( dct['issn'], dct['title'], dct['url'], dct['location'], dct['building'], dct['call_number'] )
+        for year in dct['years']:
+            holding.add_year( year )
+        return holding
+
+    def __getstate__( self ):
+        return tuple( getattr(self, slot) for slot in self.__slots__ )
+
+    def __setstate__( self, state ):
+        for ( slot, value ) in zip( self.__slots__, state ):
+            setattr( self, slot, value )
+
+    def __eq__( self, other ):
+        return isinstance( other, HoldingRecord ) and self.__getstate__() == other.__getstate__()
+
+    def __ne__( self, other ):
+        return not self.__eq__( other )
+
+    def __repr__( self ):
+        return 'HoldingRecord(%r)' % self.to_dct()
+
+    # end class HoldingRecord
+
+
+## multiprocessing pool-workers; module-level so they can be pickled by name ##
+
+shard_builder = None  # set per worker-process by init_shard_worker()
+
+
+def init_shard_worker( from_rapid_utf8_filepath, building_table ):
+    """ Builds the worker-process's HoldingsDctBuilder once, reusing the parent's compiled locations table.
+        Called by multiprocessing.Pool() on worker startup. """
+    global shard_builder
+    shard_builder = HoldingsDctBuilder( from_rapid_utf8_filepath, building_table=building_table )
+    return
+
+
+def build_shard( shard ):
+    """ Returns ( partial_holdings_dct, pending_titles, non_matches, filter_counts, cache_counts ) for a ( start, end ) byte-range.
+        Solr lookups are left pending; the parent resolves them all in batches after the merge.
+        Called by HoldingsDctBuilder.build_holdings_dct_parallel() via Pool.imap() """
+    ( start, end ) = shard
+    title_maker = shard_builder.title_maker
+    ( title_maker.pending_titles, title_maker.non_matches ) = ( {}, {} )
+    ( title_maker.title_cache.hits, title_maker.title_cache.misses, title_maker.title_cache.negative_hits ) = ( 0, 0, 0 )
+    shard_builder.line_filter = PrintLineFilter()
+    partial_dct = shard_builder.build_shard_holdings_dct( start, end )
+    return ( partial_dct, title_maker.pending_titles, title_maker.non_matches, shard_builder.line_filter.get_counts(), title_maker.title_cache.get_counts() )
+
+
 class TitleMaker( object ):
     """ Tries to reliably get a unicode-friendly title from issn.
         Main controller: build_title() """
 
-    def __init__( self ):
-        self.good_titles_dct = {}  # updated by build_title()
-        self.initialize_good_titles_dct()
+    def __init__( self, title_cache=None, heartbeat=None ):
+        self.title_cache = title_cache if title_cache else TitleCache()  # persistent; replaces loading the whole issn json file each run
+        self.heartbeat = heartbeat if heartbeat else Heartbeat()  # stamped as solr batches finish
+        self.good_titles_dct = {}  # in-memory memo of matches; updated by check_dct() and solr lookups
+        self.negative_issns = set()  # in-memory memo of cached solr-misses
         self.non_matches = {}
+        self.pending_titles = {}  # { issn: raw-title } awaiting a batched solr lookup
+        ( self.solr_batch_size, self.solr_concurrency ) = ( settings_app.SOLR_BATCH_SIZE, settings_app.SOLR_CONCURRENCY )
 
-    def initialize_good_titles_dct( self ):
-        """ Loads json.
-            Called by __init__() """
-        with open( settings_app.ISSN_JSON_PATH, 'r' ) as f:
-            self.good_titles_dct = json.loads( f.read() )
-        log.debug( 'len(self.good_titles_dct.keys()), `{}`'.format(len(self.good_titles_dct.keys())) )
-        return
-
-    def build_title( self, issn, title ):
-        """ Checks issn against built-dct or hits blacklight-solr.
+    def build_title( self, issn, title, defer_solr=False ):
+        """ Checks issn against built-dct and title-cache, or hits blacklight-solr.
+            With defer_solr, a miss returns the raw title and queues the issn for resolve_pending_titles().
             Called by HoldingsDctBuilder._build_holdings_elements() """
         if self.is_ascii( title ):
             return title
+        if issn in self.pending_titles:  # already queued; skip the cache
+            self.pending_titles[ issn ] = title
+            return title
         ( found_title, dct_check ) = self.check_dct( issn )
         if dct_check:
             return found_title
+        if issn in self.negative_issns:  # solr recently had nothing
+            self.non_matches[ issn ] = title
+            return title
+        if defer_solr:
+            self.pending_titles[ issn ] = title
+            return title
         ( found_title, solr_check ) = self.check_solr( issn )
         if solr_check:
             return found_title
+        self.title_cache.store_negatives( [issn] )
+        self.negative_issns.add( issn )
         self.non_matches[ issn ] = title  # for later logging
         return title
 
@@ -416,13 +699,20 @@ class TitleMaker( object ):
             return None
 
     def check_dct( self, issn ):
-        """ Sees if a match has already been found.
+        """ Sees if a match has already been found, in memory or in the title-cache; notes cached solr-misses in negative_issns.
             Called by build_title() """
         ( title, dct_check ) = ( None, False )
-        if issn in self.good_titles_dct.keys():
-            title = self.good_titles_dct[ issn ]
-            dct_check = True
+        if issn in self.good_titles_dct:
+            ( title, dct_check ) = ( self.good_titles_dct[issn], True )
             log.debug( 'found in dct' )
+        elif issn not in self.negative_issns:
+            ( status, cached_title ) = self.title_cache.lookup( issn )
+            if status == 'hit':
+                ( title, dct_check ) = ( cached_title, True )
+                self.good_titles_dct[ issn ] = cached_title
+                log.debug( 'found in title-cache' )
+            elif status == 'negative':
+                self.negative_issns.add( issn )
         return ( title, dct_check )
 
     def check_solr( self, issn ):
@@ -445,12 +735,93 @@ class TitleMaker( object ):
             title = dct['response']['docs'][0]['title_display']
             solr_check = True
             self.good_titles_dct[issn] = title
+            self.title_cache.store_titles( {issn: title} )
             log.info( 'adding to dct, and returning, title, ```{}```'.format(title) )
         except Exception as e:
             log.debug( 'e, ```{}```'.format(unicode(repr(e))) )
             log.debug( 'no `title_display` found' )
         return ( title, solr_check )
 
+    def resolve_pending_titles( self ):
+        """ Looks up all pending issns with multi-valued solr queries, run in batches over a pooled session with bounded concurrency.
+            Returns { issn: title } for the matches; unmatched issns go to non_matches. The job's heartbeat is stamped as batches finish.
+            Called by HoldingsDctBuilder.apply_solr_titles() """
+        issns = sorted( self.pending_titles )
+        if not issns:
+            return {}
+        batches = [ issns[i:i+self.solr_batch_size] for i in range(0, len(issns), self.solr_batch_size) ]
+        session = self._make_solr_session()
+        pool = ThreadPool( min(self.solr_concurrency, len(batches)) )
+        try:
+            batch_results = []
+            for batch_result in pool.imap( lambda batch: self.query_solr_batch(session, batch), batches ):
+                batch_results.append( batch_result )
+                self.heartbeat.beat()
+        finally:
+            pool.close()
+            pool.join()
+            session.close()
+        ( resolved_titles, failed_issns ) = ( {}, set() )
+        for ( batch, batch_result ) in zip( batches, batch_results ):
+            if batch_result is None:  # request failed; don't cache these as misses
+                failed_issns.update( batch )
+            else:
+                resolved_titles.update( batch_result )
+        self.good_titles_dct.update( resolved_titles )
+        self.title_cache.store_titles( resolved_titles )
+        unmatched_issns = [ issn for issn in issns if issn not in resolved_titles ]
+        self.title_cache.store_negatives( [issn for issn in unmatched_issns if issn not in failed_issns] )
+        for issn in unmatched_issns:
+            self.non_matches[ issn ] = self.pending_titles[ issn ]  # for later logging
+        log.info( 'solr title lookups; issns, `{issns}`; batches, `{batches}`; resolved, `{resolved}`'.format(issns=len(issns), batches=len(batches), resolved=len(resolved_titles)) )
+        self.pending_titles = {}
+        return resolved_titles
+
+    def _make_solr_session( self ):
+        """ Returns a requests session whose connection-pool fits the thread-pool.
+            Called by resolve_pending_titles() """
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter( pool_connections=1, pool_maxsize=self.solr_concurrency )
+        session.mount( 'http://', adapter )
+        session.mount( 'https://', adapter )
+        return session
+
+    def query_solr_batch( self, session, issns ):
+        """ Runs one `issn_t:("a" OR "b" ...)` query and maps docs back to the requested issns; first doc per issn wins, as in _parse_solr().
+            Issns crowded out of a truncated result fall back to check_solr(); returns None if the request fails.
+            Called by resolve_pending_titles() in a pool-thread. """
+        wanted = dict( (self._normalize_issn(issn), issn) for issn in issns )
+        params = {
+            'wt': 'json', 'rows': len(issns) * 10, 'fl': 'issn_t,title_display',
+            'fq': 'issn_t:({})'.format( ' OR '.join(['"%s"' % issn for issn in issns]) ) }
+        try:
+            r = session.get( settings_app.DISCOVERY_SOLR_URL, params=params, timeout=30 )
+            log.debug( 'url, ```{}```'.format(r.url) )
+            dct = r.json()
+        except Exception as e:
+            log.error( 'exception on solr batch-query, ```{}```'.format(unicode(repr(e))) )
+            return None
+        found = {}
+        for doc in dct['response']['docs']:
+            if 'title_display' not in doc:
+                continue
+            for doc_issn in doc.get( 'issn_t', [] ):
+                issn = wanted.get( self._normalize_issn(doc_issn) )
+                if issn and issn not in found:
+                    found[issn] = doc['title_display']
+        if dct['response']['numFound'] > len( dct['response']['docs'] ):
+            for issn in issns:
+                if issn not in found:
+                    ( title, solr_check ) = self.check_solr( issn )
+                    if solr_check:
+                        found[issn] = title
+        return found
+
+    def _normalize_issn( self, issn ):
+        """ Returns issn without hyphen, upper-cased, for matching solr values.
+            Called by query_solr_batch() """
+        return issn.replace( '-', '' ).strip().upper()
+
     # end class TitleMaker
 
 
@@ -458,15 +829,21 @@ class TrackerUpdater( object ):
     """ Manages updating of ProcessorTracker table.
         Main controller: update_db_tracker() """
 
+    def __init__( self, job_id=None ):
+        self.job_id = job_id  # None updates the latest tracker record
+
     def update_db_tracker( self, prcnt_done, entries_count ):
         """ Updates db processing tracker.
-            Called by track_row() """
-        tracker = ProcessorTracker.objects.all()[0]
+            Note: since the single-pass ingest, `entries_count` is the extract's size in bytes, so the `..._per_record` figures are per-byte.
+            Called by HoldingsDctBuilder.build_holdings_dct() and HoldingsDctBuilder.build_holdings_dct_parallel(), at 0 and 100 percent; ProgressReporter handles the ticks between """
+        tracker = ProcessorTracker.objects.get( pk=self.job_id ) if self.job_id else ProcessorTracker.objects.all()[0]  # newest first
         recent_processing_dct = json.loads( tracker.recent_processing ); log.debug( 'recent_processing_dct initially, ```{}```'.format(pprint.pformat(recent_processing_dct)) )
         ( start_timestamp, end_timestamp, recent_times_per_record, average_time_per_record ) = (
             tracker.processing_started, tracker.processing_ended, recent_processing_dct['recent_times_per_record'] , recent_processing_dct['average_time_per_record'] )  # existing info
         ( status, records_left, start_timestamp, end_timestamp, recent_times_per_record, average_time_per_record ) = self._check_percent_done(
             prcnt_done, entries_count, start_timestamp, end_timestamp, recent_times_per_record, average_time_per_record )  # updated info
+        if self.job_id and status == 'complete':
+            status = 'loading'  # parsing is done; JobQueue.run_job() marks the job complete after the db-load
         time_left = ( records_left * average_time_per_record ) / 60  # seconds-left / 60
         recent_processing_jsn = self._update_recent_processing(
             recent_processing_dct, prcnt_done, recent_times_per_record, time_left, average_time_per_record )
@@ -495,7 +872,7 @@ class TrackerUpdater( object ):
         f = float( time_taken_string )
         time_per_record = f / entries_count
         recent_times_per_record.append( time_per_record )
-        recent_times_per_record = recent_times_per_record [0:4]
+        recent_times_per_record = recent_times_per_record[-4:]  # newest four
         log.debug( 'recent_times_per_record, ```{}```'.format(recent_times_per_record) )
         return recent_times_per_record
 
@@ -517,6 +894,7 @@ class TrackerUpdater( object ):
         tracker.current_status = status
         tracker.processing_started = start_timestamp
         tracker.processing_ended = end_timestamp
+        tracker.heartbeat = datetime.datetime.now()
         tracker.save()
         log.debug( 'tracker updated' )
         return
@@ -524,6 +902,53 @@ class TrackerUpdater( object ):
     # end class TrackerUpdater()
 
 
+class PrintLineFilter( object ):
+    """ Drops non-print lines from raw utf8 bytes, before csv-parsing, decoding, and row-fixing.
+        Only a coarse pre-check; build_holdings_dct() still requires a `Print` field in the parsed row.
+        Non-django class. """
+
+    print_pattern = re.compile( b',"?Print"?,' )
+
+    def __init__( self ):
+        self.lines_seen = 0
+        self.lines_kept = 0
+        self.lines_skipped = 0
+
+    def filter_lines( self, lines ):
+        """ Yields only lines that could be print holdings; updates counters.
+            Called by HoldingsDctBuilder.prep_holdings_dct_processing() and HoldingsDctBuilder.build_shard_holdings_dct() """
+        search = self.print_pattern.search
+        for line in lines:
+            self.lines_seen += 1
+            if search( line ):
+                self.lines_kept += 1
+                yield line
+            else:
+                self.lines_skipped += 1
+
+    def get_counts( self ):
+        """ Returns ( seen, kept, skipped ).
+            Called by build_shard() and HoldingsDctBuilder.save_checkpoint() """
+        return ( self.lines_seen, self.lines_kept, self.lines_skipped )
+
+    def add_counts( self, counts ):
+        """ Adds a shard's, or a checkpoint's, counts to the totals.
+            Called by HoldingsDctBuilder.build_holdings_dct_parallel() and HoldingsDctBuilder.restore_checkpoint() """
+        ( seen, kept, skipped ) = counts
+        self.lines_seen += seen
+        self.lines_kept += kept
+        self.lines_skipped += skipped
+        return
+
+    def log_counts( self ):
+        """ Logs how much work the filter saved.
+            Called by HoldingsDctBuilder.build_holdings_dct() and HoldingsDctBuilder.build_holdings_dct_parallel() """
+        log.info( 'print-filter lines seen, `{seen}`; kept, `{kept}`; skipped, `{skipped}`'.format(seen=self.lines_seen, kept=self.lines_kept, skipped=self.lines_skipped) )
+        return
+
+    # end class PrintLineFilter
+
+
 class RowFixer( object ):
     """ Fixes non-escaped csv strings.
         Non-django class. """
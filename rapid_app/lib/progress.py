@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import datetime, json, logging, time
+from rapid_app import settings_app
+from rapid_app.lib.run_history import RunHistoryEstimator
+from rapid_app.models import ProcessorTracker
+
+log = logging.getLogger(__name__)
+
+
+class ProgressReporter( object ):
+    """ Keeps parse-progress in process, and writes it to the job's ProcessorTracker record at most every `flush_seconds`.
+        The tracker's recent-processing json and the run-history stage-rates are read once, at start(); flushes are single UPDATEs by primary-key.
+        Non-django class. """
+
+    def __init__( self, job_id=None, flush_seconds=None ):
+        self.job_id = job_id  # None reports to the latest tracker record
+        self.flush_seconds = flush_seconds if flush_seconds is not None else settings_app.PROGRESS_FLUSH_SECONDS
+        ( self.tracker_id, self.recent_processing_dct ) = ( None, None )
+        ( self.started, self.last_flush, self.prcnt_done ) = ( None, 0, 0 )
+        ( self.run_history_estimator, self.stage_rates, self.total ) = ( RunHistoryEstimator(), {}, 0 )
+
+    def start( self, fused_stages=() ):
+        """ Loads the tracker record and stage-rates once, and starts the clock.
+            `fused_stages` run inside this parse, as the serial ingest does, so their rates are added to the parse's.
+            Called by HoldingsDctBuilder.build_holdings_dct() and HoldingsDctBuilder.build_holdings_dct_parallel() """
+        tracker = ProcessorTracker.objects.get( pk=self.job_id ) if self.job_id else ProcessorTracker.objects.all()[0]  # newest first
+        ( self.tracker_id, self.recent_processing_dct ) = ( tracker.id, json.loads(tracker.recent_processing) )
+        ( self.started, self.last_flush, self.prcnt_done ) = ( time.time(), time.time(), 0 )
+        self.stage_rates = self.run_history_estimator.get_stage_rates()
+        for name in fused_stages:
+            if name in self.stage_rates and 'parse' in self.stage_rates:
+                self.stage_rates['parse'] += self.stage_rates.pop( name )
+        return
+
+    def report( self, done, total ):
+        """ Updates the in-process counters; flushes only if `flush_seconds` have passed.
+            Called by HoldingsDctBuilder.track_progress() """
+        if self.tracker_id is None or not total:
+            return
+        ( self.prcnt_done, self.total ) = ( round( done * 100.0 / total, 1 ), total )
+        now = time.time()
+        if now - self.last_flush >= self.flush_seconds:
+            self.flush( now )
+        return
+
+    def flush( self, now ):
+        """ Writes percent-done and minutes-left to the tracker.
+            Minutes-left covers the rest of the parse and the later stages, from recent runs' throughput; with no run-history, it extrapolates this run's own parse-rate.
+            Called by report() """
+        seconds_left = self.run_history_estimator.estimate_seconds_left( self.stage_rates, 'parse', self.prcnt_done / 100.0, self.total )
+        if seconds_left is None and self.prcnt_done:
+            seconds_left = ( now - self.started ) * ( 100 - self.prcnt_done ) / self.prcnt_done
+        time_left = 'N/A' if seconds_left is None else round( seconds_left / 60, 1 )
+        self.recent_processing_dct.update( {'percent_done': self.prcnt_done, 'time_left': time_left} )
+        ProcessorTracker.objects.filter( pk=self.tracker_id ).update(
+            current_status='in_process', recent_processing=json.dumps(self.recent_processing_dct), heartbeat=datetime.datetime.now() )
+        self.last_flush = now
+        log.debug( 'flushed progress; percent_done, `{prcnt}`; time_left, `{left}`'.format(prcnt=self.prcnt_done, left=time_left) )
+        return
+
+    # end class ProgressReporter
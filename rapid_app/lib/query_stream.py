@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import logging
+from django.db import connection
+
+log = logging.getLogger(__name__)
+
+
+class QueryStreamer( object ):
+    """ Streams a values_list() queryset, or sql, through a cursor that doesn't read the whole result on execute.
+        On mysql that's the driver's unbuffered SSCursor, where django's `.iterator()` gets a buffered one; sqlite steps through results as rows are fetched.
+        An SSCursor's connection can run nothing else until its result is read off, so `separate_connection` streams on a second mysql connection, leaving django's free for writes made inside the loop.
+        Non-django class. """
+
+    fetch_size = 1000  # rows per fetchmany()
+
+    def iter_queryset( self, queryset, separate_connection=False ):
+        """ Yields the values_list() queryset's row-tuples; its sql is run as compiled, so the values aren't passed through django's field-converters.
+            Called by ss_builder.SSBuilder and viewhelper_download.DownloadHelper """
+        ( sql, params ) = queryset.query.sql_with_params()
+        return self.iter_sql( sql, params, separate_connection )
+
+    def iter_sql( self, sql, params=None, separate_connection=False ):
+        """ Yields row-tuples, fetching `fetch_size` at a time.
+            Called by iter_queryset() and titles_diff.TitlesMergeDiffer.iter_dev_rows() """
+        db_connection = connection.copy() if ( separate_connection and connection.vendor == 'mysql' ) else connection
+        cursor = self.make_cursor( db_connection )
+        try:
+            cursor.execute( sql, params )
+            while True:
+                rows = cursor.fetchmany( self.fetch_size )
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            cursor.close()  # an SSCursor reads off any unfetched rows first
+            if db_connection is not connection:
+                db_connection.close()
+
+    def make_cursor( self, db_connection ):
+        """ Returns an unbuffered SSCursor on mysql; otherwise django's cursor.
+            Called by iter_sql() """
+        if db_connection.vendor == 'mysql':
+            db_connection.ensure_connection()
+            return db_connection.connection.cursor( db_connection.Database.cursors.SSCursor )
+        return db_connection.cursor()
+
+    # end class QueryStreamer
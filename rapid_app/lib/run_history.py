@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import contextlib, datetime, json, logging, resource, time
+from rapid_app import settings_app
+from rapid_app.lib.heartbeat import Heartbeat
+from rapid_app.models import RunHistory
+
+log = logging.getLogger(__name__)
+
+
+STAGES = [ 'ingest', 'parse', 'title_enrichment', 'aggregation', 'db_load' ]  # pipeline order
+
+
+class RunRecorder( object ):
+    """ Times each stage of one processing run, with rows in and out and peak memory, and saves a RunHistory record.
+        Each stage's start and end also stamps the job's heartbeat; `heartbeat` is shared with the solr and db-load loops.
+        Non-django class. """
+
+    def __init__( self, job_id=None ):
+        self.job_id = job_id
+        ( self.started, self.source_bytes, self.stages ) = ( datetime.datetime.now(), 0, {} )
+        self.heartbeat = Heartbeat( job_id )
+
+    @contextlib.contextmanager
+    def stage( self, name, rows_in=None ):
+        """ Times the wrapped block; the block may set `rows_in` and `rows_out` on the yielded dct.
+            A block that raises is still recorded, marked `failed`, and the exception goes on up.
+            Called by RapidFileProcessor.parse_file_from_rapid() and HoldingsDctBuilder """
+        stage_dct = { 'rows_in': rows_in, 'rows_out': None, 'failed': False }
+        start = time.time()
+        self.heartbeat.beat( force=True )
+        try:
+            yield stage_dct
+            self.heartbeat.beat( force=True )
+        except Exception:
+            stage_dct['failed'] = True
+            raise
+        finally:
+            stage_dct.update( {'seconds': round(time.time() - start, 3), 'peak_memory_kb': self.get_peak_memory_kb()} )
+            self.stages[ name ] = stage_dct
+            log.debug( 'stage `{name}` done, ```{stage}```'.format(name=name, stage=stage_dct) )
+
+    def record_fused_stage( self, name, seconds, within ):
+        """ Records `seconds` of work interleaved with the recorded stage `within` as stage `name`, taking them off `within`'s seconds.
+            The serial parse validates and writes the utf8-copy as it reads, so its `ingest` can't be timed as a block; splitting it out keeps each stage's rate comparable across paths.
+            Called by HoldingsDctBuilder.build_holdings_dct() """
+        within_dct = self.stages[ within ]
+        seconds = round( seconds, 3 )
+        within_dct['seconds'] = round( within_dct['seconds'] - seconds, 3 )
+        self.stages[ name ] = { 'rows_in': None, 'rows_out': None, 'failed': within_dct['failed'], 'seconds': seconds, 'peak_memory_kb': within_dct['peak_memory_kb'] }
+        log.debug( 'stage `{name}` done, ```{stage}```'.format(name=name, stage=self.stages[name]) )
+        return
+
+    def get_peak_memory_kb( self ):
+        """ Returns the high-water resident-memory so far, of this process or of any finished shard-worker; kilobytes on linux.
+            The figure never drops, so a stage's value is the peak reached by the end of that stage.
+            Called by stage() """
+        return max( resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss )
+
+    def save( self, status ):
+        """ Saves the run; returns the record.
+            Called by RapidFileProcessor.parse_file_from_rapid() """
+        self.heartbeat.close()
+        ended = datetime.datetime.now()
+        run = RunHistory(
+            job_id=self.job_id, started=self.started, ended=ended, status=status, source_bytes=self.source_bytes,
+            total_seconds=round( (ended - self.started).total_seconds(), 3 ), stages=json.dumps(self.stages, sort_keys=True) )
+        run.save()
+        log.info( 'saved run-history `{id}`; status, `{status}`; total_seconds, `{seconds}`'.format(id=run.id, status=status, seconds=run.total_seconds) )
+        return run
+
+    # end class RunRecorder
+
+
+class RunHistoryEstimator( object ):
+    """ Estimates time-left from per-stage throughput of recent complete runs, weighting newer runs more; also builds the run-trend.
+        Non-django class. """
+
+    decay = 0.5  # each older run counts half as much as the next-newer one
+
+    def __init__( self, run_count=None ):
+        self.run_count = run_count if run_count else settings_app.RUN_HISTORY_TREND_COUNT
+
+    def get_stage_rates( self ):
+        """ Returns { stage: seconds-per-source-byte }, recency-weighted, for stages with history.
+            Throughput is per source-byte for every stage, so one run's rates can be applied to a differently-sized extract.
+            Called by ProgressReporter.start() """
+        ( weighted_rates, weights ) = ( {}, {} )
+        runs = RunHistory.objects.filter( status='complete', source_bytes__gt=0 )[0:self.run_count]  # newest first
+        for ( i, run ) in enumerate( runs ):
+            weight = self.decay ** i
+            for ( name, stage_dct ) in json.loads( run.stages ).items():
+                weighted_rates[ name ] = weighted_rates.get( name, 0.0 ) + weight * stage_dct['seconds'] / run.source_bytes
+                weights[ name ] = weights.get( name, 0.0 ) + weight
+        return dict( (name, weighted_rates[name] / weights[name]) for name in weighted_rates )
+
+    def estimate_seconds_left( self, stage_rates, stage, fraction_done, source_bytes ):
+        """ Returns seconds-left for the rest of `stage` plus all later stages, or None if `stage` has no history.
+            Called by ProgressReporter.flush() """
+        if stage not in stage_rates:
+            return None
+        seconds_left = stage_rates[ stage ] * source_bytes * ( 1 - fraction_done )
+        for later_stage in STAGES[ STAGES.index(stage) + 1: ]:
+            seconds_left += stage_rates.get( later_stage, 0.0 ) * source_bytes
+        return seconds_left
+
+    def make_trend( self ):
+        """ Returns summaries of recent runs, newest first, for display.
+            Called by viewhelper_tasks.TasksHelper """
+        trend = []
+        for run in RunHistory.objects.all()[0:self.run_count]:
+            stages = json.loads( run.stages )
+            trend.append( {
+                'id': run.id, 'started': '`{}`'.format( run.started ), 'status': run.status, 'source_mb': round( run.source_bytes / 1048576.0, 2 ),
+                'total_seconds': run.total_seconds,
+                'stage_seconds': dict( (name, stages[name]['seconds']) for name in STAGES if name in stages ),
+                'rows_out': dict( (name, stages[name]['rows_out']) for name in STAGES if name in stages ),
+                'peak_memory_mb': round( max([stage_dct['peak_memory_kb'] for stage_dct in stages.values()] or [0]) / 1024.0, 1 ),
+                } )
+        return trend
+
+    # end class RunHistoryEstimator
@@ -2,8 +2,16 @@
 
 from __future__ import unicode_literals
 
-import logging, pprint
+import json, logging, os, tempfile
 import unicodecsv as csv
+from django.db import connection, transaction
+from django.db.models import CharField, F, Func, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Concat
+from rapid_app import settings_app
+from rapid_app.lib.fingerprint import Fingerprinter
+from rapid_app.lib.query_stream import QueryStreamer
+from rapid_app.models import PrintTitleDev, SSExportGeneration, SSExportRow
 
 log = logging.getLogger(__name__)
 
@@ -12,12 +20,169 @@ class SSBuilder( object ):
     """ Builds file for serials-solutions.
         Main worker function: build_row() """
 
+    batch_size = 500  # SSExportRow writes and deleted-row reads
+    title_fields = [ 'key', 'issn', 'start', 'end', 'building', 'call_number', 'title', 'url' ]  # values read per title
+
     def __init__(self ):
         self.row_dct = {}
+        self.fingerprinter = Fingerprinter()
+        self.query_streamer = QueryStreamer()
+
+    def export( self, path, delta_path=None, mode=None, force_full=False ):
+        """ Streams PrintTitleDev rows, in final order, comparing each row's fingerprint with the last export's.
+            Writes the full file (mode `both`, the first export, or `force_full`) and a delta file of new, changed, and deleted rows.
+            When nothing changed, and the full file isn't forced, nothing is written and None is returned; otherwise returns the new SSExportGeneration.
+            The files are renamed into place inside the generation's transaction, so a failed rename leaves the previous generation as the latest.
+            Each title's previous fingerprint is read in the same query as the title, and deleted rows in key-ordered pages, so memory use doesn't grow with the titles.
+            Called by views.create_ss_file() """
+        ( delta_path, mode ) = ( delta_path if delta_path else self.make_delta_path(path), mode if mode else settings_app.SS_EXPORT_MODE )
+        has_previous = SSExportGeneration.objects.exists()
+        full_file = AtomicCsvFile( path ) if ( mode == 'both' or force_full or not has_previous ) else None
+        delta_file = AtomicCsvFile( delta_path ) if has_previous else None  # a first export's delta would just repeat the full file
+        try:
+            with transaction.atomic():
+                generation = SSExportGeneration.objects.create( wrote_full_file=bool(full_file), wrote_delta_file=bool(delta_file) )
+                self.write_generation( generation, full_file, delta_file )
+                skip = not ( generation.new_count or generation.changed_count or generation.deleted_count or force_full )
+                if skip:
+                    transaction.set_rollback( True )  # leaves the previous generation as the latest
+                else:
+                    self.close_files( [full_file, delta_file], keep=True )
+        except Exception:
+            self.close_files( [full_file, delta_file], keep=False )
+            raise
+        if skip:
+            self.close_files( [full_file, delta_file], keep=False )
+            log.info( 'no title changes since the last export; nothing written' )
+            return None
+        log.info( 'export generation `{id}`; rows, `{rows}`; new, `{new}`; changed, `{changed}`; deleted, `{deleted}`; full-file, `{full}`; delta-file, `{delta}`'.format(
+            id=generation.id, rows=generation.row_count, new=generation.new_count, changed=generation.changed_count, deleted=generation.deleted_count,
+            full=generation.wrote_full_file, delta=generation.wrote_delta_file) )
+        return generation
+
+    def make_delta_path( self, path ):
+        """ Returns the configured delta-filepath, or else one beside the full file, `<name>_delta<ext>`.
+            Called by export() """
+        if settings_app.SS_DELTA_FILEPATH:
+            return unicode( settings_app.SS_DELTA_FILEPATH )
+        return '%s_delta%s' % os.path.splitext( path )
+
+    def close_files( self, output_files, keep ):
+        """ Commits, or discards, each open AtomicCsvFile.
+            Called by export() """
+        for output_file in output_files:
+            if output_file and keep:
+                output_file.commit()
+            elif output_file:
+                output_file.discard()
+        return
+
+    def write_generation( self, generation, full_file, delta_file ):
+        """ Writes rows to the open files, records new and changed rows' fingerprints in batches, then handles keys no longer present.
+            Sets the generation's counts and saves it.
+            Called by export() """
+        ( new_rows, changed_rows, counts ) = ( [], [], {'new': 0, 'changed': 0, 'rows': 0} )
+        for ( key, row, previous_fingerprint ) in self.iter_export_rows():
+            counts['rows'] += 1
+            if full_file:
+                full_file.writerow( row )
+            fingerprint = self.fingerprinter.make_fingerprint( row )
+            if previous_fingerprint == fingerprint:
+                continue
+            action = 'new' if previous_fingerprint is None else 'changed'
+            counts[action] += 1
+            if delta_file:
+                delta_file.writerow( [action] + row )
+            if action == 'new':
+                new_rows.append( SSExportRow(key=key, fingerprint=fingerprint, row=json.dumps(row), generation=generation) )
+                if len( new_rows ) == self.batch_size:
+                    SSExportRow.objects.bulk_create( new_rows )
+                    new_rows = []
+            else:
+                changed_rows.append( [fingerprint, json.dumps(row), generation.id, key] )
+                if len( changed_rows ) == self.batch_size:
+                    self.update_changed_rows( changed_rows )
+                    changed_rows = []
+        SSExportRow.objects.bulk_create( new_rows )
+        self.update_changed_rows( changed_rows )
+        deleted_count = self.remove_deleted_rows( delta_file )
+        ( generation.row_count, generation.new_count, generation.changed_count, generation.deleted_count ) = ( counts['rows'], counts['new'], counts['changed'], deleted_count )
+        generation.save()
+        return
+
+    def update_changed_rows( self, changed_rows ):
+        """ Rewrites a batch of [ fingerprint, row-json, generation-id, key ] SSExportRow entries with one executemany UPDATE.
+            Called by write_generation() """
+        if not changed_rows:
+            return
+        qn = connection.ops.quote_name
+        sql = 'UPDATE {table} SET {fingerprint} = %s, {row} = %s, {generation} = %s WHERE {key} = %s'.format(
+            table=qn(SSExportRow._meta.db_table), fingerprint=qn('fingerprint'), row=qn('row'), generation=qn('generation_id'), key=qn('key') )
+        with connection.cursor() as cursor:
+            cursor.executemany( sql, changed_rows )
+        return
+
+    def remove_deleted_rows( self, delta_file ):
+        """ Writes rows whose title is gone, as last exported, to the delta, and forgets them; read in key-ordered pages, so memory holds one page.
+            Returns the count removed.
+            Called by write_generation() """
+        qn = connection.ops.quote_name
+        gone_rows = SSExportRow.objects.extra( where=['NOT EXISTS (SELECT 1 FROM {titles} WHERE {titles}.{key} = {rows}.{key})'.format(
+            titles=qn(PrintTitleDev._meta.db_table), rows=qn(SSExportRow._meta.db_table), key=qn('key'))] ).order_by( 'key' )
+        ( count, last_key ) = ( 0, None )
+        while True:
+            page = list( (gone_rows.filter(key__gt=last_key) if last_key is not None else gone_rows).values_list('key', 'row')[0:self.batch_size] )
+            if not page:
+                return count
+            if delta_file:
+                for ( key, row_jsn ) in page:
+                    delta_file.writerow( ['deleted'] + json.loads(row_jsn) )
+            SSExportRow.objects.filter( key__in=[key for (key, row_jsn) in page] ).delete()
+            ( count, last_key ) = ( count + len(page), page[-1][0] )
+
+    def iter_keyed_title_rows( self, titles=None ):
+        """ Yields ( key, built-row ) for PrintTitleDev entries, or the `titles` queryset's, ordered by the db and streamed by QueryStreamer.
+            Called by viewhelper_download.DownloadHelper """
+        titles = ( titles if titles is not None else PrintTitleDev.objects.all() ).order_by( *self.make_order_by() ).values_list( *self.title_fields )
+        for values in self.query_streamer.iter_queryset( titles ):
+            yield ( values[0], self.build_values_row(values) )
+
+    def iter_export_rows( self ):
+        """ Yields ( key, built-row, fingerprint as last exported or None ) for PrintTitleDev entries, ordered by the db.
+            The previous fingerprint is a primary-key lookup in the same query, rather than a dct of every exported key.
+            Streamed by QueryStreamer; on mysql on a second connection, since write_generation() writes as it reads.
+            Called by write_generation() """
+        qn = connection.ops.quote_name
+        previous_fingerprint = RawSQL( 'SELECT {fingerprint} FROM {rows} WHERE {rows}.{key} = {titles}.{key}'.format(
+            fingerprint=qn('fingerprint'), rows=qn(SSExportRow._meta.db_table), titles=qn(PrintTitleDev._meta.db_table), key=qn('key')), [], output_field=CharField() )
+        titles = PrintTitleDev.objects.annotate( previous_fingerprint=previous_fingerprint ).order_by( *self.make_order_by() ).values_list( *(self.title_fields + ['previous_fingerprint']) )
+        for values in self.query_streamer.iter_queryset( titles, separate_connection=True ):
+            yield ( values[0], self.build_values_row(values), values[-1] )
+
+    def build_values_row( self, values ):
+        """ Returns the built row for a `title_fields` values-tuple.
+            Called by iter_keyed_title_rows() and iter_export_rows() """
+        ( key, issn, start, end, building, call_number, title, url ) = values[0:len(self.title_fields)]
+        return self.build_row( {
+            'issn': issn, 'year_start': start, 'year_end': end, 'building': building, 'callnumber': call_number, 'title': title, 'url': url} )
+
+    def make_order_by( self ):
+        """ Returns order_by() expressions giving the order of a sorted list of build_row() rows; `type` and `display_location_note` are constant.
+            Each column is compared as the text written: `location` as `building - call_number`, and the years as strings, where a missing year is `None`,
+              so '1990' sorts before '999', and `None` after any year, rather than first as a NULL would.
+            mysql's default collation ignores case, so there each column is compared as BINARY, like python string-comparison.
+            Called by iter_keyed_title_rows() """
+        ( text, cast_type ) = ( CharField(), 'CHAR' if connection.vendor == 'mysql' else 'TEXT' )
+        as_text = lambda field: Coalesce(  # as '{}'.format() writes it
+            Func(F(field), template='CAST(%(expressions)s AS {})'.format(cast_type), output_field=text), Value('None'), output_field=text )
+        columns = [ F('title'), F('url'), Concat(as_text('building'), Value(' - '), as_text('call_number'), output_field=text), F('issn'), as_text('start'), as_text('end') ]
+        if connection.vendor == 'mysql':
+            return [ Func(column, template='BINARY %(expressions)s', output_field=text).asc() for column in columns ]
+        return [ column.asc() for column in columns ]
 
     def build_row( self, data_dct ):
         """ Takes some dct vals, and creates others.
-            Called by views.create_ss_file() """
+            Called by iter_keyed_title_rows() """
         dct = {
             'issn': data_dct['issn'],
             'title': data_dct['title'],
@@ -42,28 +207,82 @@ class SSBuilder( object ):
         return lst
 
     def save_file( self, lines_lst, path ):
-        """ Saves csv file.
-            Called by views.create_ss_file() """
-        # try:
-        log.debug( 'lines_lst, ```{}```'.format(pprint.pformat(lines_lst)) )
-        with open(path, 'wb') as outcsv:
-            #configure writer to write standard csv file
-            writer = csv.writer( outcsv, delimiter=','.encode('utf-8'), quotechar='"'.encode('utf-8'), quoting=csv.QUOTE_ALL, lineterminator='\n'.encode('utf-8'), encoding='utf-8' )
-            for line_lst in sorted(lines_lst):
-                utf8_line_list = []
-                for element in line_lst:
-                    if element:
-                        element.encode('utf-8')
-                    else:
-                        element = ''.encode('utf-8')
-                    utf8_line_list.append( element )
-                #Write item to outcsv
-                writer.writerow(
-                    [ utf8_line_list[0], utf8_line_list[1], utf8_line_list[2], utf8_line_list[3], utf8_line_list[4], utf8_line_list[5], utf8_line_list[6], utf8_line_list[7] ]
-                    )
+        """ Saves csv file from an in-memory list of rows, sorted.
+            Called by tests; views.create_ss_file() streams via export() """
+        log.debug( 'saving `{}` lines'.format(len(lines_lst)) )
+        output_file = AtomicCsvFile( path )
+        try:
+            for row in sorted( lines_lst ):
+                output_file.writerow( row )
+        except Exception:
+            output_file.discard()
+            raise
+        output_file.commit()
         return
-        # except Exception as e:
-            # log.error( 'exception saving file, ```{}```'.format(unicode(repr(e))) )
-        # return
+
+    def make_export_dct( self ):
+        """ Returns latest export-generation summary for display, or None.
+            Called by viewhelper_tasks.TasksHelper """
+        generation = SSExportGeneration.objects.first()
+        if generation is None:
+            return None
+        return {
+            'id': generation.id, 'created': '`{}`'.format( generation.created ), 'row_count': generation.row_count, 'new_count': generation.new_count,
+            'changed_count': generation.changed_count, 'deleted_count': generation.deleted_count,
+            'wrote_full_file': generation.wrote_full_file, 'wrote_delta_file': generation.wrote_delta_file }
 
     # end class SSBuilder
+
+
+class AtomicCsvFile( object ):
+    """ Serials-solutions csv written to a temp-file beside `path`; commit() renames it into place, so the file is never seen half-written.
+        Non-django class. """
+
+    def __init__( self, path ):
+        self.path = path
+        ( file_descriptor, self.temp_path ) = tempfile.mkstemp( dir=os.path.dirname(os.path.abspath(path)), prefix='.ss_export_' )
+        self.temp_file = os.fdopen( file_descriptor, 'wb' )
+        self.writer = SSCsvWriter( self.temp_file )
+
+    def writerow( self, row ):
+        """ Writes a row.
+            Called by SSBuilder """
+        self.writer.writerow( row )
+        return
+
+    def commit( self ):
+        """ Flushes to disk and renames into place.
+            Called by SSBuilder.close_files() and SSBuilder.save_file() """
+        self.temp_file.flush()
+        os.fsync( self.temp_file.fileno() )
+        self.temp_file.close()
+        os.chmod( self.temp_path, 0o644 )  # mkstemp makes it owner-only
+        os.rename( self.temp_path, self.path )
+        return
+
+    def discard( self ):
+        """ Drops the temp-file; a no-op once committed.
+            Called by SSBuilder.close_files() and SSBuilder.save_file() """
+        if self.temp_file.closed and not os.path.exists( self.temp_path ):
+            return
+        self.temp_file.close()
+        os.remove( self.temp_path )
+        return
+
+    # end class AtomicCsvFile
+
+
+class SSCsvWriter( object ):
+    """ Writes serials-solutions csv rows: utf-8, every field quoted, empty elements as ''.
+        Non-django class. """
+
+    def __init__( self, output_file ):
+        self.writer = csv.writer( output_file, delimiter=','.encode('utf-8'), quotechar='"'.encode('utf-8'), quoting=csv.QUOTE_ALL, lineterminator='\n'.encode('utf-8'), encoding='utf-8' )
+
+    def writerow( self, row ):
+        """ Writes a row.
+            Called by AtomicCsvFile.writerow() and viewhelper_download.DownloadHelper """
+        self.writer.writerow( [element if element else '' for element in row] )
+        return
+
+    # end class SSCsvWriter
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import datetime, json, logging
+from rapid_app import settings_app
+from rapid_app.lib.table_rotator import TableRotator
+from rapid_app.models import SyncPlan
+
+log = logging.getLogger(__name__)
+
+
+class SyncPlanner( object ):
+    """ Builds, estimates, and records easyA sync-plans, so the diff can be reviewed before production is touched.
+        Non-django class. """
+
+    recent_plans_count = 5  # applied plans used for the throughput estimate
+
+    def build_plan( self, update_helper ):
+        """ Runs the read-only diff, supersedes any pending plan, and saves the new one.
+            Called by UpdateTitlesHelper.plan_update() """
+        delta = update_helper.make_delta()
+        SyncPlan.objects.filter( status='pending' ).update( status='superseded' )
+        plan = SyncPlan(
+            delta=json.dumps( delta ), add_count=len( delta['add'] ), change_count=len( delta['change'] ), delete_count=len( delta['delete'] ), unchanged_count=delta['unchanged'],
+            estimated_statements=self.estimate_statements( delta, update_helper ) )
+        plan.estimated_seconds = self.estimate_seconds( self.count_written_rows(plan) )
+        plan.save()
+        log.info( 'saved sync-plan `{id}`; add, `{add}`; change, `{change}`; delete, `{delete}`; est. statements, `{statements}`; est. seconds, `{seconds}`'.format(
+            id=plan.id, add=plan.add_count, change=plan.change_count, delete=plan.delete_count, statements=plan.estimated_statements, seconds=plan.estimated_seconds) )
+        return plan
+
+    def estimate_statements( self, delta, update_helper ):
+        """ Returns count of easyA statements the chunked writes will take.
+            In `rotate` backup-mode that's the staging load of every dev row, plus the rotation's fixed statements.
+            Called by build_plan() """
+        chunks = lambda count, batch_size: ( count + batch_size - 1 ) // batch_size
+        if settings_app.DB_BACKUP_MODE == 'rotate':
+            rows = len( delta['add'] ) + len( delta['change'] ) + delta['unchanged']
+            return chunks( rows, update_helper._get_batch_size(len(TableRotator.columns)) ) + TableRotator.fixed_statements
+        return (
+            chunks( len(delta['add']), update_helper._get_batch_size(6) ) +
+            chunks( len(delta['change']), update_helper._get_batch_size(1) ) +
+            chunks( len(delta['delete']), update_helper._get_batch_size(1) ) )
+
+    def estimate_seconds( self, rows ):
+        """ Returns estimated seconds from the rows-per-second of recent applied plans, or None if there's no history.
+            Called by build_plan() """
+        recent_plans = SyncPlan.objects.filter( status='applied', applied_seconds__gt=0 )[0:self.recent_plans_count]
+        ( total_rows, total_seconds ) = ( 0, 0.0 )
+        for plan in recent_plans:
+            total_rows += self.count_written_rows( plan )
+            total_seconds += plan.applied_seconds
+        if not total_rows:
+            return None
+        return rows * ( total_seconds / total_rows )
+
+    def count_written_rows( self, plan ):
+        """ Returns rows the plan's apply writes: the diff, or in `rotate` backup-mode, the whole dev-table loaded into staging.
+            Called by build_plan() and estimate_seconds() """
+        if settings_app.DB_BACKUP_MODE == 'rotate':
+            return plan.add_count + plan.change_count + plan.unchanged_count
+        return plan.add_count + plan.change_count + plan.delete_count
+
+    def supersede_pending( self ):
+        """ Retires any pending plan; its diff, and planned row-values, no longer describe PrintTitleDev.
+            Called by devdb_updater.DevDbUpdater.update() and devdb_updater.ShadowTableLoader.load() """
+        count = SyncPlan.objects.filter( status='pending' ).update( status='superseded' )
+        if count:
+            log.info( 'dev-table reloaded; superseded `{}` pending sync-plan(s)'.format(count) )
+        return
+
+    def get_pending_plan( self ):
+        """ Returns newest pending plan, or None.
+            Called by UpdateTitlesHelper.run_update() and viewhelper_tasks.TasksHelper """
+        return SyncPlan.objects.filter( status='pending' ).first()
+
+    def get_delta( self, plan ):
+        """ Returns the plan's cached delta dct.
+            Called by UpdateTitlesHelper.run_update() """
+        return json.loads( plan.delta )
+
+    def mark_applied( self, plan, seconds ):
+        """ Records that the plan ran, and how long its writes took, for later estimates.
+            Called by UpdateTitlesHelper.apply_plan() and UpdateTitlesHelper.publish_plan() """
+        ( plan.status, plan.applied, plan.applied_seconds ) = ( 'applied', datetime.datetime.now(), seconds )
+        plan.save()
+        return
+
+    def make_plan_dct( self, plan ):
+        """ Returns plan summary for display.
+            Called by viewhelper_tasks.TasksHelper """
+        if plan is None:
+            return None
+        return {
+            'id': plan.id, 'created': '`{}`'.format( plan.created ), 'add_count': plan.add_count, 'change_count': plan.change_count,
+            'delete_count': plan.delete_count, 'unchanged_count': plan.unchanged_count, 'estimated_statements': plan.estimated_statements,
+            'estimated_minutes': 'N/A' if plan.estimated_seconds is None else '{0:.1f}'.format( plan.estimated_seconds / 60 ) }
+
+    # end class SyncPlanner
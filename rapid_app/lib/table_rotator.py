@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import logging, re
+from rapid_app.models import PrintTitleDev
+
+log = logging.getLogger(__name__)
+
+
+class TableRotator( object ):
+    """ Publishes new easyA titles by loading a staging table, then renaming tables in one step:
+        staging becomes production, production becomes backup, backup becomes older.
+        Backups cost a rename rather than a full-table copy, and rollback() is a rename back.
+        Main controller: publish() """
+
+    columns = [ 'key', 'issn', 'start', 'end', 'location', 'call_number' ]
+    fixed_statements = 8  # publish()'s statements besides the staging inserts: staging drop and create, count, two backup-table checks, two trash drops, rename
+
+    def __init__( self, db_handler, connection_url, production_table, backup_table, older_table, staging_table, min_rows, batch_size ):
+        self.db_handler = db_handler
+        self.connection_url = connection_url
+        ( self.production_table, self.backup_table, self.older_table, self.staging_table ) = ( production_table, backup_table, older_table, staging_table )
+        self.trash_table = '%s_trash' % production_table
+        self.min_rows = min_rows  # row-count guard; don't publish a staging table smaller than this
+        self.batch_size = batch_size
+        self.is_mysql = 'mysql' in connection_url
+
+    def publish( self ):
+        """ Loads staging from PrintTitleDev, checks its row-count, and rotates it in; returns True if published.
+            Called by UpdateTitlesHelper.run_update() """
+        self.create_like( self.staging_table, replace=True )
+        self.load_staging()
+        count = self.count_rows( self.staging_table )
+        if count < self.min_rows:
+            log.info( 'not publishing because staging count is only, `{count}`; minimum, `{min_rows}`'.format(count=count, min_rows=self.min_rows) )
+            self.drop_table( self.staging_table )
+            return False
+        for table in [ self.backup_table, self.older_table ]:
+            self.create_like( table, replace=False )  # the first rotation has nothing to rename yet
+        self.drop_table( self.trash_table )  # left by a run that died after its rename; mysql's RENAME won't overwrite it
+        self.rename( [(self.older_table, self.trash_table), (self.backup_table, self.older_table), (self.production_table, self.backup_table), (self.staging_table, self.production_table)] )
+        self.drop_table( self.trash_table )
+        log.info( 'published `{count}` rows to `{production}`'.format(count=count, production=self.production_table) )
+        return True
+
+    def rollback( self ):
+        """ Restores the previous production table: production goes to staging (kept for inspection), backup to production, older to backup.
+            Called by management.commands.rollback_titles_table """
+        self.drop_table( self.staging_table )
+        self.rename( [(self.production_table, self.staging_table), (self.backup_table, self.production_table), (self.older_table, self.backup_table)] )
+        log.info( 'rolled back `{}` to its backup'.format(self.production_table) )
+        return
+
+    def load_staging( self ):
+        """ Fills staging from PrintTitleDev with chunked multi-row inserts, in one transaction.
+            Called by publish() """
+        sql_start = 'INSERT INTO `{table}` ( {columns} ) VALUES '.format( table=self.staging_table, columns=', '.join(['`%s`' % column for column in self.columns]) )
+        titles = PrintTitleDev.objects.order_by( 'key' ).values_list( 'key', 'issn', 'start', 'end', 'building', 'call_number' ).iterator()  # easyA `location` holds the dev `building`
+        with self.db_handler.transaction( self.connection_url ):
+            chunk = []
+            for title in titles:
+                chunk.append( title )
+                if len( chunk ) == self.batch_size:
+                    self.insert_chunk( sql_start, chunk )
+                    chunk = []
+            if chunk:
+                self.insert_chunk( sql_start, chunk )
+        return
+
+    def insert_chunk( self, sql_start, chunk ):
+        """ Runs one multi-row insert with bound params.
+            Called by load_staging() """
+        ( value_rows, params ) = ( [], {} )
+        for ( i, values ) in enumerate( chunk ):
+            value_rows.append( '( %s )' % ', '.join([':%s_%s' % (column, i) for column in self.columns]) )
+            params.update( dict(('%s_%s' % (column, i), value) for (column, value) in zip(self.columns, values)) )
+        self.db_handler.run_sql( sql=sql_start + ', '.join(value_rows), connection_url=self.connection_url, params=params )
+        return
+
+    def create_like( self, table, replace ):
+        """ Creates an empty table shaped like production; with `replace`, an existing one is dropped first.
+            Called by publish() """
+        if replace:
+            self.drop_table( table )
+        elif self.table_exists( table ):
+            return
+        if self.is_mysql:
+            self.db_handler.run_sql( sql='CREATE TABLE `{table}` LIKE `{production}`'.format(table=table, production=self.production_table), connection_url=self.connection_url )
+        else:
+            rows = self.db_handler.run_sql( sql="SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name", connection_url=self.connection_url, params={'name': self.production_table} )
+            create_sql = re.sub( r'^(CREATE TABLE\s+)[`"]?%s[`"]?' % re.escape(self.production_table), r'\1`%s`' % table, rows[0][0], count=1 )
+            self.db_handler.run_sql( sql=create_sql, connection_url=self.connection_url )
+        return
+
+    def rename( self, pairs ):
+        """ Renames [ (old, new), ... ] in order, atomically: one RENAME TABLE in mysql; one explicit transaction in sqlite.
+            Called by publish() and rollback() """
+        if self.is_mysql:
+            sql = 'RENAME TABLE %s' % ', '.join( ['`%s` TO `%s`' % (old, new) for (old, new) in pairs] )
+            self.db_handler.run_sql( sql=sql, connection_url=self.connection_url )
+        else:
+            self.rename_sqlite( pairs )
+        return
+
+    def rename_sqlite( self, pairs ):
+        """ Runs the renames between an explicit BEGIN and COMMIT on the raw sqlite3 connection.
+            Python 2's sqlite3 commits implicitly before any non-dml statement, so each ALTER run through a sqlalchemy transaction would commit on its own,
+            and a failure part-way would leave the tables half-rotated. With isolation_level None the module leaves transaction-control to these statements.
+            Called by rename() """
+        raw_connection = self.db_handler.get_engine( self.connection_url ).raw_connection()
+        sqlite_connection = raw_connection.connection  # under the pool's proxy
+        isolation_level = sqlite_connection.isolation_level
+        sqlite_connection.isolation_level = None
+        cursor = sqlite_connection.cursor()
+        try:
+            cursor.execute( 'BEGIN' )
+            for ( old, new ) in pairs:
+                log.debug( 'renaming `{old}` to `{new}`'.format(old=old, new=new) )
+                cursor.execute( 'ALTER TABLE `%s` RENAME TO `%s`' % (old, new) )
+            cursor.execute( 'COMMIT' )
+        except Exception:
+            cursor.execute( 'ROLLBACK' )
+            raise
+        finally:
+            cursor.close()
+            sqlite_connection.isolation_level = isolation_level
+            raw_connection.close()  # back to the pool
+        return
+
+    def table_exists( self, table ):
+        """ Returns boolean.
+            Called by create_like() """
+        if self.is_mysql:
+            rows = self.db_handler.run_sql( sql='SHOW TABLES LIKE :name', connection_url=self.connection_url, params={'name': table} )
+        else:
+            rows = self.db_handler.run_sql( sql="SELECT name FROM sqlite_master WHERE type = 'table' AND name = :name", connection_url=self.connection_url, params={'name': table} )
+        return bool( rows )
+
+    def count_rows( self, table ):
+        """ Returns row-count.
+            Called by publish() """
+        return self.db_handler.run_sql( sql='SELECT COUNT(*) FROM `%s`' % table, connection_url=self.connection_url )[0][0]
+
+    def drop_table( self, table ):
+        """ Drops a table if it exists.
+            Called by publish(), rollback(), and create_like() """
+        self.db_handler.run_sql( sql='DROP TABLE IF EXISTS `%s`' % table, connection_url=self.connection_url )
+        return
+
+    # end class TableRotator
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json, logging, os, sqlite3, time
+from rapid_app import settings_app
+
+log = logging.getLogger(__name__)
+
+
+class TitleCache( object ):
+    """ Persistent issn-to-title cache, in a local sqlite file, looked up one issn at a time.
+        Holds solr matches indefinitely, and solr misses (negative entries) for a limited time.
+        Seeded once from the issn-to-unicode-title json file.
+        Non-django class. """
+
+    def __init__( self, cache_path=None, negative_ttl_days=None, seed_json_path=None ):
+        self.cache_path = cache_path if cache_path else settings_app.TITLE_CACHE_PATH
+        self.negative_ttl_seconds = ( negative_ttl_days if negative_ttl_days is not None else settings_app.TITLE_CACHE_NEGATIVE_TTL_DAYS ) * 24 * 60 * 60
+        self.seed_json_path = seed_json_path if seed_json_path else settings_app.ISSN_JSON_PATH
+        ( self.connection, self.connection_pid ) = ( None, None )
+        ( self.hits, self.misses, self.negative_hits ) = ( 0, 0, 0 )
+
+    def lookup( self, issn ):
+        """ Returns ( status, title ); status is `hit`, `negative`, or `miss`; expired negatives count as misses.
+            Called by TitleMaker.check_dct() """
+        row = self._get_connection().execute( 'SELECT title, checked FROM titles WHERE issn = ?', (issn,) ).fetchone()
+        if row is None or ( row[0] is None and time.time() - row[1] > self.negative_ttl_seconds ):
+            self.misses += 1
+            return ( 'miss', None )
+        if row[0] is None:
+            self.negative_hits += 1
+            return ( 'negative', None )
+        self.hits += 1
+        return ( 'hit', row[0] )
+
+    def store_titles( self, titles_dct ):
+        """ Saves { issn: title } matches.
+            Called by TitleMaker """
+        self._write( [ (issn, title, time.time()) for (issn, title) in titles_dct.items() ] )
+        return
+
+    def store_negatives( self, issns ):
+        """ Saves issns that solr didn't match.
+            Called by TitleMaker """
+        self._write( [ (issn, None, time.time()) for issn in issns ] )
+        return
+
+    def _write( self, rows ):
+        """ Upserts rows in one transaction.
+            Called by store_titles() and store_negatives() """
+        if not rows:
+            return
+        connection = self._get_connection()
+        with connection:
+            connection.executemany( 'INSERT OR REPLACE INTO titles ( issn, title, checked ) VALUES ( ?, ?, ? )', rows )
+        return
+
+    def get_counts( self ):
+        """ Returns ( hits, misses, negative_hits ).
+            Called by build_shard() and HoldingsDctBuilder.save_checkpoint() """
+        return ( self.hits, self.misses, self.negative_hits )
+
+    def add_counts( self, counts ):
+        """ Adds a shard's, or a checkpoint's, counts to the totals.
+            Called by HoldingsDctBuilder.build_holdings_dct_parallel() and HoldingsDctBuilder.restore_checkpoint() """
+        ( hits, misses, negative_hits ) = counts
+        ( self.hits, self.misses, self.negative_hits ) = ( self.hits + hits, self.misses + misses, self.negative_hits + negative_hits )
+        return
+
+    def log_counts( self ):
+        """ Logs lookup counters.
+            Called by HoldingsDctBuilder.build_holdings_dct() and HoldingsDctBuilder.build_holdings_dct_parallel() """
+        log.info( 'title-cache hits, `{hits}`; misses, `{misses}`; negative-hits, `{negative_hits}`'.format(hits=self.hits, misses=self.misses, negative_hits=self.negative_hits) )
+        return
+
+    def _get_connection( self ):
+        """ Opens the cache lazily, once per process, so forked parse-workers don't share a connection.
+            Called by lookup() and _write() """
+        if self.connection is None or self.connection_pid != os.getpid():
+            self.connection = sqlite3.connect( self.cache_path, timeout=30 )
+            self.connection_pid = os.getpid()
+            self._ensure_schema( self.connection )
+        return self.connection
+
+    def _ensure_schema( self, connection ):
+        """ Creates the table, and seeds it from the json file the first time.
+            Called by _get_connection() """
+        with connection:
+            connection.execute( 'CREATE TABLE IF NOT EXISTS titles ( issn TEXT PRIMARY KEY, title TEXT, checked REAL NOT NULL )' )
+            connection.execute( 'CREATE TABLE IF NOT EXISTS meta ( name TEXT PRIMARY KEY, value TEXT )' )
+            if connection.execute( "SELECT value FROM meta WHERE name = 'seeded'" ).fetchone() is None:
+                with open( self.seed_json_path, 'r' ) as f:
+                    seed_dct = json.loads( f.read() )
+                connection.executemany( 'INSERT OR IGNORE INTO titles ( issn, title, checked ) VALUES ( ?, ?, ? )', [ (issn, title, time.time()) for (issn, title) in seed_dct.items() ] )
+                connection.execute( "INSERT INTO meta ( name, value ) VALUES ( 'seeded', ? )", (self.seed_json_path,) )
+                log.info( 'seeded title-cache with `{count}` entries from, ```{path}```'.format(count=len(seed_dct), path=self.seed_json_path) )
+        return
+
+    # end class TitleCache
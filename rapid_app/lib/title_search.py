@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import logging, re
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from rapid_app import settings_app
+from rapid_app.models import PrintTitleDev, RunHistory
+
+log = logging.getLogger(__name__)
+
+
+class TitleSearchIndex( object ):
+    """ Indexed search over PrintTitleDev, for the admin changelist.
+        Words match a full-text index over `search_fields`: on sqlite an fts5 table, kept in sync by the load step; on mysql a FULLTEXT index, kept by the db.
+        `key` and `issn` match as exact prefixes, as ranges on their indexes.
+        Words the index can't match, on mysql its stopwords and words shorter than innodb_ft_min_token_size, are required with LIKEs instead.
+        Non-django class. """
+
+    search_fields = [ 'title', 'call_number', 'url' ]  # a mysql MATCH() must list a FULLTEXT index's columns in its order
+    batch_size = 500  # keys per sync statement
+    mysql_stopwords = frozenset( [  # innodb's default full-text stopword list
+        'a', 'about', 'an', 'are', 'as', 'at', 'be', 'by', 'com', 'de', 'en', 'for', 'from', 'how', 'i', 'in', 'is', 'it', 'la', 'of', 'on', 'or',
+        'that', 'the', 'this', 'to', 'was', 'what', 'when', 'where', 'who', 'will', 'with', 'und', 'www' ] )
+
+    def __init__( self ):
+        self.live_table = PrintTitleDev._meta.db_table
+        self.table = '%s_fts' % self.live_table  # sqlite
+        self.shadow_table = '%s_shadow' % self.table
+        self.available = False  # positive result cached; see is_available()
+        ( self.min_word_length, self.stopwords ) = ( None, None )  # set by load_word_rules()
+
+    def search( self, titles, search_term ):
+        """ Returns the queryset narrowed to titles matching the term's words, or whose key or issn starts with the term.
+            Called by admin.PrintTitleDevAdmin.get_search_results() """
+        term = search_term.strip()
+        ( clauses, params ) = ( [self.make_prefix_sql('key'), self.make_prefix_sql('issn')], self.make_prefix_range(term) + self.make_prefix_range(self.make_issn_prefix(term)) )
+        ( words_sql, words_params ) = self.make_words_sql( term )
+        if words_sql:
+            clauses.append( words_sql )
+            params.extend( words_params )
+        return titles.extra( where=[' OR '.join(clauses)], params=params )  # one where-clause; a RawSQL in `key__in` is double-parenthesized, which sqlite reads as a scalar subquery
+
+    def make_prefix_sql( self, field ):
+        """ Returns a `prefix <= field < next-prefix` clause; unlike a LIKE, sqlite uses the index for this.
+            Called by search() """
+        return '({column} >= %s AND {column} < %s)'.format( column=self.make_column_sql(field) )
+
+    def make_prefix_range( self, prefix ):
+        """ Returns [ prefix, next-prefix ] params for make_prefix_sql().
+            Called by search() """
+        return [ prefix, prefix[:-1] + unichr(ord(prefix[-1]) + 1) ]
+
+    def make_column_sql( self, field ):
+        """ Returns the table-qualified column.
+            Called by make_prefix_sql() and make_words_sql() """
+        qn = connection.ops.quote_name
+        return '{table}.{column}'.format( table=qn(self.live_table), column=qn(field) )
+
+    def make_issn_prefix( self, term ):
+        """ Returns the term as a stored-form issn prefix, hyphen added when it runs past the first four digits.
+            Called by search() """
+        issn = term.upper()
+        if re.match( r'^[0-9]{5,7}[0-9X]?$', issn ):
+            issn = '%s-%s' % ( issn[0:4], issn[4:] )
+        return issn
+
+    def make_words_sql( self, term ):
+        """ Returns ( sql, params ) requiring every word of the term, each as a prefix; or ( None, [] ) when the term has no words.
+            Indexed words go to one full-text match. A mysql `+word*` for a stopword or short word would match nothing, so those words are
+              instead required as substrings of a search-field, with LIKEs; checked on the matched rows, or on every row if no word is indexed.
+            Called by search() """
+        words = re.findall( r'\w+', term, re.UNICODE )
+        if not words:
+            return ( None, [] )
+        ( clauses, params ) = ( [], [] )
+        indexed_words = [ word for word in words if self.is_indexed_word(word) ]
+        if indexed_words:
+            clauses.append( '{column} IN ({match_sql})'.format(column=self.make_column_sql('key'), match_sql=self.make_match_sql()) )
+            params.append( self.make_match_query(indexed_words) )
+        for word in [ word for word in words if word not in indexed_words ]:
+            clauses.append( '(%s)' % ' OR '.join(["{column} LIKE %s ESCAPE '!'".format(column=self.make_column_sql(field)) for field in self.search_fields]) )
+            params.extend( [ '%%%s%%' % word.replace('_', '!_') ] * len(self.search_fields) )  # \w words hold no other LIKE wildcards
+        return ( '(%s)' % ' AND '.join(clauses), params )
+
+    def is_indexed_word( self, word ):
+        """ Returns True if the full-text index can match the word as a prefix.
+            Called by make_words_sql() """
+        self.load_word_rules()
+        return len( word ) >= self.min_word_length and word.lower() not in self.stopwords
+
+    def load_word_rules( self ):
+        """ Sets the shortest indexed word and the stopwords, once; mysql's minimum is read from the server, sqlite fts5 indexes every word.
+            Called by is_indexed_word() """
+        if self.min_word_length is not None:
+            return
+        if connection.vendor == 'mysql':
+            with connection.cursor() as cursor:
+                cursor.execute( 'SELECT @@innodb_ft_min_token_size' )
+                ( self.min_word_length, self.stopwords ) = ( int(cursor.fetchone()[0]), self.mysql_stopwords )
+        else:
+            ( self.min_word_length, self.stopwords ) = ( 1, frozenset() )
+        return
+
+    def make_match_query( self, words ):
+        """ Returns a full-text query requiring every word, each as a prefix.
+            Called by make_words_sql() """
+        if connection.vendor == 'mysql':
+            return ' '.join( [ '+%s*' % word for word in words ] )
+        return ' '.join( [ '"%s"*' % word for word in words ] )
+
+    def make_match_sql( self ):
+        """ Returns the sql selecting keys of full-text matches.
+            Called by make_words_sql() """
+        qn = connection.ops.quote_name
+        if connection.vendor == 'mysql':
+            return 'SELECT {key} FROM {live} WHERE MATCH ({columns}) AGAINST (%s IN BOOLEAN MODE)'.format(
+                key=qn('key'), live=qn(self.live_table), columns=', '.join([qn(field) for field in self.search_fields]) )
+        return 'SELECT {key} FROM {table} WHERE {table} MATCH %s'.format( key=qn('key'), table=qn(self.table) )
+
+    def is_available( self ):
+        """ Returns True when the full-text index exists; a sqlite build without fts5 has none, and the admin falls back to its default search.
+            Called by admin.PrintTitleDevAdmin.get_search_results() """
+        if not self.available:
+            with connection.cursor() as cursor:
+                if connection.vendor == 'mysql':
+                    constraints = connection.introspection.get_constraints( cursor, self.live_table )
+                    self.available = any( dct['columns'] == self.search_fields for dct in constraints.values() )
+                else:
+                    self.available = self.table in connection.introspection.table_names( cursor )
+        return self.available
+
+    def is_fulltext_index( self, columns ):
+        """ Returns True for the mysql FULLTEXT index's columns, which need CREATE FULLTEXT INDEX.
+            Called by devdb_updater.ShadowTableLoader.create_indexes() """
+        return connection.vendor == 'mysql' and list( columns ) == self.search_fields
+
+    def sync_keys( self, remove_keys, add_keys ):
+        """ Drops, then re-reads from PrintTitleDev, the given keys' sqlite fts entries; mysql keeps its own index.
+            Run inside the load's transaction, after the table is written.
+            Called by devdb_updater.DevDbUpdater.update() """
+        if connection.vendor == 'mysql' or not self.is_available():
+            return
+        qn = connection.ops.quote_name
+        ( remove_keys, add_keys ) = ( sorted(remove_keys), sorted(add_keys) )
+        with connection.cursor() as cursor:
+            for i in range( 0, len(remove_keys), self.batch_size ):
+                chunk = remove_keys[i:i+self.batch_size]
+                cursor.execute( 'DELETE FROM {table} WHERE {key} IN ({placeholders})'.format(
+                    table=qn(self.table), key=qn('key'), placeholders=', '.join(['%s'] * len(chunk))), chunk )
+            for i in range( 0, len(add_keys), self.batch_size ):
+                chunk = add_keys[i:i+self.batch_size]
+                self.fill( cursor, self.live_table, self.table, where_keys=chunk )
+        log.debug( 'fts entries removed, `{removed}`; added, `{added}`'.format(removed=len(remove_keys), added=len(add_keys)) )
+        return
+
+    def load_shadow( self, cursor, shadow_live_table ):
+        """ Builds a sqlite fts table from the loaded shadow PrintTitleDev table, to be swapped in with it.
+            Called by devdb_updater.ShadowTableLoader.load() """
+        if connection.vendor == 'mysql' or not self.is_available():
+            return
+        cursor.execute( 'DROP TABLE IF EXISTS {}'.format(connection.ops.quote_name(self.shadow_table)) )
+        self.create_table( cursor, self.shadow_table )
+        self.fill( cursor, shadow_live_table, self.shadow_table )
+        return
+
+    def swap_shadow( self, cursor ):
+        """ Replaces the sqlite fts table with the shadow one; run in the table-swap's transaction.
+            Called by devdb_updater.ShadowTableLoader.swap_tables() """
+        if connection.vendor == 'mysql' or not self.is_available():
+            return
+        qn = connection.ops.quote_name
+        cursor.execute( 'DROP TABLE {}'.format(qn(self.table)) )
+        cursor.execute( 'ALTER TABLE {shadow} RENAME TO {table}'.format(shadow=qn(self.shadow_table), table=qn(self.table)) )
+        return
+
+    def create_table( self, cursor, table ):
+        """ Creates an empty sqlite fts5 table; the key is stored, not indexed.
+            Called by load_shadow() """
+        qn = connection.ops.quote_name
+        cursor.execute( "CREATE VIRTUAL TABLE {table} USING fts5( {key} UNINDEXED, {columns}, prefix='2 3' )".format(
+            table=qn(table), key=qn('key'), columns=', '.join([qn(field) for field in self.search_fields])) )
+        return
+
+    def fill( self, cursor, source_table, table, where_keys=None ):
+        """ Copies rows' searchable text into an fts table, optionally just the given keys.
+            Called by sync_keys() and load_shadow() """
+        qn = connection.ops.quote_name
+        columns = ', '.join( [ qn(field) for field in ['key'] + self.search_fields ] )
+        sql = 'INSERT INTO {table} ({columns}) SELECT {columns} FROM {source}'.format( table=qn(table), columns=columns, source=qn(source_table) )
+        if where_keys is not None:
+            sql += ' WHERE {key} IN ({placeholders})'.format( key=qn('key'), placeholders=', '.join(['%s'] * len(where_keys)) )
+        cursor.execute( sql, where_keys )
+        return
+
+    # end class TitleSearchIndex
+
+
+class TitleFacets( object ):
+    """ Cached value-counts of a PrintTitleDev field, for the admin's building and location filters.
+        Cache-keys carry the latest RunHistory id, so a finished load, in whichever process, starts fresh counts; manual edits show after FACET_CACHE_SECONDS.
+        Non-django class. """
+
+    def get_counts( self, field ):
+        """ Returns [ (value, count), ... ] ordered by value; empty values are left out.
+            Called by admin.FacetCountsFilter.lookups() """
+        cache_key = 'rapid_app__facets__{field}__{stamp}'.format( field=field, stamp=self.get_load_stamp() )
+        counts = cache.get( cache_key )
+        if counts is None:
+            counts = [
+                ( value, count ) for ( value, count ) in PrintTitleDev.objects.values_list( field ).annotate( count=Count('key') ).order_by( field )
+                if value ]
+            cache.set( cache_key, counts, settings_app.FACET_CACHE_SECONDS )
+            log.debug( 'facet counts for `{field}` cached under `{key}`'.format(field=field, key=cache_key) )
+        return counts
+
+    def get_load_stamp( self ):
+        """ Returns the latest run's id; a run is saved once its load has finished.
+            Called by get_counts() """
+        return RunHistory.objects.values_list( 'id', flat=True ).first()
+
+    # end class TitleFacets
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import logging
+from django.db import connection
+from rapid_app.lib.fingerprint import Fingerprinter
+from rapid_app.lib.query_stream import QueryStreamer
+from rapid_app.models import PrintTitleDev
+
+log = logging.getLogger(__name__)
+
+
+class TitlesMergeDiffer( object ):
+    """ Diffs PrintTitleDev against the easyA titles table with a merge-join over both tables streamed in key order.
+        Only one key and fingerprint per side is held at a time; memory grows only with the returned delta.
+        Main controller: diff() """
+
+    easya_fields = [ 'issn', 'start', 'end', 'location', 'call_number' ]  # fingerprinted, in this order
+    dev_fields = [ 'issn', 'start', 'end', 'building', 'call_number' ]  # easyA `location` holds the dev `building`
+    fetch_size = 1000
+
+    def __init__( self, db_handler, connection_url, table_name ):
+        self.db_handler = db_handler
+        self.connection_url = connection_url
+        self.table_name = table_name
+        self.fingerprinter = Fingerprinter()
+        self.query_streamer = QueryStreamer()
+        self.query_streamer.fetch_size = self.fetch_size
+
+    def diff( self ):
+        """ Returns dct of key-lists: `add` (dev-only), `delete` (easyA-only), `change` (fingerprints differ); plus an `unchanged` count,
+            and `rows`, { key: [issn, start, end, building, call_number] } for adds and changes, read in the same pass as their fingerprints.
+            Called by UpdateTitlesHelper.make_delta() """
+        delta = { 'add': [], 'delete': [], 'change': [], 'unchanged': 0, 'rows': {} }
+        for ( action, key, dev_row ) in self.merge( self.iter_dev_rows(), self.iter_easya_rows() ):
+            if action == 'unchanged':
+                delta['unchanged'] += 1
+            else:
+                delta[action].append( key )
+            if action in ( 'add', 'change' ):
+                delta['rows'][key] = dev_row[2]
+        log.info( 'merge-diff counts; add, `{add}`; delete, `{delete}`; change, `{change}`; unchanged, `{unchanged}`'.format(
+            add=len(delta['add']), delete=len(delta['delete']), change=len(delta['change']), unchanged=delta['unchanged']) )
+        return delta
+
+    def merge( self, dev_rows, easya_rows ):
+        """ Yields ( action, key, dev-row or None ) from two key-ordered iterables of ( key, fingerprint, ... ).
+            Called by diff() """
+        ( dev_rows, easya_rows ) = ( self.check_order(dev_rows, 'dev'), self.check_order(easya_rows, 'easyA') )
+        ( dev, easya ) = ( next(dev_rows, None), next(easya_rows, None) )
+        while dev is not None or easya is not None:
+            if easya is None or ( dev is not None and dev[0] < easya[0] ):
+                yield ( 'add', dev[0], dev )
+                dev = next( dev_rows, None )
+            elif dev is None or easya[0] < dev[0]:
+                yield ( 'delete', easya[0], None )
+                easya = next( easya_rows, None )
+            else:
+                yield ( 'unchanged' if dev[1] == easya[1] else 'change', dev[0], dev )
+                ( dev, easya ) = ( next(dev_rows, None), next(easya_rows, None) )
+
+    def check_order( self, rows, label ):
+        """ Passes rows through, raising if keys aren't strictly ascending; a collation mismatch would otherwise give a wrong diff.
+            Called by merge() """
+        previous_key = None
+        for row in rows:
+            if previous_key is not None and not row[0] > previous_key:
+                raise Exception( '{label} keys out of order at, ```{key}```; check the key column collation'.format(label=label, key=row[0]) )
+            previous_key = row[0]
+            yield row
+
+    def iter_dev_rows( self ):
+        """ Yields ( key, fingerprint, [issn, start, end, building, call_number] ) for PrintTitleDev rows in binary key-order, streamed in chunks by QueryStreamer.
+            Called by diff() """
+        qn = connection.ops.quote_name
+        sql = 'SELECT {columns} FROM {table} ORDER BY {order}'.format(
+            columns=', '.join([qn(field) for field in ['key'] + self.dev_fields]), table=qn(PrintTitleDev._meta.db_table), order=self.make_order_sql(connection.vendor, qn('key')) )
+        for row in self.query_streamer.iter_sql( sql ):
+            yield ( row[0], self.fingerprinter.make_fingerprint(row[1:]), list(row[1:]) )
+
+    def iter_easya_rows( self ):
+        """ Yields ( key, fingerprint ) for easyA rows in binary key-order, streamed by ManualDbHandler.iter_sql().
+            Called by diff() """
+        vendor = 'mysql' if 'mysql' in self.connection_url else 'sqlite'
+        sql = 'SELECT {columns} FROM `{table}` ORDER BY {order}'.format(
+            columns=', '.join(['`%s`' % field for field in ['key'] + self.easya_fields]), table=self.table_name, order=self.make_order_sql(vendor, '`key`') )
+        for row in self.db_handler.iter_sql( sql=sql, connection_url=self.connection_url, chunk_size=self.fetch_size ):
+            yield ( row[0], self.fingerprinter.make_fingerprint(row[1:]) )
+
+    def make_order_sql( self, vendor, quoted_key ):
+        """ Returns an ORDER BY expression matching python string-comparison; mysql's default collation ignores case.
+            Called by iter_dev_rows() and iter_easya_rows() """
+        return 'BINARY %s' % quoted_key if vendor == 'mysql' else quoted_key
+
+    # end class TitlesMergeDiffer
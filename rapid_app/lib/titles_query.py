@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import logging, re
+from django.db.models import Q
+from rapid_app.models import PrintTitleDev
+
+log = logging.getLogger(__name__)
+
+
+class TitlesQuery( object ):
+    """ Narrows PrintTitleDev by request-params, in the db; shared by the downloads and the holdings api.
+        Params, each of which may repeat: `issn` (with or without the hyphen), `building`, `location`; and `year_from` / `year_to` for holdings overlapping those years.
+        Bad params raise ValueError, for a 400 response.
+        Non-django class. """
+
+    def filter_titles( self, params, titles=None ):
+        """ Returns the queryset narrowed by the params.
+            Called by viewhelper_download.DownloadHelper and viewhelper_api.HoldingsApiHelper """
+        titles = titles if titles is not None else PrintTitleDev.objects.all()
+        issns = [ self.normalize_issn(issn) for issn in params.getlist('issn') ]
+        if issns:
+            titles = titles.filter( issn__in=issns )
+        for field in [ 'building', 'location' ]:
+            values = params.getlist( field )
+            if values:
+                titles = titles.filter( **{'%s__in' % field: values} )
+        ( year_from, year_to ) = ( self.parse_year(params, 'year_from'), self.parse_year(params, 'year_to') )
+        if year_to is not None:
+            titles = titles.filter( start__lte=year_to )
+        if year_from is not None:
+            titles = titles.filter( Q(end__gte=year_from) | Q(end__isnull=True, start__gte=year_from) )  # a null end means the single start-year
+        return titles
+
+    def normalize_issn( self, issn ):
+        """ Returns issn in the stored `1234-5678` form.
+            Called by filter_titles() """
+        issn = issn.strip().upper()
+        if re.match( r'^[0-9]{7}[0-9X]$', issn ):
+            issn = '%s-%s' % ( issn[0:4], issn[4:] )
+        return issn
+
+    def parse_year( self, params, name ):
+        """ Returns the param as an int, or None if absent.
+            Called by filter_titles() """
+        value = params.get( name )
+        if value in ( None, '' ):
+            return None
+        if not re.match( r'^[0-9]{1,4}$', value.strip() ):
+            raise ValueError( '`{name}` must be a year; got `{value}`'.format(name=name, value=value) )
+        return int( value )
+
+    # end class TitlesQuery
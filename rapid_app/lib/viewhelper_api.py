@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json, logging
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.urlresolvers import reverse
+from django.http import HttpResponse, HttpResponseBadRequest
+from rapid_app.lib.titles_query import TitlesQuery
+
+log = logging.getLogger(__name__)
+
+
+class HoldingsApiHelper( object ):
+    """ Manages views.holdings_api() work: read-only, keyset-paginated json pages of PrintTitleDev.
+        Params: TitlesQuery's filters; `after`, the previous page's last key; `limit`; and `fields`, comma-separated.
+        A page is `WHERE key > after ... ORDER BY key LIMIT n` on an index, so page cost doesn't grow with depth, unlike an offset.
+        Non-django class. """
+
+    fields = [ 'key', 'issn', 'title', 'url', 'location', 'building', 'call_number', 'start', 'end', 'date_updated' ]
+    default_limit = 100
+    max_limit = 1000
+
+    def __init__( self ):
+        self.titles_query = TitlesQuery()
+
+    def make_context( self, request ):
+        """ Returns page dct; raises ValueError on bad params.
+            Called by views.holdings_api() """
+        ( requested_fields, limit, after ) = ( self.parse_fields(request.GET.get('fields')), self.parse_limit(request.GET.get('limit')), request.GET.get('after') )
+        titles = self.titles_query.filter_titles( request.GET )
+        if after:
+            titles = titles.filter( key__gt=after )
+        fields = [ 'key' ] + [ field for field in requested_fields if field != 'key' ]  # the cursor needs the key
+        results = list( titles.order_by('key').values(*fields)[0:limit+1] )  # one extra row shows whether there's a next page
+        has_more = len( results ) > limit
+        results = results[0:limit]
+        next_after = results[-1]['key'] if has_more else None
+        if 'key' not in requested_fields:
+            for result in results:
+                del result['key']
+        return {
+            'count': len( results ),
+            'limit': limit,
+            'next_after': next_after,
+            'next_url': self.make_next_url( request, next_after ) if next_after else None,
+            'results': results,
+            }
+
+    def parse_fields( self, fields_param ):
+        """ Returns the requested fields; all fields by default.
+            Called by make_context() """
+        if not fields_param:
+            return self.fields
+        fields = [ field.strip() for field in fields_param.split(',') if field.strip() ]
+        unknown_fields = [ field for field in fields if field not in self.fields ]
+        if unknown_fields:
+            raise ValueError( 'unknown fields, `{unknown}`; available, `{available}`'.format(unknown=', '.join(unknown_fields), available=', '.join(self.fields)) )
+        return fields
+
+    def parse_limit( self, limit_param ):
+        """ Returns page-size.
+            Called by make_context() """
+        if not limit_param:
+            return self.default_limit
+        if not limit_param.isdigit() or not 1 <= int( limit_param ) <= self.max_limit:
+            raise ValueError( '`limit` must be 1 to {max_limit}; got `{limit}`'.format(max_limit=self.max_limit, limit=limit_param) )
+        return int( limit_param )
+
+    def make_next_url( self, request, next_after ):
+        """ Returns this request's url with `after` moved on.
+            Called by make_context() """
+        params = request.GET.copy()
+        params['after'] = next_after
+        return '{path}?{query}'.format( path=reverse('holdings_api_url'), query=params.urlencode() )
+
+    def make_response( self, request, data ):
+        """ Returns json.
+            Called by views.holdings_api() """
+        output = json.dumps( data, sort_keys=True, indent=2, cls=DjangoJSONEncoder )
+        return HttpResponse( output, content_type=u'application/javascript; charset=utf-8' )
+
+    def make_error_response( self, message ):
+        """ Returns a 400 json response.
+            Called by views.holdings_api() """
+        return HttpResponseBadRequest( json.dumps({'error': message}, sort_keys=True), content_type=u'application/javascript; charset=utf-8' )
+
+    # end class HoldingsApiHelper
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import io, json, logging, re, zlib
+from django.http import StreamingHttpResponse
+from rapid_app.lib.query_stream import QueryStreamer
+from rapid_app.lib.ss_builder import SSBuilder, SSCsvWriter
+from rapid_app.lib.titles_query import TitlesQuery
+
+log = logging.getLogger(__name__)
+
+
+class DownloadHelper( object ):
+    """ Manages views.download_ss_file() and views.download_holdings() work.
+        Responses are streamed from an unbuffered db-cursor in chunks, gzipped when the client accepts it, so a large pull starts at once and holds little in memory.
+        Non-django class. """
+
+    chunk_size = 65536  # bytes gathered before each yield
+    holdings_fields = [ 'key', 'issn', 'title', 'url', 'location', 'building', 'call_number', 'start', 'end' ]  # the processed holdings-list's entry order
+
+    def __init__( self ):
+        self.ss_builder = SSBuilder()
+        self.titles_query = TitlesQuery()
+        self.query_streamer = QueryStreamer()
+
+    def make_ss_response( self, request ):
+        """ Returns the serials-solutions csv, for the filtered titles, as a download; raises ValueError on bad filter-params.
+            Called by views.download_ss_file() """
+        titles = self.titles_query.filter_titles( request.GET )
+        return self.make_response( request, self.iter_ss_lines(titles), 'text/csv; charset=utf-8', 'ss_titles.csv' )
+
+    def make_holdings_response( self, request ):
+        """ Returns the processed holdings, for the filtered titles, as a json-lines download; raises ValueError on bad filter-params.
+            Called by views.download_holdings() """
+        titles = self.titles_query.filter_titles( request.GET )
+        return self.make_response( request, self.iter_holdings_lines(titles), 'application/x-ndjson; charset=utf-8', 'holdings.jsonl' )
+
+    def iter_ss_lines( self, titles ):
+        """ Yields csv bytes in serials-solutions file order.
+            Called by make_ss_response() """
+        buffer = io.BytesIO()
+        writer = SSCsvWriter( buffer )
+        for ( key, row ) in self.ss_builder.iter_keyed_title_rows( titles ):
+            writer.writerow( row )
+            yield buffer.getvalue()
+            buffer.seek( 0 )
+            buffer.truncate()
+
+    def iter_holdings_lines( self, titles ):
+        """ Yields one json object per holding, in key order.
+            Called by make_holdings_response() """
+        for values in self.query_streamer.iter_queryset( titles.order_by('key').values_list(*self.holdings_fields) ):
+            yield json.dumps( dict(zip(self.holdings_fields, values)), sort_keys=True ).encode( 'utf-8' ) + b'\n'
+
+    def make_response( self, request, lines, content_type, filename ):
+        """ Wraps the line-iterator in a streaming download.
+            Called by make_ss_response() and make_holdings_response() """
+        ( chunks, gzipped ) = ( self.iter_chunks(lines), self.accepts_gzip(request) )
+        if gzipped:
+            chunks = self.iter_gzipped( chunks )
+        resp = StreamingHttpResponse( chunks, content_type=content_type )
+        if gzipped:
+            resp['Content-Encoding'] = 'gzip'
+        resp['Vary'] = 'Accept-Encoding'
+        resp['Content-Disposition'] = 'attachment; filename="%s"' % filename
+        resp['X-Accel-Buffering'] = 'no'  # keeps a proxy from buffering the whole download
+        return resp
+
+    def iter_chunks( self, lines ):
+        """ Gathers lines into chunks of about `chunk_size` bytes.
+            Called by make_response() """
+        ( parts, size ) = ( [], 0 )
+        for line in lines:
+            parts.append( line )
+            size += len( line )
+            if size >= self.chunk_size:
+                yield b''.join( parts )
+                ( parts, size ) = ( [], 0 )
+        if parts:
+            yield b''.join( parts )
+
+    def iter_gzipped( self, chunks ):
+        """ Yields a gzip stream of the chunks; wbits 31 makes zlib write the gzip header and trailer.
+            Called by make_response() """
+        compressor = zlib.compressobj( 6, zlib.DEFLATED, 31 )
+        for chunk in chunks:
+            compressed = compressor.compress( chunk )
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+    def accepts_gzip( self, request ):
+        """ Returns True if the Accept-Encoding header allows gzip; `gzip;q=0` refuses it.
+            Called by make_response() """
+        for part in request.META.get( 'HTTP_ACCEPT_ENCODING', '' ).split( ',' ):
+            pieces = [ piece.strip() for piece in part.split(';') ]
+            if pieces[0].lower() in ( 'gzip', 'x-gzip' ):
+                return not any( re.match(r'^q=0(\.0*)?$', piece) for piece in pieces[1:] )
+        return False
+
+    # end class DownloadHelper
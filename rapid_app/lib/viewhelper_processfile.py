@@ -2,10 +2,13 @@
 
 from __future__ import unicode_literals
 
-import json, logging
-from django.http import HttpResponse, HttpResponseRedirect
+import json, logging, time
+from django.core.urlresolvers import reverse
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from rapid_app import settings_app
-from rapid_app.lib.processor import RapidFileProcessor
+from rapid_app.lib.job_queue import JobQueue
+from rapid_app.models import ProcessorTracker
 
 log = logging.getLogger(__name__)
 
@@ -13,14 +16,17 @@ log = logging.getLogger(__name__)
 class ProcessFileFromRapidHelper( object ):
     """ Manages views.process_file_from_rapid() work. """
 
+    def __init__( self ):
+        self.job_queue = JobQueue()
+
     def initiate_work( self, request ):
-        """ Initiates work.
+        """ Queues a processing job; the `run_jobs` worker does the parsing and db-load.
             Called by views.process_file_from_rapid() """
         log.debug( 'source-path, ```{source}```; utf8-destination-path, ```{destination}```'.format(source=settings_app.FROM_RAPID_FILEPATH, destination=settings_app.FROM_RAPID_UTF8_FILEPATH) )
-        processor = RapidFileProcessor(
-            settings_app.FROM_RAPID_FILEPATH, settings_app.FROM_RAPID_UTF8_FILEPATH )
-        data_lst = processor.parse_file_from_rapid()
-        return data_lst
+        job = self.job_queue.enqueue( 'process_file' )
+        data = self.job_queue.make_status_dct( job )
+        data['status_url'] = reverse( 'job_status_url', kwargs={'job_id': job.id} )
+        return data
 
     def make_response( self, request, data ):
         """ Prepares response.
@@ -29,8 +35,57 @@ class ProcessFileFromRapidHelper( object ):
             output = json.dumps( data, sort_keys=True, indent=2 )
             resp = HttpResponse( output, content_type=u'application/javascript; charset=utf-8' )
         else:
-            # resp = HttpResponseRedirect( reverse('tasks_url') )
-            resp = HttpResponseRedirect( '/rapid_manager/admin/rapid_app/printtitledev/' )
+            resp = HttpResponseRedirect( reverse('tasks_url') )  # shows the queued job's status
         return resp
 
     # end class ProcessFileFromRapidHelper
+
+
+class JobStatusHelper( object ):
+    """ Manages views.job_status() work. """
+
+    def __init__( self ):
+        self.job_queue = JobQueue()
+
+    def make_context( self, request, job_id ):
+        """ Prepares job-status data.
+            Called by views.job_status() """
+        job = get_object_or_404( ProcessorTracker, pk=job_id )
+        return self.job_queue.make_status_dct( job )
+
+    def make_response( self, request, data ):
+        """ Returns json; meant for polling, so it's never cached.
+            Called by views.job_status() """
+        output = json.dumps( data, sort_keys=True, indent=2 )
+        resp = HttpResponse( output, content_type=u'application/javascript; charset=utf-8' )
+        resp['Cache-Control'] = 'no-cache'
+        return resp
+
+    def make_events_response( self, request, job_id ):
+        """ Returns a server-sent-events stream of the job's status.
+            Called by views.job_events() """
+        get_object_or_404( ProcessorTracker, pk=job_id )
+        resp = StreamingHttpResponse( self.iter_events(job_id), content_type='text/event-stream' )
+        resp['Cache-Control'] = 'no-cache'
+        resp['X-Accel-Buffering'] = 'no'  # keeps a proxy from holding events back
+        return resp
+
+    def iter_events( self, job_id ):
+        """ Yields an event whenever the job's status changes, until it finishes or PROGRESS_EVENTS_MAX_SECONDS pass; the browser's EventSource then reconnects.
+            Stream-length is capped so a watched job doesn't hold a web-worker for the whole run.
+            Called by make_events_response() """
+        yield 'retry: %s\n\n' % ( settings_app.PROGRESS_EVENTS_POLL_SECONDS * 1000 )
+        ( last_data, deadline ) = ( None, time.time() + settings_app.PROGRESS_EVENTS_MAX_SECONDS )
+        while True:
+            data = self.job_queue.make_status_dct( ProcessorTracker.objects.get(pk=job_id) )
+            if data != last_data:
+                yield 'data: %s\n\n' % json.dumps( data, sort_keys=True )
+                last_data = data
+            if data['status'] in ( 'complete', 'failed' ):
+                yield 'event: done\ndata: %s\n\n' % json.dumps( {'job_id': data['job_id'], 'status': data['status']}, sort_keys=True )
+                return
+            if time.time() >= deadline:
+                return
+            time.sleep( settings_app.PROGRESS_EVENTS_POLL_SECONDS )
+
+    # end class JobStatusHelper
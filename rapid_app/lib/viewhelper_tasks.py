@@ -7,6 +7,10 @@ from django.core.urlresolvers import reverse
 from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import render
 from rapid_app import settings_app
+from rapid_app.lib.job_queue import JobQueue
+from rapid_app.lib.run_history import RunHistoryEstimator
+from rapid_app.lib.ss_builder import SSBuilder
+from rapid_app.lib.sync_planner import SyncPlanner
 from rapid_app.models import ProcessorTracker
 
 log = logging.getLogger(__name__)
@@ -27,8 +31,15 @@ class TasksHelper( object ):
             'process_file_from_rapid_url': reverse( 'process_file_from_rapid_url' ),
             'check_data_url': reverse( 'admin:rapid_app_printtitledev_changelist' ),
             'create_ss_file_url': reverse( 'create_ss_file_url' ),
+            'download_ss_file_url': reverse( 'download_ss_file_url' ),
+            'download_holdings_url': reverse( 'download_holdings_url' ),
+            'plan_titles_update_url': reverse( 'plan_titles_update_url' ),
+            'update_titles_url': reverse( 'update_titles_url' ),
+            'sync_plan_data': self._make_sync_plan_dct(),
+            'ss_export_data': SSBuilder().make_export_dct(),
+            'run_trend_data': RunHistoryEstimator().make_trend(),
             'grab_file_data': {'exists': grab_file_dct['exists'], 'host': request.get_host().decode('utf-8'), 'path': grab_file_dct['start_fpath'], 'size': grab_file_dct['size'], 'date': grab_file_dct['date'] },
-            'process_file_data': { 'status': process_dct['status'], 'percent_done': process_dct['percent_done'], 'time_left': process_dct['time_left'], 'last_run': '`{}`'.format( process_dct['last_run'] ), 'allow_processing': process_dct['allow_processing'] },
+            'process_file_data': { 'status': process_dct['status'], 'percent_done': process_dct['percent_done'], 'time_left': process_dct['time_left'], 'last_run': '`{}`'.format( process_dct['last_run'] ), 'allow_processing': process_dct['allow_processing'], 'queued_count': process_dct['queued_count'], 'status_url': reverse( 'job_status_url', kwargs={'job_id': process_dct['job_id']} ), 'events_url': reverse( 'job_events_url', kwargs={'job_id': process_dct['job_id']} ) },
             }
         return d
 
@@ -45,10 +56,11 @@ class TasksHelper( object ):
         return file_dct
 
     def _make_process_file_dct( self ):
-        """ Prepares process-file dct.
+        """ Prepares process-file dct from the newest job's tracker record.
             Called by make_context() """
-        process_dct = { 'allow_processing': True }
-        results = ProcessorTracker.objects.all()  # only one record
+        JobQueue().clear_stale_jobs()  # so a job whose worker died doesn't show as running
+        process_dct = { 'allow_processing': True, 'queued_count': ProcessorTracker.objects.filter(current_status='queued').count() }
+        results = ProcessorTracker.objects.all()  # newest first
         log.debug( 'results, ```{}```'.format(results) )
         if not results:
             log.debug( 'gonna add an initial record' )
@@ -60,14 +72,19 @@ class TasksHelper( object ):
             p.save()
         tracker_data = ProcessorTracker.objects.all()[0]
         recent_processing_dct = json.loads( tracker_data.recent_processing )
+        process_dct['job_id'] = tracker_data.id
         process_dct['status'] = tracker_data.current_status
         process_dct['last_run'] = tracker_data.processing_ended
         process_dct['percent_done'] = recent_processing_dct['percent_done']
         process_dct['time_left'] = recent_processing_dct['time_left']
-        if tracker_data.current_status == 'in_process':
-            process_dct['allow_processing'] = False
         return process_dct
 
+    def _make_sync_plan_dct( self ):
+        """ Prepares pending sync-plan summary, or None.
+            Called by make_context() """
+        sync_planner = SyncPlanner()
+        return sync_planner.make_plan_dct( sync_planner.get_pending_plan() )
+
     def make_response( self, request, data ):
         """ Prepares response.
             Called by views.tasks() """
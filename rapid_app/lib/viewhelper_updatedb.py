@@ -2,8 +2,11 @@
 
 from __future__ import unicode_literals
 
-import logging, os, sets
+import logging, os, time
 from rapid_app import settings_app
+from rapid_app.lib.sync_planner import SyncPlanner
+from rapid_app.lib.table_rotator import TableRotator
+from rapid_app.lib.titles_diff import TitlesMergeDiffer
 from rapid_app.models import ManualDbHandler, PrintTitleDev
 
 log = logging.getLogger(__name__)
@@ -14,23 +17,71 @@ class UpdateTitlesHelper( object ):
 
     def __init__(self):
         self.db_handler = ManualDbHandler()
+        self.sync_planner = SyncPlanner()
+
+    def plan_update( self, request ):
+        """ Builds and caches a sync-plan without writing to easyA; returns it.
+            Called by views.plan_titles_update() """
+        return self.sync_planner.build_plan( self )
 
     def run_update( self, request ):
         """ Calls the backup and update code.
+            Applies the pending sync-plan's cached diff as-is; a plan is built first if none is pending.
+            In `rotate` backup-mode, new data is loaded into a staging table and renamed in, with backups rotated by rename instead of copied.
             Called by views.update_production_easyA_titles() """
-        log.debug( 'calling update_older_backup()' )
-        self.update_older_backup()
-        log.debug( 'calling update_backup()' )
-        self.update_backup()
-        log.debug( 'calling update_production_table()' )
-        self.update_production_table()
+        plan = self.sync_planner.get_pending_plan() or self.plan_update( request )
+        if settings_app.DB_BACKUP_MODE == 'rotate':
+            log.debug( 'calling publish_plan()' )
+            self.publish_plan( plan )
+        else:
+            log.debug( 'calling update_older_backup()' )
+            self.update_older_backup()
+            log.debug( 'calling update_backup()' )
+            self.update_backup()
+            log.debug( 'calling apply_plan()' )
+            self.apply_plan( plan )
+        self.db_handler.log_timings()
         return
 
+    def apply_plan( self, plan ):
+        """ Applies the plan's cached diff and planned row-values, without re-reading either table, and records its timing; returns counts dct.
+            A dev-table load since planning would have superseded the plan.
+            Called by run_update() """
+        log.debug( 'applying sync-plan, `{}`'.format(plan.id) )
+        start = time.time()
+        counts = self.update_production_table( self.sync_planner.get_delta(plan) )
+        self.sync_planner.mark_applied( plan, time.time() - start )
+        return counts
+
+    def publish_plan( self, plan ):
+        """ Publishes PrintTitleDev by table-rotation and records the plan applied, with its timing; returns True if published.
+            The rotation loads the whole dev-table, which the plan's diff describes, so it settles the plan. If the row-count guard stops it, the plan stays pending.
+            Called by run_update() """
+        log.debug( 'publishing for sync-plan, `{}`'.format(plan.id) )
+        start = time.time()
+        published = self.make_table_rotator().publish()
+        if published:
+            self.sync_planner.mark_applied( plan, time.time() - start )
+        return published
+
+    def make_table_rotator( self ):
+        """ Returns a TableRotator for the easyA titles tables; backup, older-backup, and staging names default to production-name suffixes.
+            Called by run_update() and management.commands.rollback_titles_table """
+        production_table = unicode( os.environ['RAPID__TITLES_TABLE_NAME'] )
+        return TableRotator(
+            self.db_handler, settings_app.DB_CONNECTION_URL,
+            production_table=production_table,
+            backup_table=unicode( os.environ.get('RAPID__BACKUP_TABLE_NAME', '%s_backup' % production_table) ),
+            older_table=unicode( os.environ.get('RAPID__BACKUP_OLDER_TABLE_NAME', '%s_backup_older' % production_table) ),
+            staging_table=unicode( os.environ.get('RAPID__STAGING_TABLE_NAME', '%s_staging' % production_table) ),
+            min_rows=settings_app.DB_SYNC_MIN_ROWS,
+            batch_size=self._get_batch_size(len(TableRotator.columns)) )
+
     def update_older_backup( self ):
         """ Copies data from backup table to older backup table.
             Called by run_update() """
         result = self.db_handler.run_sql( sql=unicode(os.environ['RAPID__BACKUP_COUNT_SQL']), connection_url=settings_app.DB_CONNECTION_URL )
-        if result[0][0] > 10000:  # result is like `[(27010,)]`; don't backup if the count is way off
+        if result[0][0] > settings_app.DB_SYNC_MIN_ROWS:  # result is like `[(27010,)]`; don't backup if the count is way off
             self.db_handler.run_sql(
                 sql=unicode(os.environ['RAPID__BACKUP_OLDER_DELETE_SQL']), connection_url=settings_app.DB_CONNECTION_URL )
             if 'sqlite' in settings_app.DB_CONNECTION_URL:
@@ -45,7 +96,7 @@ class UpdateTitlesHelper( object ):
         """ Copies data from production table to backup table.
             Called by run_update() """
         result = self.db_handler.run_sql( sql=unicode(os.environ['RAPID__PRODUCTION_COUNT_SQL']), connection_url=settings_app.DB_CONNECTION_URL )
-        if result[0][0] > 10000:  # result is like `[(27010,)]`; don't backup if the count is way off
+        if result[0][0] > settings_app.DB_SYNC_MIN_ROWS:  # result is like `[(27010,)]`; don't backup if the count is way off
             self.db_handler.run_sql(
                 sql=unicode(os.environ['RAPID__BACKUP_DELETE_SQL']), connection_url=settings_app.DB_CONNECTION_URL )
             if 'sqlite' in settings_app.DB_CONNECTION_URL:
@@ -56,20 +107,38 @@ class UpdateTitlesHelper( object ):
             log.info( 'not backing up because count is only, ```{}```'.format(result) )
         return
 
-    def update_production_table( self ):
-        """ Runs update-production sql.
-            Called by run_update() """
+    def update_production_table( self, delta=None ):
+        """ Runs update-production sql, in one transaction, so a failure leaves easyA as it was and the plan can simply be re-applied; returns counts dct.
+            Applies `delta` and its `rows` values as given, without re-reading either table; otherwise diffs first.
+            Called by apply_plan() """
+        if delta is None:
+            delta = self.make_delta()
+        with self.db_handler.transaction( settings_app.DB_CONNECTION_URL ):
+            self._add_rapid_entries( delta['add'], delta['rows'] )          # insert new rapid records
+            self._update_easya_entries( delta['change'], delta['rows'] )    # rewrite changed easyA records
+            self._remove_easya_entries( delta['delete'] )                   # run easyA deletions
+        counts = { 'added': len(delta['add']), 'updated': len(delta['change']), 'deleted': len(delta['delete']), 'unchanged': delta['unchanged'] }
+        log.info( 'easyA sync counts, ```{}```'.format(counts) )
+        return counts
+
+    def make_delta( self ):
+        """ Diffs read-only; returns dct of key-lists `add`, `change`, `delete`, plus an `unchanged` count and the adds' and changes' `rows` values.
+            Default `merge` diff-mode streams both tables through TitlesMergeDiffer, and also finds rows whose fingerprinted columns changed.
+            `set` mode loads all keys of both into memory, and only finds adds and deletes.
+            Called by update_production_table() and SyncPlanner.build_plan() """
+        if settings_app.DB_SYNC_DIFF_MODE == 'merge':
+            return TitlesMergeDiffer( self.db_handler, settings_app.DB_CONNECTION_URL, unicode(os.environ['RAPID__TITLES_TABLE_NAME']) ).diff()
         ( rapid_keys, easya_keys, key_int ) = self._setup_vars()        # setup
         rapid_keys = self._populate_rapid_keys( rapid_keys )            # get rapid keys
         easya_keys = self._populate_easya_keys( easya_keys, key_int )   # get easyA keys
         ( rapid_not_in_easya, easya_not_in_rapid ) = self._intersect_keys( rapid_keys, easya_keys)  # intersect sets
-        self._add_rapid_entries( rapid_not_in_easya )                   # insert new rapid records
-        self._remove_easya_entries( easya_not_in_rapid )                # run easyA deletions
-        return
+        return {
+            'add': rapid_not_in_easya, 'change': [], 'delete': easya_not_in_rapid, 'unchanged': len(rapid_keys) - len(rapid_not_in_easya),
+            'rows': self._populate_rapid_rows(rapid_not_in_easya) }
 
     def _setup_vars( self ):
         """ Preps vars.
-            Called by update_production_table() """
+            Called by make_delta() """
         rapid_keys = []
         easya_keys = []
         tuple_keys = { 'key': 0, 'issn': 1, 'start': 2, 'end': 3, 'location': 4, 'call_number': 5 }
@@ -78,57 +147,105 @@ class UpdateTitlesHelper( object ):
 
     def _populate_rapid_keys( self, rapid_keys ):
         """ Preps list of rapid keys.
-            Called by update_production_table() """
-        for title in PrintTitleDev.objects.all():
-            rapid_keys.append( title.key )
+            Called by make_delta() """
+        for key in PrintTitleDev.objects.values_list( 'key', flat=True ).iterator():
+            rapid_keys.append( key )
         log.debug( 'len rapid_keys, {}'.format(len(rapid_keys)) )
         return rapid_keys
 
     def _populate_easya_keys( self, easya_keys, key_int ):
         """ Preps list of easya keys.
-            Called by update_production_table() """
-        sql = 'SELECT * FROM `{}`'.format( unicode(os.environ['RAPID__TITLES_TABLE_NAME']) )
+            Called by make_delta() """
+        sql = 'SELECT `key` FROM `{}`'.format( unicode(os.environ['RAPID__TITLES_TABLE_NAME']) )
         result = self.db_handler.run_sql( sql=sql, connection_url=settings_app.DB_CONNECTION_URL )
         for row_tuple in result:
-            easya_keys.append( row_tuple[key_int] )
+            easya_keys.append( row_tuple[0] )
         log.debug( 'len easya_keys, {}'.format(len(easya_keys)) )
         return easya_keys
 
+    def _populate_rapid_rows( self, keys ):
+        """ Returns { key: [issn, start, end, building, call_number] } for the keys, in chunked queries.
+            Called by make_delta() """
+        ( rows, keys, batch_size ) = ( {}, sorted(keys), self._get_batch_size(1) )
+        for i in range( 0, len(keys), batch_size ):
+            for values in PrintTitleDev.objects.filter( key__in=keys[i:i+batch_size] ).values_list( 'key', 'issn', 'start', 'end', 'building', 'call_number' ):
+                rows[values[0]] = list( values[1:] )
+        return rows
+
     def _intersect_keys( self, rapid_keys, easya_keys):
         """ Runs set work.
-            Called by update_production_table() """
-        rapid_not_in_easya = list( sets.Set(rapid_keys) - sets.Set(easya_keys) )
-        easya_not_in_rapid = list( sets.Set(easya_keys) - sets.Set(rapid_keys) )
+            Called by make_delta() """
+        ( rapid_keys, easya_keys ) = ( set(rapid_keys), set(easya_keys) )
+        rapid_not_in_easya = list( rapid_keys - easya_keys )
+        easya_not_in_rapid = list( easya_keys - rapid_keys )
         log.debug( 'rapid_not_in_easya, {}'.format(rapid_not_in_easya) )
         log.debug( 'easya_not_in_rapid, {}'.format(easya_not_in_rapid) )
         return ( rapid_not_in_easya, easya_not_in_rapid )
 
-    def _add_rapid_entries( self, rapid_not_in_easya ):
-        """ Runs inserts of new records.
+    def _add_rapid_entries( self, rapid_not_in_easya, rows ):
+        """ Inserts new records, from the planned `rows` values, with chunked multi-row INSERTs.
             Called by update_production_table() """
-        for rapid_key in rapid_not_in_easya:
-            rapid_title = PrintTitleDev.objects.get( key=rapid_key )
-            sql = '''
-                INSERT INTO `{destination_table}` ( `key`, `issn`, `start`, `end`, `location`, `call_number` )
-                VALUES ( '{key}', '{issn}', '{start}', '{end}', '{building}', '{call_number}' );
-                '''.format( destination_table=unicode(os.environ['RAPID__TITLES_TABLE_NAME']), key=rapid_title.key, issn=rapid_title.issn, start=rapid_title.start, end=rapid_title.end, building=rapid_title.building, call_number=rapid_title.call_number )
-            self.db_handler.run_sql( sql=sql, connection_url=settings_app.DB_CONNECTION_URL )
-        log.debug( 'rapid additions to easyA complete' )
+        columns = [ 'key', 'issn', 'start', 'end', 'location', 'call_number' ]
+        batch_size = self._get_batch_size( len(columns) )
+        keys = sorted( rapid_not_in_easya )
+        for i in range( 0, len(keys), batch_size ):
+            ( values_sql, params ) = self._make_insert_values( [ [key] + rows[key] for key in keys[i:i+batch_size] ] )
+            sql = 'INSERT INTO `{destination_table}` ( {columns} ) VALUES {values_sql}'.format(
+                destination_table=unicode(os.environ['RAPID__TITLES_TABLE_NAME']), columns=', '.join(['`%s`' % column for column in columns]), values_sql=values_sql )
+            self.db_handler.run_sql( sql=sql, connection_url=settings_app.DB_CONNECTION_URL, params=params )
+        log.debug( 'rapid additions to easyA complete; count, `{}`'.format(len(keys)) )
+        return
+
+    def _make_insert_values( self, value_lists ):
+        """ Returns ( `( :key_0, ... ), ( :key_1, ... )` sql, params-dct ) for a chunk of [key, issn, start, end, building, call_number] lists.
+            Note: easyA's `location` column holds the rapid `building`.
+            Called by _add_rapid_entries() """
+        ( value_rows, params ) = ( [], {} )
+        for ( i, ( key, issn, start, end, building, call_number ) ) in enumerate( value_lists ):
+            row_params = { 'key_%s' % i: key, 'issn_%s' % i: issn, 'start_%s' % i: start, 'end_%s' % i: end, 'location_%s' % i: building, 'call_number_%s' % i: call_number }
+            value_rows.append( '( :key_{i}, :issn_{i}, :start_{i}, :end_{i}, :location_{i}, :call_number_{i} )'.format(i=i) )
+            params.update( row_params )
+        return ( ', '.join(value_rows), params )
+
+    def _update_easya_entries( self, changed_keys, rows ):
+        """ Rewrites the fingerprinted columns of changed records to the planned `rows` values; one executemany UPDATE per chunk.
+            Called by update_production_table() """
+        sql = '''
+            UPDATE `{destination_table}`
+            SET `issn` = :issn, `start` = :start, `end` = :end, `location` = :location, `call_number` = :call_number
+            WHERE `key` = :key
+            '''.format( destination_table=unicode(os.environ['RAPID__TITLES_TABLE_NAME']) )
+        batch_size = self._get_batch_size( 1 )
+        keys = sorted( changed_keys )
+        for i in range( 0, len(keys), batch_size ):
+            params = [
+                dict( zip(['issn', 'start', 'end', 'location', 'call_number'], rows[key]), key=key )
+                for key in keys[i:i+batch_size] ]
+            self.db_handler.run_sql( sql=sql, connection_url=settings_app.DB_CONNECTION_URL, params=params )
+        log.debug( 'easyA updates complete; count, `{}`'.format(len(keys)) )
         return
 
     def _remove_easya_entries( self, easya_not_in_rapid ):
-        """ Runs deletion of old records.
+        """ Deletes old records with chunked `WHERE key IN (...)` statements.
             Called by update_production_table() """
-        for easya_key in easya_not_in_rapid:
-            sql = '''
-                DELETE FROM `{destination_table}`
-                WHERE `key` = '{easya_key}'
-                LIMIT 1;
-                '''.format( destination_table=unicode(os.environ['RAPID__TITLES_TABLE_NAME']), easya_key=easya_key )
-            self.db_handler.run_sql( sql=sql, connection_url=settings_app.DB_CONNECTION_URL )
-        log.debug( 'easyA deletions complete' )
+        batch_size = self._get_batch_size( 1 )
+        keys = sorted( easya_not_in_rapid )
+        for i in range( 0, len(keys), batch_size ):
+            chunk = keys[i:i+batch_size]
+            sql = 'DELETE FROM `{destination_table}` WHERE `key` IN ( {placeholders} )'.format(
+                destination_table=unicode(os.environ['RAPID__TITLES_TABLE_NAME']), placeholders=', '.join([':key_%s' % j for j in range(len(chunk))]) )
+            self.db_handler.run_sql( sql=sql, connection_url=settings_app.DB_CONNECTION_URL, params=dict(('key_%s' % j, key) for (j, key) in enumerate(chunk)) )
+        log.debug( 'easyA deletions complete; count, `{}`'.format(len(keys)) )
         return
 
+    def _get_batch_size( self, params_per_row ):
+        """ Returns rows per statement; sqlite allows only 999 bound parameters per statement.
+            Called by make_table_rotator(), _populate_rapid_rows(), _add_rapid_entries(), _update_easya_entries(), and _remove_easya_entries() """
+        batch_size = settings_app.DB_SYNC_BATCH_SIZE
+        if 'sqlite' in settings_app.DB_CONNECTION_URL:
+            batch_size = min( batch_size, 999 // params_per_row )
+        return batch_size
+
     # def update_production_table( self ):
     #     """ Runs update-production sql.
     #         TODO: a more elegant way to do this would be to query both tables, do a set intersection, and then do the appropriate small loop of additions and deletes.
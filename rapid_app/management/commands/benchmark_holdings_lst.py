@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import logging, random, time
+from django.core.management.base import BaseCommand
+from rapid_app import settings_app
+from rapid_app.lib.processor import HoldingRecord, RapidFileProcessor
+
+log = logging.getLogger(__name__)
+
+
+class Command( BaseCommand ):
+    """ Times RapidFileProcessor.build_holdings_lst() on synthetic holdings.
+        Usage: `python ./manage.py benchmark_holdings_lst --sizes 10000 100000 1000000`
+        Per-holding time should stay flat as the size grows. """
+
+    help = 'Times build_holdings_lst() on synthetic holdings, to check it scales linearly.'
+
+    def add_arguments( self, parser ):
+        parser.add_argument( '--sizes', nargs='+', type=int, default=[10000, 100000, 1000000] )
+        parser.add_argument( '--seed', type=int, default=1 )
+
+    def handle( self, *args, **options ):
+        logging.getLogger( 'rapid_app' ).setLevel( logging.INFO )  # debug-logging the whole list would swamp the timing
+        processor = RapidFileProcessor( settings_app.FROM_RAPID_FILEPATH, settings_app.FROM_RAPID_UTF8_FILEPATH )
+        self.stdout.write( '{:>10}  {:>10}  {:>12}'.format('holdings', 'seconds', 'usec/holding') )
+        for size in options['sizes']:
+            holdings_dct = self.make_holdings_dct( size, random.Random(options['seed']) )
+            start = time.time()
+            processor.build_holdings_lst( holdings_dct )
+            elapsed = time.time() - start
+            self.stdout.write( '{:>10}  {:>10.3f}  {:>12.2f}'.format(size, elapsed, (elapsed / size) * 1000000) )
+        return
+
+    def make_holdings_dct( self, size, rand ):
+        """ Builds a holdings dct of HoldingRecords with a few gappy year-runs each.
+            Called by handle() """
+        holdings_dct = {}
+        for i in xrange( size ):
+            issn = '{:04d}-{:04d}'.format( i // 10000, i % 10000 )
+            holding = HoldingRecord( issn, 'title %s' % i, 'url %s' % i, 'sci', 'Sciences', 'QA%s .A1' % i )
+            first_year = rand.randint( 1900, 1990 )
+            for year in xrange( first_year, first_year + rand.randint(1, 25) ):
+                if rand.random() > 0.2:
+                    holding.add_year( unicode(year) )
+            holdings_dct[ '%s%s' % (issn, i) ] = holding
+        return holdings_dct
+
+    # end class Command
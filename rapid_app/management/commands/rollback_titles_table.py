@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import logging
+from django.core.management.base import BaseCommand
+from rapid_app.lib.viewhelper_updatedb import UpdateTitlesHelper
+
+log = logging.getLogger(__name__)
+
+
+class Command( BaseCommand ):
+    """ Restores the easyA titles table from its backup, after a `rotate`-mode publish.
+        Usage: `python ./manage.py rollback_titles_table` """
+
+    help = 'Renames the easyA titles backup back into production.'
+
+    def handle( self, *args, **options ):
+        UpdateTitlesHelper().make_table_rotator().rollback()
+        self.stdout.write( 'rolled back' )
+        return
+
+    # end class Command
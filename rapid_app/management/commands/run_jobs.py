@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import logging
+from django.core.management.base import BaseCommand
+from rapid_app.lib.job_queue import JobQueue
+
+log = logging.getLogger(__name__)
+
+
+class Command( BaseCommand ):
+    """ Runs queued processing jobs, oldest first, one at a time.
+        Usage: `python ./manage.py run_jobs` (keeps polling; run under a process supervisor)
+               `python ./manage.py run_jobs --once` (exits when the queue is empty; suits cron) """
+
+    help = 'Runs queued processing jobs in order.'
+
+    def add_arguments( self, parser ):
+        parser.add_argument( '--once', action='store_true', default=False, help='exit when no queued jobs remain' )
+
+    def handle( self, *args, **options ):
+        count = JobQueue().run_pending( once=options['once'] )
+        self.stdout.write( 'jobs run, `{}`'.format(count) )
+        return
+
+    # end class Command
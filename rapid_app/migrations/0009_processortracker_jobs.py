@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rapid_app', '0008_auto_20160907_1034'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='processortracker',
+            options={'ordering': ['-id'], 'verbose_name_plural': 'Processor Tracker'},
+        ),
+        migrations.AddField(
+            model_name='processortracker',
+            name='error',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processortracker',
+            name='heartbeat',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processortracker',
+            name='job_type',
+            field=models.CharField(default='process_file', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='processortracker',
+            name='queued_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
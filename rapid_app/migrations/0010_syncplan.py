@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 03:53
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rapid_app', '0009_processortracker_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncPlan',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('status', models.CharField(default='pending', max_length=20)),
+                ('delta', models.TextField()),
+                ('add_count', models.IntegerField(default=0)),
+                ('change_count', models.IntegerField(default=0)),
+                ('delete_count', models.IntegerField(default=0)),
+                ('unchanged_count', models.IntegerField(default=0)),
+                ('estimated_statements', models.IntegerField(default=0)),
+                ('estimated_seconds', models.FloatField(blank=True, null=True)),
+                ('applied', models.DateTimeField(blank=True, null=True)),
+                ('applied_seconds', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-id'],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 04:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rapid_app', '0010_syncplan'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RunHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started', models.DateTimeField()),
+                ('ended', models.DateTimeField(blank=True, null=True)),
+                ('status', models.CharField(max_length=20)),
+                ('source_bytes', models.BigIntegerField(default=0)),
+                ('total_seconds', models.FloatField(blank=True, null=True)),
+                ('stages', models.TextField()),
+                ('job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='rapid_app.ProcessorTracker')),
+            ],
+            options={
+                'ordering': ['-id'],
+                'verbose_name_plural': 'Run History',
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 05:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rapid_app', '0011_runhistory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processortracker',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+    ]
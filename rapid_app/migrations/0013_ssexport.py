@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 05:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rapid_app', '0012_processortracker_attempts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SSExportGeneration',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('wrote_full_file', models.BooleanField(default=False)),
+                ('wrote_delta_file', models.BooleanField(default=False)),
+                ('row_count', models.IntegerField(default=0)),
+                ('new_count', models.IntegerField(default=0)),
+                ('changed_count', models.IntegerField(default=0)),
+                ('deleted_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SSExportRow',
+            fields=[
+                ('key', models.CharField(max_length=20, primary_key=True, serialize=False)),
+                ('fingerprint', models.CharField(max_length=40)),
+                ('row', models.TextField()),
+                ('generation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='rapid_app.SSExportGeneration')),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 06:20
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rapid_app', '0013_ssexport'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='printtitledev',
+            index_together=set([('location', 'key'), ('building', 'key'), ('issn', 'key')]),
+        ),
+    ]
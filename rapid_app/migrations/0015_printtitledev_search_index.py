@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-18 07:05
+from __future__ import unicode_literals
+
+import logging
+from django.db import migrations
+from django.db.utils import OperationalError
+
+log = logging.getLogger(__name__)
+
+
+def create_search_index( apps, schema_editor ):
+    """ Adds the admin's full-text index: a filled fts5 table on sqlite, a FULLTEXT index on mysql.
+        A sqlite build without fts5 is left without one; the admin then uses its default search. """
+    ( connection, qn ) = ( schema_editor.connection, schema_editor.quote_name )
+    columns = ', '.join( [ qn('title'), qn('call_number'), qn('url') ] )
+    if connection.vendor == 'mysql':
+        schema_editor.execute( 'CREATE FULLTEXT INDEX rapid_app_printtitledev_search ON rapid_app_printtitledev ({})'.format(columns) )
+    elif connection.vendor == 'sqlite':
+        try:
+            schema_editor.execute( "CREATE VIRTUAL TABLE rapid_app_printtitledev_fts USING fts5( {key} UNINDEXED, {columns}, prefix='2 3' )".format(key=qn('key'), columns=columns) )
+        except OperationalError as e:
+            log.warning( 'no fts5, so no search index; error, ```{}```'.format(e) )
+            return
+        schema_editor.execute( 'INSERT INTO rapid_app_printtitledev_fts ({key}, {columns}) SELECT {key}, {columns} FROM rapid_app_printtitledev'.format(key=qn('key'), columns=columns) )
+
+
+def drop_search_index( apps, schema_editor ):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute( 'DROP INDEX rapid_app_printtitledev_search ON rapid_app_printtitledev' )
+    elif schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute( 'DROP TABLE IF EXISTS rapid_app_printtitledev_fts' )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rapid_app', '0014_printtitledev_api_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython( create_search_index, drop_search_index ),
+    ]
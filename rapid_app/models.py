@@ -2,7 +2,7 @@
 
 from __future__ import unicode_literals
 
-import codecs, csv, datetime, ftplib, itertools, json, logging, operator, os, pprint, shutil, time, zipfile
+import codecs, contextlib, csv, datetime, ftplib, itertools, json, logging, operator, os, pprint, shutil, threading, time, zipfile
 import MySQLdb  # really pymysql; see config/__init__.py
 import requests
 from django.conf import settings as project_settings
@@ -13,7 +13,7 @@ from django.shortcuts import render
 from django.utils.encoding import smart_unicode
 from django.utils.text import slugify
 from rapid_app import settings_app
-from sqlalchemy import create_engine as alchemy_create_engine
+from sqlalchemy import create_engine as alchemy_create_engine, text as alchemy_text
 
 
 log = logging.getLogger(__name__)
@@ -41,25 +41,114 @@ class PrintTitleDev( models.Model ):
     def __unicode__(self):
         return '%s__%s_to_%s' % ( self.issn, self.start, self.end )
 
+    class Meta:
+        index_together = [ ['issn', 'key'], ['building', 'key'], ['location', 'key'] ]  # filtered, key-ordered api pages
+
     # end class PrintTitleDev
 
 
 class ProcessorTracker( models.Model ):
-    """ Tracks current-status and recent-processing. """
-    current_status = models.CharField( max_length=50, blank=True, null=True )
+    """ Per-job status record; also tracks recent-processing, for time-left estimates.
+        Jobs are queued by lib.job_queue.JobQueue and run in order by the `run_jobs` management command. """
+    job_type = models.CharField( max_length=50, default='process_file' )
+    current_status = models.CharField( max_length=50, blank=True, null=True )  # queued, started, in_process, complete, failed
+    queued_at = models.DateTimeField( blank=True, null=True )
     processing_started = models.DateTimeField( blank=True, null=True )
     processing_ended = models.DateTimeField( blank=True, null=True )
+    heartbeat = models.DateTimeField( blank=True, null=True )  # last progress-update by the job-worker
+    attempts = models.IntegerField( default=0 )  # claims so far; a job whose worker died is re-queued until MAX_JOB_ATTEMPTS
     recent_processing = models.TextField( blank=True, null=True )
+    error = models.TextField( blank=True, null=True )
 
     def __unicode__(self):
-        return '{status}__{started}'.format( status=self.current_status, started=self.processing_started )
+        return '{id}__{status}__{started}'.format( id=self.id, status=self.current_status, started=self.processing_started )
 
     class Meta:
        verbose_name_plural = "Processor Tracker"
+       ordering = [ '-id' ]
 
     # end class PrintTitleDev
 
 
+class SSExportGeneration( models.Model ):
+    """ One serials-solutions export; the rows it left exported are in SSExportRow.
+        Made by lib.ss_builder.SSBuilder.export(); an export with no changes makes none. """
+    created = models.DateTimeField( auto_now_add=True )
+    wrote_full_file = models.BooleanField( default=False )
+    wrote_delta_file = models.BooleanField( default=False )
+    row_count = models.IntegerField( default=0 )
+    new_count = models.IntegerField( default=0 )
+    changed_count = models.IntegerField( default=0 )
+    deleted_count = models.IntegerField( default=0 )
+
+    def __unicode__(self):
+        return '{id}__{created}'.format( id=self.id, created=self.created )
+
+    class Meta:
+       ordering = [ '-id' ]
+
+    # end class SSExportGeneration
+
+
+class SSExportRow( models.Model ):
+    """ A title-row as last exported to serials-solutions; the next delta is made against these.
+        Maintained by lib.ss_builder.SSBuilder.export(). """
+    key = models.CharField( max_length=20, primary_key=True )  # PrintTitleDev key
+    fingerprint = models.CharField( max_length=40 )
+    row = models.TextField()  # json list, as written; a deleted row is written to the delta from this
+    generation = models.ForeignKey( SSExportGeneration )  # export that last wrote this row
+
+    def __unicode__(self):
+        return '{key}__{generation}'.format( key=self.key, generation=self.generation_id )
+
+    # end class SSExportRow
+
+
+class RunHistory( models.Model ):
+    """ One processing run's per-stage timings; feeds time-left estimates and the tasks-page trend.
+        Recorded by lib.run_history.RunRecorder. """
+    job = models.ForeignKey( ProcessorTracker, blank=True, null=True, on_delete=models.SET_NULL )
+    started = models.DateTimeField()
+    ended = models.DateTimeField( blank=True, null=True )
+    status = models.CharField( max_length=20 )  # complete, failed
+    source_bytes = models.BigIntegerField( default=0 )  # bytes the parse-stage read; stage-throughputs are relative to this
+    total_seconds = models.FloatField( blank=True, null=True )
+    stages = models.TextField()  # json; { stage: {'seconds': s, 'rows_in': n, 'rows_out': n, 'peak_memory_kb': n}, ... }
+
+    def __unicode__(self):
+        return '{id}__{status}__{started}'.format( id=self.id, status=self.status, started=self.started )
+
+    class Meta:
+       verbose_name_plural = "Run History"
+       ordering = [ '-id' ]
+
+    # end class RunHistory
+
+
+class SyncPlan( models.Model ):
+    """ Cached, read-only diff between PrintTitleDev and the easyA titles table, with a cost estimate.
+        Built by lib.sync_planner.SyncPlanner; applied as-is by UpdateTitlesHelper.run_update(). """
+    created = models.DateTimeField( auto_now_add=True )
+    status = models.CharField( max_length=20, default='pending' )  # pending, applied, superseded
+    delta = models.TextField()  # json; { 'add': [keys], 'change': [keys], 'delete': [keys], 'unchanged': count }
+    add_count = models.IntegerField( default=0 )
+    change_count = models.IntegerField( default=0 )
+    delete_count = models.IntegerField( default=0 )
+    unchanged_count = models.IntegerField( default=0 )
+    estimated_statements = models.IntegerField( default=0 )
+    estimated_seconds = models.FloatField( blank=True, null=True )  # None until a plan has been applied and timed
+    applied = models.DateTimeField( blank=True, null=True )
+    applied_seconds = models.FloatField( blank=True, null=True )
+
+    def __unicode__(self):
+        return '{id}__{status}__{created}'.format( id=self.id, status=self.status, created=self.created )
+
+    class Meta:
+       ordering = [ '-id' ]
+
+    # end class SyncPlan
+
+
 #####################
 ## regular classes ##
 #####################
@@ -123,22 +212,113 @@ class RapidFileGrabber( object ):
 
 class ManualDbHandler( object ):
     """ Backs-up and writes to non-rapid-manager print-titles table.
+        Engines are pooled and kept for the life of the process, one per connection-url.
+        Statements can take bound parameters, can be grouped with transaction(), and are timed.
         Non-django class. """
 
-    def run_sql( self, sql, connection_url ):
-        """ Executes sql.
-            Called by UpdateTitlesHelper._make_backup_table() """
-        time.sleep( .25 )
+    engines = {}  # { connection_url: engine }; class-level, so all handlers share the pools
+    engines_lock = threading.Lock()
+
+    def __init__( self ):
+        self.connection = None  # set by transaction(); run_sql() uses it while set
+        self.statement_timings = []  # [ (sql-summary, seconds, rowcount), ... ]
+
+    def get_engine( self, connection_url ):
+        """ Returns the pooled engine for the url, creating it on first use.
+            Called by run_sql() and transaction() """
+        with self.engines_lock:
+            if connection_url not in self.engines:
+                log.debug( 'creating engine for, ```%s```' % connection_url.split('@')[-1] )  # no credentials in the log
+                self.engines[connection_url] = alchemy_create_engine( connection_url, pool_recycle=3600 )
+            return self.engines[connection_url]
+
+    def run_sql( self, sql, connection_url, params=None ):
+        """ Executes sql; returns fetched rows for row-returning statements, otherwise None.
+            `params` binds `:name` placeholders: a dct runs the statement once, a list of dcts runs it for each.
+            Inside transaction() the statement joins that transaction, and errors are raised so it rolls back; otherwise errors are logged.
+            Called by UpdateTitlesHelper """
         log.debug( 'sql, ```%s```' % sql )
-        engine = alchemy_create_engine( connection_url )
+        start = time.time()
         try:
-            return_val = None
-            result = engine.execute( sql )
-            if 'fetchall' in dir( result.cursor ):
-                return_val = result.cursor.fetchall()
+            executor = self.connection if self.connection is not None else self.get_engine( connection_url )
+            result = executor.execute( alchemy_text(sql), params ) if params is not None else executor.execute( sql )
+            return_val = result.fetchall() if result.returns_rows else None
+            self.record_timing( sql, time.time() - start, result.rowcount )
             result.close()
             return return_val
         except Exception as e:
             log.error( 'exception executing sql, ```{}```'.format(unicode(repr(e))) )
+            if self.connection is not None:
+                raise
+
+    def iter_sql( self, sql, connection_url, params=None, chunk_size=1000 ):
+        """ Yields rows, fetching chunk_size at a time, so large results aren't loaded whole.
+            On mysql the statement runs on the driver's unbuffered SSCursor: sqlalchemy 1.0's `stream_results` only streams under psycopg2, and a default mysql cursor reads the whole result on execute.
+            sqlite already steps through results as they're fetched.
+            Called by TitlesMergeDiffer.iter_easya_rows() """
+        log.debug( 'streaming sql, ```%s```' % sql )
+        start = time.time()
+        engine = self.get_engine( connection_url )
+        compiled = alchemy_text( sql ).compile( dialect=engine.dialect )  # `:name` binds in the driver's paramstyle
+        bind_params = compiled.construct_params( params or {} )
+        args = [ bind_params[name] for name in compiled.positiontup ] if compiled.positional else bind_params
+        raw_connection = engine.raw_connection()
+        cursor = raw_connection.cursor( engine.dialect.dbapi.cursors.SSCursor ) if engine.dialect.name == 'mysql' else raw_connection.cursor()
+        try:
+            cursor.execute( unicode(compiled), args )
+            row_count = 0
+            while True:
+                rows = cursor.fetchmany( chunk_size )
+                if not rows:
+                    break
+                row_count += len( rows )
+                for row in rows:
+                    yield row
+            self.record_timing( sql, time.time() - start, row_count )
+        finally:
+            cursor.close()  # an SSCursor reads off any unfetched rows first
+            raw_connection.close()  # back to the pool
+
+    @contextlib.contextmanager
+    def transaction( self, connection_url ):
+        """ Runs the enclosed run_sql() calls on one connection in one transaction; commits on success, rolls back on error.
+            Called by UpdateTitlesHelper """
+        connection = self.get_engine( connection_url ).connect()
+        trans = connection.begin()
+        self.connection = connection
+        try:
+            yield connection
+            trans.commit()
+        except Exception:
+            trans.rollback()
+            raise
+        finally:
+            self.connection = None
+            connection.close()
+
+    def record_timing( self, sql, seconds, rowcount ):
+        """ Saves and debug-logs a statement's timing.
+            Called by run_sql() """
+        summary = ' '.join( sql.split() )[0:80]
+        self.statement_timings.append( (summary, seconds, rowcount) )
+        log.debug( 'sql took `{seconds:.4f}` seconds; rowcount, `{rowcount}`'.format(seconds=seconds, rowcount=rowcount) )
+        return
+
+    def get_timing_summary( self ):
+        """ Returns { statement-kind: {'count': n, 'seconds': total} } from recorded timings, keyed on the first sql word.
+            Called by log_timings() """
+        summary = {}
+        for ( sql_summary, seconds, rowcount ) in self.statement_timings:
+            kind = sql_summary.split( ' ' )[0].upper() if sql_summary else ''
+            entry = summary.setdefault( kind, {'count': 0, 'seconds': 0.0} )
+            entry['count'] += 1
+            entry['seconds'] += seconds
+        return summary
+
+    def log_timings( self ):
+        """ Logs where statement time went.
+            Called by UpdateTitlesHelper.run_update() """
+        log.info( 'sql timings, ```{}```'.format(pprint.pformat(self.get_timing_summary())) )
+        return
 
     # end class ManualDbHandler
@@ -21,11 +21,38 @@ ZIPFILE_EXTRACT_FILENAME = unicode( os.environ['RAPID__ZIPFILE_EXTRACT_FILENAME'
 FROM_RAPID_FILEPATH = '%s/%s' % ( ZIPFILE_EXTRACT_DIR_PATH, ZIPFILE_EXTRACT_FILENAME )
 FROM_RAPID_UTF8_FILEPATH = unicode( os.environ['RAPID__FROM_RAPID_UTF8_FILEPATH'] )
 LOCATIONS_URL = unicode( os.environ['RAPID__LOCATIONS_JSON_URL'] )
+LOCATIONS_CACHE_PATH = unicode( os.environ.get('RAPID__LOCATIONS_CACHE_PATH', os.path.join(os.path.dirname(FROM_RAPID_UTF8_FILEPATH), 'locations_cache.json')) )
+LOCATIONS_CACHE_MAX_AGE = int( os.environ.get('RAPID__LOCATIONS_CACHE_MAX_AGE', '86400') )  # seconds; used when the service sends no Cache-Control max-age
+LOCATIONS_TIMEOUT = int( os.environ.get('RAPID__LOCATIONS_TIMEOUT', '10') )  # seconds
 DISCOVERY_SOLR_URL = unicode( os.environ['RAPID__DISCOVERY_SOLR_URL'] )
+SOLR_BATCH_SIZE = int( os.environ.get('RAPID__SOLR_BATCH_SIZE', '50') )  # issns per batched title-query
+SOLR_CONCURRENCY = int( os.environ.get('RAPID__SOLR_CONCURRENCY', '4') )  # simultaneous title-queries
+TITLE_CACHE_PATH = unicode( os.environ.get('RAPID__TITLE_CACHE_PATH', os.path.join(os.path.dirname(FROM_RAPID_UTF8_FILEPATH), 'issn_title_cache.sqlite3')) )  # sqlite file; seeded from ISSN_JSON_PATH
+TITLE_CACHE_NEGATIVE_TTL_DAYS = float( os.environ.get('RAPID__TITLE_CACHE_NEGATIVE_TTL_DAYS', '7') )  # how long a solr-miss is trusted
+JOB_POLL_SECONDS = int( os.environ.get('RAPID__JOB_POLL_SECONDS', '5') )  # how often the `run_jobs` worker checks for queued jobs
+PROGRESS_FLUSH_SECONDS = float( os.environ.get('RAPID__PROGRESS_FLUSH_SECONDS', '2') )  # most-frequent progress db-write while parsing
+PROGRESS_EVENTS_POLL_SECONDS = int( os.environ.get('RAPID__PROGRESS_EVENTS_POLL_SECONDS', '1') )  # how often the events-stream checks the tracker
+PROGRESS_EVENTS_MAX_SECONDS = int( os.environ.get('RAPID__PROGRESS_EVENTS_MAX_SECONDS', '60') )  # events-stream length before the browser reconnects
+CHECKPOINT_PATH = unicode( os.environ.get('RAPID__CHECKPOINT_PATH', os.path.join(os.path.dirname(FROM_RAPID_UTF8_FILEPATH), 'parse_checkpoint.pickle.zlib')) )  # resumable parse-state
+CHECKPOINT_SECONDS = float( os.environ.get('RAPID__CHECKPOINT_SECONDS', '60') )  # most-frequent parse checkpoint
+HEARTBEAT_SECONDS = float( os.environ.get('RAPID__HEARTBEAT_SECONDS', '30') )  # most-frequent heartbeat from the solr and db-load loops; stages always send one
+STALE_JOB_SECONDS = int( os.environ.get('RAPID__STALE_JOB_SECONDS', '900') )  # a running job with no heartbeat for this long has lost its worker
+MAX_JOB_ATTEMPTS = int( os.environ.get('RAPID__MAX_JOB_ATTEMPTS', '3') )  # stale jobs are re-queued until claimed this many times, then failed
+SS_EXPORT_MODE = unicode( os.environ.get('RAPID__SS_EXPORT_MODE', 'both') )  # `both` writes the full and delta files; `delta` writes the full file only on request
+SS_DELTA_FILEPATH = os.environ.get( 'RAPID__TO_SS_DELTA_FILEPATH' )  # changes since the previous export; unset, it's derived from the export's path, `<name>_delta<ext>`
+RUN_HISTORY_TREND_COUNT = int( os.environ.get('RAPID__RUN_HISTORY_TREND_COUNT', '10') )  # recent runs used for time-left estimates and shown in the tasks-page trend
 ISSN_JSON_PATH = unicode( os.environ['RAPID__ISSN_DCT_PATH'] )
+PARSE_WORKERS = int( os.environ.get('RAPID__PARSE_WORKERS', '1') )  # >1 parses the utf8-file in that many processes
+DEV_DB_BATCH_SIZE = int( os.environ.get('RAPID__DEV_DB_BATCH_SIZE', '500') )  # rows per bulk insert/delete statement
+DEV_DB_LOAD_MODE = unicode( os.environ.get('RAPID__DEV_DB_LOAD_MODE', 'diff') )  # `diff` updates in place; `shadow` loads a copy and swaps it in
+FACET_CACHE_SECONDS = int( os.environ.get('RAPID__FACET_CACHE_SECONDS', '600') )  # admin building/location filter-counts; a finished load always refreshes them
 
 ## update production db ##
 DB_CONNECTION_URL = unicode( os.environ['RAPID__MANUAL_DB_CONNECTION_URL'] )
+DB_SYNC_BATCH_SIZE = int( os.environ.get('RAPID__DB_SYNC_BATCH_SIZE', '500') )  # rows per multi-row insert, keys per delete; capped for sqlite's bound-parameter limit
+DB_SYNC_DIFF_MODE = unicode( os.environ.get('RAPID__DB_SYNC_DIFF_MODE', 'merge') )  # `merge` streams both tables in key-order; `set` loads all keys into memory
+DB_BACKUP_MODE = unicode( os.environ.get('RAPID__DB_BACKUP_MODE', 'copy') )  # `copy` runs the RAPID__BACKUP_* sql then syncs in place; `rotate` publishes a staging table by rename
+DB_SYNC_MIN_ROWS = int( os.environ.get('RAPID__DB_SYNC_MIN_ROWS', '10000') )  # row-count sanity guard for backups and publishing
 # DB_TITLES_TABLE = unicode( os.environ['RAPID__TITLES_TABLE_NAME'] )
 
 
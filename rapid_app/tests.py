@@ -1,12 +1,26 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals
-import json, logging, os, pprint
+import BaseHTTPServer, csv, datetime, io, json, logging, os, pprint, shutil, tempfile, threading, urlparse, zlib
+from django.contrib import admin
 from django.test import TestCase
 from rapid_app import settings_app
-from rapid_app.lib.processor import HoldingsDctBuilder, RapidFileProcessor, RowFixer, Utf8Maker, TitleMaker
+from rapid_app.lib.checkpoint import ParseCheckpointer
+from rapid_app.lib.devdb_updater import DevDbUpdater, ShadowTableLoader
+from rapid_app.lib.heartbeat import Heartbeat
+from rapid_app.lib.job_queue import JobQueue
+from rapid_app.lib.locations import LocationsResolver
+from rapid_app.lib.progress import ProgressReporter
+from rapid_app.lib.query_stream import QueryStreamer
+from rapid_app.lib.processor import HoldingRecord, HoldingsDctBuilder, PrintLineFilter, RapidFileProcessor, RowFixer, TrackerUpdater, Utf8Maker, TitleMaker
+from rapid_app.lib.run_history import RunHistoryEstimator, RunRecorder
 from rapid_app.lib.ss_builder import SSBuilder
-from rapid_app.models import RapidFileGrabber, ProcessorTracker  # TODO: move RapidFileGrabber to lib from models
+from rapid_app.lib.table_rotator import TableRotator
+from rapid_app.lib.title_search import TitleFacets, TitleSearchIndex
+from rapid_app.lib.title_cache import TitleCache
+from rapid_app.lib.titles_diff import TitlesMergeDiffer
+from rapid_app.lib.viewhelper_updatedb import UpdateTitlesHelper
+from rapid_app.models import ManualDbHandler, PrintTitleDev, RapidFileGrabber, ProcessorTracker, RunHistory, SSExportGeneration, SyncPlan  # TODO: move RapidFileGrabber to lib from models
 from sqlalchemy import create_engine as alchemy_create_engine
 from sqlalchemy.orm import sessionmaker as alchemy_sessionmaker, scoped_session as alchemy_scoped_session
 
@@ -34,12 +48,22 @@ class Utf8MakerTest( TestCase ):
 
     def test__check_utf8_after( self ):
         """ Tests detection of utf8 data. """
-        self.utf8_maker.make_utf8()
+        self.utf8_maker.write_utf8_copy()
         self.assertEqual(
             True,
             self.utf8_maker.check_utf8( settings_app.TEST_FROM_RAPID_UTF8_FILEPATH )
             )
 
+    def test__stream_utf8_lines( self ):
+        """ Tests single-pass transcode; streamed lines, written copy, and byte-progress should all line up. """
+        lines = list( self.utf8_maker.stream_utf8_lines(write_copy=True) )
+        with open( settings_app.TEST_FROM_RAPID_UTF8_FILEPATH, 'rb' ) as f:
+            written = f.read()
+        self.assertEqual( written, b''.join(lines) )
+        self.assertEqual( True, self.utf8_maker.check_utf8(settings_app.TEST_FROM_RAPID_UTF8_FILEPATH) )
+        self.assertEqual( os.path.getsize(settings_app.TEST_FROM_RAPID_FILEPATH), self.utf8_maker.bytes_read )
+        self.assertEqual( self.utf8_maker.bytes_total, self.utf8_maker.bytes_read )
+
     # end class Utf8MakerTest
 
 
@@ -53,30 +77,6 @@ class RapidFileProcessorTest( TestCase ):
             settings_app.TEST_FROM_RAPID_UTF8_FILEPATH,
             )
 
-    def test__contigify_list( self ):
-        """ Tests updating list of single elements to list of lists-of-contiguous elements. """
-        start_lst = [ 1, 2, 3, 5, 6, 8 ]
-        self.assertEqual(
-            [ [1, 2, 3], [5, 6], [8] ],
-            self.processor._contigify_list( start_lst )
-            )
-        start_lst = [ '1', '2', '4', '5', '7' ]
-        self.assertEqual(
-            [ [1, 2], [4, 5], [7] ],
-            self.processor._contigify_list( start_lst )
-            )
-
-    def test__build_years_held( self ):
-        """ Tests converting contig list to list of start-end dcts. """
-        contig_list = [ [1, 2, 3], [5, 6], [8] ]
-        self.assertEqual(
-            [
-                {u'start': 1, u'end': 3},
-                {u'start': 5, u'end': 6},
-                {u'start': 8, u'end': 8}],
-            self.processor._build_years_held( contig_list )
-            )
-
     def test__build_holdings_lst( self ):
         """ Tests conversion of holdings_dct to holdings_lst. """
         holdings_dct = {
@@ -144,6 +144,144 @@ class RapidFileProcessorTest( TestCase ):
     # end class RapidFileProcessorTest
 
 
+class HoldingRecordTest( TestCase ):
+    """ Tests lib.processor.HoldingRecord """
+
+    def setUp( self ):
+        """ Runs initialization. """
+        self.holding = HoldingRecord( '0002-9629', 'title', 'url', 'sci', 'Sciences', 'R11 .A6' )
+
+    def test__year_ranges( self ):
+        """ Checks out-of-order, duplicate, and blank years collapse into contiguous ranges. """
+        for year in [ '5', '8', '', '2', '3', '1', '6', '3' ]:
+            self.holding.add_year( year )
+        self.assertEqual( [ (1, 3), (5, 6), (8, 8) ], self.holding.year_ranges() )
+        self.assertEqual( ['1', '2', '3', '5', '6', '8'], self.holding.to_dct()['years'] )
+
+    def test__merge_years( self ):
+        """ Checks union of years, with re-basing on an earlier year. """
+        for year in [ '1926', '1928' ]:
+            self.holding.add_year( year )
+        other = HoldingRecord( '0002-9629', 'other title', 'url', 'sci', 'Sciences', 'R11 .A6' )
+        for year in [ '1920', '1927' ]:
+            other.add_year( year )
+        self.holding.merge_years( other )
+        self.assertEqual( [ (1920, 1920), (1926, 1928) ], self.holding.year_ranges() )
+        self.assertEqual( 'title', self.holding.title )
+
+    # end class HoldingRecordTest
+
+
+class DevDbUpdaterTest( TestCase ):
+    """ Tests lib.devdb_updater.DevDbUpdater """
+
+    def setUp( self ):
+        """ Runs initialization; loads rows to be kept, changed, and removed. """
+        defs_dct = { 'key': 0, 'issn': 1, 'title': 2, 'url': 3, 'location': 4, 'building': 5, 'callnumber': 6, 'year_start': 7, 'year_end': 8 }
+        self.updater = DevDbUpdater( defs_dct, batch_size=2 )
+        self.holdings_lst = [
+            [u'000294831919', u'0002-9483', u'aa', u'url_aa', u'qs', u'Annex', u'1-SIZE GN1 .A55', 1919, 1919],
+            [u'000296291926', u'0002-9629', u'bb', u'url_bb', u'sci', u'Sciences', u'R11 .A6', 1926, 1928],
+            [u'0022197X1991', u'0022-197X', u'cc', u'url_cc', u'rsmch', u'Rock', u'JX1 .C58', 1991, 1992],
+            ]
+        self.updater.update( self.holdings_lst[0:2] + [[u'stale', u'1111-1111', u'zz', u'url_zz', u'sci', u'Sciences', u'Z1', 1900, 1901]] )
+
+    def test__update( self ):
+        """ Checks counts and resulting table; a changed row is updated in place, with a new `date_updated`. """
+        self.holdings_lst[1][8] = 1930  # end-year changed
+        self.holdings_lst[1][2] = u'bb2'  # title changed
+        PrintTitleDev.objects.update( date_updated=datetime.datetime(2016, 1, 1) )
+        self.assertEqual(
+            {'added': 1, 'changed': 1, 'deleted': 1, 'unchanged': 1},
+            self.updater.update( self.holdings_lst )
+            )
+        self.assertEqual(
+            [ (u'000294831919', 1919), (u'000296291926', 1930), (u'0022197X1991', 1992) ],
+            list( PrintTitleDev.objects.order_by('key').values_list('key', 'end') )
+            )
+        changed = PrintTitleDev.objects.get( key=u'000296291926' )
+        self.assertEqual( u'bb2', changed.title )
+        self.assertTrue( changed.date_updated > datetime.datetime(2016, 1, 1) )
+        self.assertEqual( datetime.datetime(2016, 1, 1), PrintTitleDev.objects.get(key=u'000294831919').date_updated )  # unchanged row untouched
+        self.assertEqual(
+            {'added': 0, 'changed': 0, 'deleted': 0, 'unchanged': 3},
+            self.updater.update( self.holdings_lst )
+            )
+
+    def test__shadow_load( self ):
+        """ Checks the swapped-in table holds exactly the new rows, with the model still working against it. """
+        self.holdings_lst[1][8] = 1930
+        loader = ShadowTableLoader( { 'key': 0, 'issn': 1, 'title': 2, 'url': 3, 'location': 4, 'building': 5, 'callnumber': 6, 'year_start': 7, 'year_end': 8 }, batch_size=2 )
+        self.assertEqual( 3, loader.load(self.holdings_lst) )
+        self.assertEqual(
+            [ (u'000294831919', 1919), (u'000296291926', 1930), (u'0022197X1991', 1992) ],
+            list( PrintTitleDev.objects.order_by('key').values_list('key', 'end') )
+            )
+        self.assertEqual(
+            {'added': 0, 'changed': 0, 'deleted': 0, 'unchanged': 3},
+            self.updater.update( self.holdings_lst )
+            )
+
+    # end class DevDbUpdaterTest
+
+
+class TitleSearchTest( TestCase ):
+    """ Tests lib.title_search.TitleSearchIndex and TitleFacets, through the loaders and the admin. """
+
+    def setUp( self ):
+        """ Loads titles. """
+        self.defs_dct = { 'key': 0, 'issn': 1, 'title': 2, 'url': 3, 'location': 4, 'building': 5, 'callnumber': 6, 'year_start': 7, 'year_end': 8 }
+        self.holdings_lst = [
+            [u'000294831919', u'0002-9483', u'American journal of physical anthropology', u'url_aa', u'qs', u'Annex', u'1-SIZE GN1 .A55', 1919, 1919],
+            [u'000296291926', u'0002-9629', u'American journal of the medical sciences', u'url_bb', u'sci', u'Sciences', u'R11 .A6', 1926, 1928],
+            [u'0022197X1991', u'0022-197X', u'Journal of conflict resolution', u'url_cc', u'rsmch', u'Rock', u'JX1 .C58', 1991, 1992],
+            ]
+        DevDbUpdater( self.defs_dct, batch_size=2 ).update( self.holdings_lst )
+        self.model_admin = admin.site._registry[PrintTitleDev]
+
+    def search_keys( self, search_term ):
+        """ Returns the admin's search-result keys. """
+        ( titles, use_distinct ) = self.model_admin.get_search_results( None, PrintTitleDev.objects.all(), search_term )
+        return sorted( titles.values_list('key', flat=True) )
+
+    def test__search( self ):
+        """ Checks word-prefixes, key and issn prefixes, and the index kept in step by diff and shadow loads. """
+        self.assertTrue( TitleSearchIndex().is_available() )
+        self.assertEqual( [u'000294831919', u'000296291926'], self.search_keys('americ JOURN') )
+        self.assertEqual( [u'000296291926'], self.search_keys('r11') )
+        self.assertEqual( [u'0022197X1991'], self.search_keys('0022') )
+        self.assertEqual( [u'000294831919'], self.search_keys('000294') )  # issn-prefix, without its hyphen
+        self.holdings_lst[1][2] = u'Medical sciences review'
+        DevDbUpdater( self.defs_dct, batch_size=2 ).update( self.holdings_lst[1:] )
+        self.assertEqual( [], self.search_keys('american') )
+        self.assertEqual( [u'000296291926'], self.search_keys('review') )
+        ShadowTableLoader( self.defs_dct, batch_size=2 ).load( self.holdings_lst[0:1] )
+        self.assertEqual( [u'000294831919'], self.search_keys('american') )
+        self.assertEqual( [], self.search_keys('review') )
+
+    def test__search_stopwords( self ):
+        """ Checks stopwords and short words, which a mysql index can't match, still narrow the search rather than emptying it. """
+        self.assertEqual( [u'000296291926'], self.search_keys('the') )  # sqlite fts5 indexes every word
+        index = TitleSearchIndex()
+        ( index.min_word_length, index.stopwords ) = ( 3, TitleSearchIndex.mysql_stopwords )  # mysql's rules, on any db
+        search_keys = lambda term: sorted( index.search(PrintTitleDev.objects.all(), term).values_list('key', flat=True) )
+        self.assertEqual( [u'000296291926'], search_keys('the medical') )
+        self.assertEqual( [u'000296291926'], search_keys('of the') )  # no indexed word
+        self.assertEqual( [u'000294831919', u'000296291926', u'0022197X1991'], search_keys('journal of') )
+        self.assertEqual( [u'000294831919'], search_keys('GN anthropology') )  # a short word, in the call-number
+
+    def test__facets( self ):
+        """ Checks building counts are cached until the next recorded run. """
+        facets = TitleFacets()
+        self.assertEqual( [(u'Annex', 1), (u'Rock', 1), (u'Sciences', 1)], facets.get_counts('building') )
+        PrintTitleDev.objects.filter( building='Rock' ).update( building='Sciences' )
+        self.assertEqual( [(u'Annex', 1), (u'Rock', 1), (u'Sciences', 1)], facets.get_counts('building') )
+        RunRecorder( None ).save( 'complete' )
+        self.assertEqual( [(u'Annex', 1), (u'Sciences', 2)], facets.get_counts('building') )
+
+    # end class TitleSearchTest
+
+
 class IssnDctTest( TestCase ):
     """ Ensures any update to issn-to-unicode-title json file are formatted properly. """
 
@@ -268,9 +406,72 @@ class HoldingsDctBuilderTest( TestCase ):
                 u'title': u'Information circular / State of Tennessee Department of Conservation, Division of Geology',
                 u'url': u'https://search.library.brown.edu/catalog/?q=Information+circular+%2F+State+of+Tennessee+Department+of+Conservation%2C+Division+of+Geology&f%5Bformat%5D%5B%5D=Periodical+Title',
                 u'years': [u'1971']}},
-            self.builder.build_holdings_dct()
+            dict( (key, holding.to_dct()) for (key, holding) in self.builder.build_holdings_dct().items() )
             )
 
+    def test__make_shards( self ):
+        """ Checks shards cover the file and start at line-beginnings. """
+        size = os.path.getsize( settings_app.TEST_FROM_RAPID_UTF8_FILEPATH )
+        shards = self.builder.make_shards( size, 7 )
+        self.assertEqual( 0, shards[0][0] )
+        self.assertEqual( size, shards[-1][1] )
+        with open( settings_app.TEST_FROM_RAPID_UTF8_FILEPATH, 'rb' ) as f:
+            data = f.read()
+        for ( start, end ) in shards[1:]:
+            self.assertEqual( b'\n', data[start-1:start] )
+
+    def test__build_holdings_dct_parallel( self ):
+        """ Checks sharded parsing matches the serial parse. """
+        serial_dct = self.builder.build_holdings_dct()
+        self.assertEqual( serial_dct, self.builder.build_holdings_dct_parallel(2) )
+
+    def test__checkpoint_resume( self ):
+        """ Checks a parse that dies part-way resumes from its checkpoint, serially or in shards, to the uninterrupted result. """
+        expected_dct = self.builder.build_holdings_dct()
+        checkpoint_path = os.path.join( tempfile.mkdtemp(), 'checkpoint' )
+        make_checkpointer = lambda: ParseCheckpointer( settings_app.TEST_FROM_RAPID_UTF8_FILEPATH, checkpoint_path=checkpoint_path, interval_seconds=0 )
+        builder = HoldingsDctBuilder( settings_app.TEST_FROM_RAPID_UTF8_FILEPATH, checkpointer=make_checkpointer() )
+        original_add_row = builder.add_row_to_holdings_dct
+        def add_row_then_die( holdings_dct, row ):
+            if builder.line_filter.lines_kept > 5:
+                raise Exception( 'worker recycled' )
+            return original_add_row( holdings_dct, row )
+        builder.add_row_to_holdings_dct = add_row_then_die
+        self.assertRaises( Exception, builder.build_holdings_dct )
+        checkpoint = make_checkpointer().load()
+        self.assertTrue( 0 < checkpoint['offset'] < os.path.getsize(settings_app.TEST_FROM_RAPID_UTF8_FILEPATH) )
+        self.assertEqual( expected_dct, HoldingsDctBuilder(settings_app.TEST_FROM_RAPID_UTF8_FILEPATH).build_holdings_dct(checkpoint=make_checkpointer().load()) )
+        self.assertEqual( expected_dct, HoldingsDctBuilder(settings_app.TEST_FROM_RAPID_UTF8_FILEPATH).build_holdings_dct_parallel(2, checkpoint=make_checkpointer().load()) )
+        self.assertEqual( None, ParseCheckpointer(settings_app.TEST_FROM_RAPID_FILEPATH, checkpoint_path=checkpoint_path).load() )  # another extract
+        resent_filepath = os.path.join( os.path.dirname(checkpoint_path), 'resent.txt' )
+        shutil.copy( settings_app.TEST_FROM_RAPID_UTF8_FILEPATH, resent_filepath )
+        os.utime( resent_filepath, (0, os.path.getmtime(settings_app.TEST_FROM_RAPID_UTF8_FILEPATH) + 60) )
+        self.assertEqual( None, ParseCheckpointer(resent_filepath, checkpoint_path=checkpoint_path).load() )  # same bytes, re-sent
+        shutil.rmtree( os.path.dirname(checkpoint_path) )
+
+    def test__checkpoint_spacing( self ):
+        """ Checks saves wait for the parse to go as many rows past the last save as its snapshot held, and a finished parse writes none. """
+        checkpoint_path = os.path.join( tempfile.mkdtemp(), 'checkpoint' )
+        checkpointer = ParseCheckpointer( settings_app.TEST_FROM_RAPID_UTF8_FILEPATH, checkpoint_path=checkpoint_path, interval_seconds=0 )
+        checkpointer.save( {'offset': 10, 'holdings_dct': dict.fromkeys(range(100))}, 150 )
+        self.assertEqual( False, checkpointer.is_due(249) )
+        self.assertEqual( True, checkpointer.is_due(250) )
+        os.remove( checkpoint_path )
+        builder = HoldingsDctBuilder( settings_app.TEST_FROM_RAPID_UTF8_FILEPATH, checkpointer=ParseCheckpointer(settings_app.TEST_FROM_RAPID_UTF8_FILEPATH, checkpoint_path=checkpoint_path) )
+        builder.build_holdings_dct()
+        self.assertEqual( False, os.path.exists(checkpoint_path) )
+        shutil.rmtree( os.path.dirname(checkpoint_path) )
+
+    def test__serial_ingest_stage( self ):
+        """ Checks the single-pass parse records an `ingest` stage, split out of the `parse` stage's time. """
+        recorder = RunRecorder()
+        builder = HoldingsDctBuilder( settings_app.TEST_FROM_RAPID_UTF8_FILEPATH, run_recorder=recorder )
+        utf8_maker = Utf8Maker( settings_app.TEST_FROM_RAPID_FILEPATH, settings_app.TEST_FROM_RAPID_UTF8_FILEPATH )
+        builder.build_holdings_dct( utf8_maker=utf8_maker )
+        self.assertEqual( round(utf8_maker.stream_seconds, 3), recorder.stages['ingest']['seconds'] )
+        self.assertTrue( recorder.stages['parse']['seconds'] >= 0 )
+        self.assertEqual( False, recorder.stages['ingest']['failed'] )
+
     # end class HoldingsDctBuilderTest
 
 
@@ -304,6 +505,303 @@ class TitleMakerTest( TestCase ):
     # end class TitleMakerTest
 
 
+class FakeSolrHandler( BaseHTTPServer.BaseHTTPRequestHandler ):
+    """ Stand-in discovery-solr; answers `issn_t:(...)` queries from a small dct, and counts requests. """
+
+    titles = { '0000-0001': 'Dong Wu fa lü xue bao = Soochow law review', '0000-0002': 'Annales du Midi' }
+    request_count = 0
+
+    def do_GET( self ):
+        FakeSolrHandler.request_count += 1
+        fq = urlparse.parse_qs( urlparse.urlparse(self.path).query )['fq'][0].decode( 'utf-8' )
+        docs = [ {'issn_t': [issn], 'title_display': title} for (issn, title) in sorted(self.titles.items()) if '"%s"' % issn in fq ]
+        body = json.dumps( {'response': {'numFound': len(docs), 'docs': docs}} )
+        self.send_response( 200 )
+        self.send_header( 'Content-Type', 'application/json' )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def log_message( self, *args ):
+        pass
+
+    # end class FakeSolrHandler
+
+
+class TitleMakerBatchTest( TestCase ):
+    """ Tests batched solr lookups against a local stand-in server. """
+
+    def setUp( self ):
+        """ Starts stand-in solr; points the title-maker at it. """
+        self.server = BaseHTTPServer.HTTPServer( ('127.0.0.1', 0), FakeSolrHandler )
+        threading.Thread( target=self.server.serve_forever ).start()
+        self.solr_url = settings_app.DISCOVERY_SOLR_URL
+        settings_app.DISCOVERY_SOLR_URL = 'http://127.0.0.1:%s/solr/' % self.server.server_port
+        FakeSolrHandler.request_count = 0
+        self.temp_dir = tempfile.mkdtemp()
+        self.maker = TitleMaker( title_cache=TitleCache(cache_path=os.path.join(self.temp_dir, 'cache.sqlite3')) )
+        ( self.maker.solr_batch_size, self.maker.solr_concurrency ) = ( 2, 2 )
+
+    def test__resolve_pending_titles( self ):
+        """ Checks three deferred issns take two batched requests, and results map back to issns. """
+        for issn in [ '0000-0001', '0000-0002', '1234-5678' ]:
+            self.assertEqual( 'f�oo', self.maker.build_title(issn, 'f�oo', defer_solr=True) )
+        self.assertEqual(
+            {'0000-0001': 'Dong Wu fa lü xue bao = Soochow law review', '0000-0002': 'Annales du Midi'},
+            self.maker.resolve_pending_titles()
+            )
+        self.assertEqual( 2, FakeSolrHandler.request_count )
+        self.assertEqual( {'1234-5678': 'f�oo'}, self.maker.non_matches )
+        self.assertEqual( 'Annales du Midi', self.maker.build_title('0000-0002', 'f�oo') )  # now in dct; no request
+        self.assertEqual( 2, FakeSolrHandler.request_count )
+
+    def test__resolved_titles_persist( self ):
+        """ Checks a second run gets matches and misses from the title-cache, without solr requests. """
+        for issn in [ '0000-0001', '1234-5678' ]:
+            self.maker.build_title( issn, 'f�oo', defer_solr=True )
+        self.maker.resolve_pending_titles()
+        self.assertEqual( 1, FakeSolrHandler.request_count )
+        next_maker = TitleMaker( title_cache=TitleCache(cache_path=self.maker.title_cache.cache_path) )
+        self.assertEqual( 'Dong Wu fa lü xue bao = Soochow law review', next_maker.build_title('0000-0001', 'f�oo', defer_solr=True) )
+        self.assertEqual( 'f�oo', next_maker.build_title('1234-5678', 'f�oo', defer_solr=True) )
+        self.assertEqual( {}, next_maker.pending_titles )
+        self.assertEqual( {'1234-5678': 'f�oo'}, next_maker.non_matches )
+        self.assertEqual( (1, 0, 1), next_maker.title_cache.get_counts() )
+
+    def tearDown( self ):
+        """ Stops stand-in solr. """
+        settings_app.DISCOVERY_SOLR_URL = self.solr_url
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree( self.temp_dir )
+
+    # end class TitleMakerBatchTest
+
+
+class TitleCacheTest( TestCase ):
+    """ Tests lib.title_cache.TitleCache """
+
+    def setUp( self ):
+        """ Runs initialization against a temporary cache-file. """
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = TitleCache( cache_path=os.path.join(self.temp_dir, 'cache.sqlite3'), negative_ttl_days=1 )
+
+    def test__lookup( self ):
+        """ Checks seeded hits, negatives, expired negatives, and counters. """
+        self.assertEqual( ('hit', 'Dong Wu fa lü xue bao = Soochow law review'), self.cache.lookup('0259-3750') )  # from the seed json
+        self.assertEqual( ('miss', None), self.cache.lookup('1234-5678') )
+        self.cache.store_negatives( ['1234-5678'] )
+        self.assertEqual( ('negative', None), self.cache.lookup('1234-5678') )
+        self.cache.negative_ttl_seconds = -1  # negative entry now stale
+        self.assertEqual( ('miss', None), self.cache.lookup('1234-5678') )
+        self.assertEqual( (1, 2, 1), self.cache.get_counts() )
+
+    def tearDown( self ):
+        """ Removes the temporary cache-file. """
+        shutil.rmtree( self.temp_dir )
+
+    # end class TitleCacheTest
+
+
+class FakeLocationsHandler( BaseHTTPServer.BaseHTTPRequestHandler ):
+    """ Stand-in locations-service; honors If-None-Match, can leave the ETag off its 304s, and can be set to fail. """
+
+    locations = { 'result': {'items': {'sci': {'building': 'Sciences'}, 'qs': {'building': 'Annex'}}} }
+    ( statuses, failing, bare_304 ) = ( [], False, False )
+
+    def do_GET( self ):
+        if FakeLocationsHandler.failing:
+            status = 503
+        elif self.headers.get( 'If-None-Match' ) == '"v1"':
+            status = 304
+        else:
+            status = 200
+        FakeLocationsHandler.statuses.append( status )
+        self.send_response( status )
+        if not ( status == 304 and FakeLocationsHandler.bare_304 ):
+            self.send_header( 'ETag', '"v1"' )
+        self.send_header( 'Cache-Control', 'max-age=0' )
+        self.end_headers()
+        if status == 200:
+            self.wfile.write( json.dumps(self.locations) )
+
+    def log_message( self, *args ):
+        pass
+
+    # end class FakeLocationsHandler
+
+
+class LocationsResolverTest( TestCase ):
+    """ Tests lib.locations.LocationsResolver """
+
+    def setUp( self ):
+        """ Starts stand-in locations-service. """
+        self.server = BaseHTTPServer.HTTPServer( ('127.0.0.1', 0), FakeLocationsHandler )
+        threading.Thread( target=self.server.serve_forever ).start()
+        self.locations_url = settings_app.LOCATIONS_URL
+        settings_app.LOCATIONS_URL = 'http://127.0.0.1:%s/locations/' % self.server.server_port
+        ( FakeLocationsHandler.statuses, FakeLocationsHandler.failing, FakeLocationsHandler.bare_304 ) = ( [], False, False )
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join( self.temp_dir, 'locations_cache.json' )
+
+    def test__resolve( self ):
+        """ Checks listed codes, prefix-rule codes, and memoizing. """
+        resolver = LocationsResolver( building_table={'sci': 'Sciences'} )
+        self.assertEqual( 'Sciences', resolver.resolve('sci') )
+        self.assertEqual( 'Rock', resolver.resolve('rbx') )
+        self.assertEqual( 'zz', resolver.resolve('zz') )
+        self.assertEqual( {'sci': 'Sciences', 'rbx': 'Rock', 'zz': 'zz'}, resolver.building_table )
+
+    def test__load_revalidate_and_stale( self ):
+        """ Checks a full fetch, ETag revalidations, including a 304 without an ETag, and stale-if-error. """
+        expected = { 'sci': 'Sciences', 'qs': 'Annex' }
+        self.assertEqual( expected, LocationsResolver(cache_path=self.cache_path).building_table )
+        FakeLocationsHandler.bare_304 = True
+        self.assertEqual( expected, LocationsResolver(cache_path=self.cache_path).building_table )
+        self.assertEqual( expected, LocationsResolver(cache_path=self.cache_path).building_table )  # still revalidates with the kept ETag
+        FakeLocationsHandler.failing = True
+        self.assertEqual( expected, LocationsResolver(cache_path=self.cache_path).building_table )
+        self.assertEqual( [200, 304, 304, 503], FakeLocationsHandler.statuses )
+
+    def tearDown( self ):
+        """ Stops stand-in service; removes the temporary cache-file. """
+        settings_app.LOCATIONS_URL = self.locations_url
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree( self.temp_dir )
+
+    # end class LocationsResolverTest
+
+
+class JobQueueTest( TestCase ):
+    """ Tests lib.job_queue.JobQueue """
+
+    def setUp( self ):
+        """ Runs initialization; job-runners are swapped for quick ones. """
+        self.queue = JobQueue()
+        self.ran = []
+        self.queue.job_runners = { 'process_file': lambda job: self.ran.append(job.id), 'broken': lambda job: 1/0 }
+
+    def test__run_in_order( self ):
+        """ Checks queued jobs run oldest-first, and a failure is recorded on its job. """
+        ( first, second, third ) = ( self.queue.enqueue(), self.queue.enqueue('broken'), self.queue.enqueue() )
+        self.assertEqual( 3, self.queue.make_status_dct(third)['queue_position'] )
+        self.assertEqual( 3, self.queue.run_pending(once=True) )
+        self.assertEqual( [first.id, third.id], self.ran )
+        self.assertEqual( 'complete', ProcessorTracker.objects.get(pk=first.id).current_status )
+        second = ProcessorTracker.objects.get( pk=second.id )
+        self.assertEqual( ('failed', 'ZeroDivisionError'), (second.current_status, second.error.split('(')[0]) )
+        self.assertEqual( None, self.queue.claim_next() )
+
+    def test__views( self ):
+        """ Checks the view queues a job without running it, and the status-url reports it. """
+        response = self.client.get( '/tasks/process_file_from_rapid/', {'format': 'json'} )
+        data = json.loads( response.content )
+        self.assertEqual( ('queued', 1), (data['status'], data['queue_position']) )
+        self.assertEqual( [], self.ran )
+        status_data = json.loads( self.client.get(data['status_url']).content )
+        self.assertEqual( (data['job_id'], 'queued'), (status_data['job_id'], status_data['status']) )
+        self.assertEqual( 404, self.client.get('/tasks/jobs/999/').status_code )
+
+    def test__events( self ):
+        """ Checks the events-stream sends the job's status and closes once it's done. """
+        job = self.queue.enqueue()
+        self.queue.run_pending( once=True )
+        response = self.client.get( '/tasks/jobs/%s/events/' % job.id )
+        self.assertEqual( 'text/event-stream', response['Content-Type'] )
+        body = b''.join( response.streaming_content ).decode( 'utf-8' )
+        self.assertTrue( '"status": "complete"' in body )
+        self.assertTrue( body.endswith('event: done\ndata: {"job_id": %s, "status": "complete"}\n\n' % job.id) )
+
+    def test__progress_reporter( self ):
+        """ Checks progress reaches the tracker only when a flush is due. """
+        job = self.queue.enqueue()
+        reporter = ProgressReporter( job.id, flush_seconds=3600 )
+        reporter.start()
+        reporter.report( 10, 1000 )
+        self.assertEqual( 'N/A', json.loads(ProcessorTracker.objects.get(pk=job.id).recent_processing)['percent_done'] )
+        reporter.flush_seconds = 0
+        reporter.report( 250, 1000 )
+        job = ProcessorTracker.objects.get( pk=job.id )
+        self.assertEqual( ('in_process', 25.0), (job.current_status, json.loads(job.recent_processing)['percent_done']) )
+
+    def test__clear_stale_jobs( self ):
+        """ Checks a running job without recent heartbeats is re-queued, then failed once out of attempts. """
+        job = self.queue.enqueue()
+        self.queue.claim_next()
+        self.assertEqual( 0, self.queue.clear_stale_jobs() )
+        stale_heartbeat = datetime.datetime.now() - datetime.timedelta( seconds=settings_app.STALE_JOB_SECONDS + 60 )
+        ProcessorTracker.objects.filter( pk=job.pk ).update( current_status='in_process', heartbeat=stale_heartbeat )
+        self.assertEqual( 1, self.queue.clear_stale_jobs() )
+        self.assertEqual( 'queued', ProcessorTracker.objects.get(pk=job.pk).current_status )
+        ProcessorTracker.objects.filter( pk=job.pk ).update( current_status='in_process', attempts=settings_app.MAX_JOB_ATTEMPTS )
+        self.queue.clear_stale_jobs()
+        self.assertEqual( 'failed', ProcessorTracker.objects.get(pk=job.pk).current_status )
+
+    # end class JobQueueTest
+
+
+class RunHistoryTest( TestCase ):
+    """ Tests lib.run_history """
+
+    def test__record_and_estimate( self ):
+        """ Checks stage timings are saved, newer runs weigh more, and the estimate covers the later stages. """
+        for ( parse_seconds, load_seconds ) in [ (40.0, 20.0), (10.0, 5.0) ]:  # older run first
+            RunHistory( started=datetime.datetime.now(), status='complete', source_bytes=1000, stages=json.dumps({
+                'parse': {'seconds': parse_seconds, 'rows_in': 10, 'rows_out': 5, 'peak_memory_kb': 2048},
+                'db_load': {'seconds': load_seconds, 'rows_in': 5, 'rows_out': 5, 'peak_memory_kb': 2048}}) ).save()
+        estimator = RunHistoryEstimator( run_count=2 )
+        stage_rates = estimator.get_stage_rates()
+        self.assertAlmostEqual( 0.02, stage_rates['parse'] )  # ( 1 * 10 + 0.5 * 40 ) / 1.5 / 1000
+        self.assertAlmostEqual( 20.0, estimator.estimate_seconds_left(stage_rates, 'parse', 0.5, 1000) )  # half of parse, 10; then all of db_load, 10
+        self.assertEqual( None, estimator.estimate_seconds_left(stage_rates, 'aggregation', 0.5, 1000) )
+        recorder = RunRecorder()
+        with recorder.stage( 'aggregation', rows_in=5 ) as stage:
+            stage['rows_out'] = 4
+        run = recorder.save( 'failed' )
+        self.assertEqual( (5, 4), (json.loads(run.stages)['aggregation']['rows_in'], json.loads(run.stages)['aggregation']['rows_out']) )
+        self.assertEqual( ['failed', 'complete'], [dct['status'] for dct in estimator.make_trend()] )  # newest `run_count` runs
+        self.assertEqual( {'parse': 10.0, 'db_load': 5.0}, estimator.make_trend()[1]['stage_seconds'] )
+
+    def test__failed_stage( self ):
+        """ Checks a stage that raises is still recorded, marked failed. """
+        recorder = RunRecorder()
+        with self.assertRaises( ValueError ):
+            with recorder.stage( 'db_load', rows_in=5 ):
+                raise ValueError( 'load failed' )
+        self.assertEqual( True, recorder.stages['db_load']['failed'] )
+        self.assertEqual( 5, recorder.stages['db_load']['rows_in'] )
+        self.assertTrue( recorder.stages['db_load']['seconds'] is not None )
+
+    def test__heartbeats( self ):
+        """ Checks stages and the db-load batches stamp the job's heartbeat, so a long load isn't taken for a dead worker. """
+        job = JobQueue().enqueue()
+        recorder = RunRecorder( job.id )
+        with recorder.stage( 'aggregation' ):
+            self.assertTrue( ProcessorTracker.objects.get(pk=job.id).heartbeat is not None )
+        ProcessorTracker.objects.filter( pk=job.id ).update( heartbeat=None )
+        defs_dct = { 'key': 0, 'issn': 1, 'title': 2, 'url': 3, 'location': 4, 'building': 5, 'callnumber': 6, 'year_start': 7, 'year_end': 8 }
+        updater = DevDbUpdater( defs_dct, batch_size=1, heartbeat=Heartbeat(job.id, interval_seconds=0) )
+        ( beats, original_beat ) = ( [], updater.heartbeat.beat )
+
+        def counting_beat( force=False ):
+            """ Records the call, then stamps as usual. """
+            beats.append( force )
+            original_beat( force )
+
+        updater.heartbeat.beat = counting_beat
+        updater.update( [ [u'k%s' % i, u'1234-5678', u't', u'u', u'r', u'Rock', u'QA1', 1990, 1991] for i in range(3) ] )
+        self.assertEqual( 3, len(beats) )  # one per batch
+        self.assertTrue( ProcessorTracker.objects.get(pk=job.id).heartbeat is not None )
+
+    def test__recent_times_per_record( self ):
+        """ Checks the recent-times list keeps the newest four, rather than freezing on the first four. """
+        ( start, end ) = ( datetime.datetime(2016, 1, 1), datetime.datetime(2016, 1, 1, 0, 0, 5) )
+        times = TrackerUpdater()._update_recent_times_per_record( [1.0, 2.0, 3.0, 4.0], start, end, 1 )
+        self.assertEqual( [2.0, 3.0, 4.0, 5.0], times )
+
+    # end class RunHistoryTest
+
+
 class RowFixerTest( TestCase ):
     """ Tests models.RowFixer """
 
@@ -336,6 +834,24 @@ class RowFixerTest( TestCase ):
     # end class RowFixerTest
 
 
+class PrintLineFilterTest( TestCase ):
+    """ Tests lib.processor.PrintLineFilter """
+
+    def test__filter_lines( self ):
+        """ Checks only print lines survive, and counters add up. """
+        line_filter = PrintLineFilter()
+        lines = [
+            b'RBN,Main Library,sci,TR1 .P58,Photographic abstracts,Print,0031-8701,ISSN,,,1962\n',
+            b'RBN,Main Library,Wiley,https://foo,Archives of insect biochemistry,Electronic,0739-4462,eISSN,,,1999\n',
+            b'\n',
+            b'RBN,Main Library,qs,QP1 .E7,Ergebnisse der Physiologie, biologischen Chemie,Print,0080-2042,ISSN,1,69,1938\n',
+            ]
+        self.assertEqual( [lines[0], lines[3]], list(line_filter.filter_lines(lines)) )
+        self.assertEqual( (4, 2, 2), line_filter.get_counts() )
+
+    # end class PrintLineFilterTest
+
+
 class SSBuilderTest( TestCase ):
     """ Tests functions for building the serials-solutions file. """
 
@@ -393,9 +909,303 @@ class SSBuilderTest( TestCase ):
         # print 'line, ```{}```'.format( line )
         self.assertEqual( '"aa"', line[0:4] )
 
+    def test__export( self ):
+        """ Checks the streamed export matches sorting every built row in memory, and leaves no temp-file. """
+        for ( key, title, building, start, end ) in [
+                ('k1', 'beta', 'Rock', 1990, 1991), ('k2', 'Alpha', 'Sci', 1980, None), ('k3', 'alpha', 'Rock', 1970, 1975), ('k4', 'Alpha', 'Rock', 1985, 1985),
+                ('k5', 'gamma', 'Rock', 999, None), ('l5', 'gamma', 'Rock', 1990, None), ('m5', 'gamma', 'Rock', 1990, 1991) ]:  # years sort as the strings written
+            PrintTitleDev( key=key, issn='1234-567%s' % key[-1], start=start, end=end, building=building, call_number='QA1', title=title, url='url_%s' % title ).save()
+        ( path, delta_path ) = ( os.path.join(tempfile.mkdtemp(), 'ss.csv'), os.path.join(tempfile.mkdtemp(), 'ss_delta.csv') )
+        self.assertEqual( 7, self.builder.export(path, delta_path).row_count )
+        with open( path, 'rb' ) as f:
+            streamed = f.read()
+        rows = [ self.builder.build_row({'issn': t.issn, 'year_start': t.start, 'year_end': t.end, 'building': t.building, 'callnumber': t.call_number, 'title': t.title, 'url': t.url}) for t in PrintTitleDev.objects.all() ]
+        self.builder.save_file( rows, path )
+        with open( path, 'rb' ) as f:
+            self.assertEqual( f.read(), streamed )
+        self.assertEqual( ['ss.csv'], os.listdir(os.path.dirname(path)) )
+        self.assertEqual( False, os.path.exists(delta_path) )  # a first export has nothing to be a delta of
+        ( configured_delta_path, settings_app.SS_DELTA_FILEPATH ) = ( settings_app.SS_DELTA_FILEPATH, None )
+        self.assertEqual( '/exports/ss_delta.csv', self.builder.make_delta_path('/exports/ss.csv') )  # derived when unset
+        settings_app.SS_DELTA_FILEPATH = configured_delta_path
+        SSExportGeneration.objects.all().delete()
+        blocked_path = os.path.join( os.path.dirname(path), 'blocked' )
+        os.mkdir( blocked_path )  # renaming a file onto a directory fails
+        self.assertRaises( OSError, self.builder.export, blocked_path, delta_path )
+        self.assertEqual( 0, SSExportGeneration.objects.count() )  # the failed rename rolled back the generation
+        self.assertEqual( ['blocked', 'ss.csv'], sorted(os.listdir(os.path.dirname(path))) )  # and its temp-file is gone
+        for directory in [ os.path.dirname(path), os.path.dirname(delta_path) ]:
+            shutil.rmtree( directory )
+
+    def test__export_delta( self ):
+        """ Checks a repeat export with no changes writes nothing, and one with changes writes only them to the delta. """
+        for key in [ 'k1', 'k2', 'k3' ]:
+            PrintTitleDev( key=key, issn='1234-567%s' % key[-1], start=1990, end=1991, building='Rock', call_number='QA1', title='title_%s' % key, url='url' ).save()
+        directory = tempfile.mkdtemp()
+        ( path, delta_path ) = ( os.path.join(directory, 'ss.csv'), os.path.join(directory, 'ss_delta.csv') )
+        first_generation = self.builder.export( path, delta_path, mode='delta' )
+        self.assertEqual( ( 3, True, False ), (first_generation.new_count, first_generation.wrote_full_file, first_generation.wrote_delta_file) )
+        os.remove( path )
+        self.assertEqual( None, self.builder.export(path, delta_path, mode='delta') )
+        self.assertEqual( [], os.listdir(directory) )
+        PrintTitleDev.objects.filter( key__in=['k1', 'k3'] ).update( end=1999 )
+        PrintTitleDev.objects.filter( key='k2' ).delete()
+        PrintTitleDev( key='k4', issn='1234-5674', start=1990, end=1991, building='Rock', call_number='QA1', title='title_k4', url='url' ).save()
+        PrintTitleDev( key='k0', issn='1234-5670', start=1990, end=1991, building='Rock', call_number='QA1', title='title_k0', url='url' ).save()
+        generation = self.builder.export( path, delta_path, mode='delta' )
+        self.assertEqual( (2, 2, 1), (generation.new_count, generation.changed_count, generation.deleted_count) )
+        PrintTitleDev.objects.filter( key='k0' ).delete()
+        self.builder.batch_size = 1  # one-row pages and update-batches
+        generation = self.builder.export( path, delta_path, mode='delta' )
+        self.assertEqual( (0, 0, 1, False), (generation.new_count, generation.changed_count, generation.deleted_count, generation.wrote_full_file) )
+        with open( delta_path, 'rb' ) as f:
+            self.assertEqual( [('deleted', 'title_k0', '1991')], [(row[0], row[1], row[8]) for row in csv.reader(f)] )
+        PrintTitleDev.objects.filter( key__in=['k1', 'k3'] ).update( end=2000 )
+        PrintTitleDev.objects.filter( key='k4' ).delete()
+        PrintTitleDev( key='k5', issn='1234-5675', start=1990, end=1991, building='Rock', call_number='QA1', title='title_k5', url='url' ).save()
+        generation = self.builder.export( path, delta_path, mode='delta' )
+        self.assertEqual( (1, 2, 1, False), (generation.new_count, generation.changed_count, generation.deleted_count, generation.wrote_full_file) )
+        with open( delta_path, 'rb' ) as f:
+            self.assertEqual( [('changed', 'title_k1', '2000'), ('changed', 'title_k3', '2000'), ('new', 'title_k5', '1991'), ('deleted', 'title_k4', '1991')], [(row[0], row[1], row[8]) for row in csv.reader(f)] )
+        self.assertEqual( None, self.builder.export(path, delta_path, mode='delta') )  # the batched updates took
+        self.assertEqual( ['ss_delta.csv'], os.listdir(directory) )
+        self.assertEqual( 3, self.builder.export(path, delta_path, force_full=True).row_count )  # on demand, even with no changes
+        self.assertEqual( ['ss.csv', 'ss_delta.csv'], sorted(os.listdir(directory)) )
+        shutil.rmtree( directory )
+
     # end class SSBuilderTest()
 
 
+class ManualDbHandlerTest( TestCase ):
+    """ Tests models.ManualDbHandler """
+
+    def setUp( self ):
+        """ Creates a scratch table. """
+        self.handler = ManualDbHandler()
+        self.url = settings_app.TEST_DB_CONNECTION_URL
+        self.handler.run_sql( 'CREATE TABLE `handler_test_table` ( `key` varchar(20) PRIMARY KEY, `start` int(11) )', self.url )
+
+    def test__engine_reuse( self ):
+        """ Checks handlers share one engine per url. """
+        self.assertTrue( self.handler.get_engine(self.url) is ManualDbHandler().get_engine(self.url) )
+
+    def test__transaction( self ):
+        """ Checks bound params, executemany, rollback on error, and timings. """
+        sql = 'INSERT INTO `handler_test_table` ( `key`, `start` ) VALUES ( :key, :start )'
+        with self.handler.transaction( self.url ):
+            self.handler.run_sql( sql, self.url, params={'key': "o'brien", 'start': 1990} )
+            self.handler.run_sql( sql, self.url, params=[{'key': 'a', 'start': 1}, {'key': 'b', 'start': 2}] )
+        with self.assertRaises( Exception ):
+            with self.handler.transaction( self.url ):
+                self.handler.run_sql( sql, self.url, params={'key': 'c', 'start': 3} )
+                self.handler.run_sql( sql, self.url, params={'key': 'a', 'start': 4} )  # duplicate key
+        rows = self.handler.run_sql( 'SELECT `key`, `start` FROM `handler_test_table` ORDER BY `start`', self.url )
+        self.assertEqual( [('a', 1), ('b', 2), ("o'brien", 1990)], [tuple(row) for row in rows] )
+        self.assertEqual( 3, self.handler.get_timing_summary()['INSERT']['count'] )  # the failing insert isn't timed
+
+    def test__iter_sql( self ):
+        """ Checks streamed rows, in chunks, with bound params. """
+        self.handler.run_sql( 'INSERT INTO `handler_test_table` ( `key`, `start` ) VALUES ( :key, :start )', self.url, params=[{'key': 'k%s' % i, 'start': i} for i in range(5)] )
+        rows = self.handler.iter_sql( 'SELECT `key` FROM `handler_test_table` WHERE `start` >= :start ORDER BY `key`', self.url, params={'start': 1}, chunk_size=2 )
+        self.assertEqual( ['k1', 'k2', 'k3', 'k4'], [row[0] for row in rows] )
+
+    def tearDown( self ):
+        """ Drops the scratch table. """
+        self.handler.run_sql( 'DROP TABLE `handler_test_table`', self.url )
+
+    # end class ManualDbHandlerTest
+
+
+class DownloadHelperTest( TestCase ):
+    """ Tests lib.viewhelper_download.DownloadHelper, through its views. """
+
+    def setUp( self ):
+        """ Adds titles. """
+        for ( key, issn, building ) in [ ('k1', '1111-1111', 'Rock'), ('k2', '2222-222X', 'Sci'), ('k3', '3333-3333', 'Rock') ]:
+            PrintTitleDev( key=key, issn=issn, start=1990, end=1991, building=building, location='loc', call_number='QA1', title='title_%s' % key, url='url_%s' % key ).save()
+
+    def test__ss_file( self ):
+        """ Checks the csv download is filtered, and gzipped only when accepted. """
+        response = self.client.get( '/tasks/downloads/ss_file/', {'building': 'Rock'} )
+        self.assertEqual( ('text/csv; charset=utf-8', False), (response['Content-Type'], response.has_header('Content-Encoding')) )
+        body = b''.join( response.streaming_content )
+        self.assertEqual( ['title_k1', 'title_k3'], [row[0] for row in csv.reader(io.BytesIO(body))] )
+        response = self.client.get( '/tasks/downloads/ss_file/', {'building': 'Rock'}, HTTP_ACCEPT_ENCODING='deflate, gzip' )
+        self.assertEqual( 'gzip', response['Content-Encoding'] )
+        self.assertEqual( body, zlib.decompress(b''.join(response.streaming_content), 31) )
+        response = self.client.get( '/tasks/downloads/ss_file/', HTTP_ACCEPT_ENCODING='gzip;q=0' )
+        self.assertEqual( False, response.has_header('Content-Encoding') )
+
+    def test__holdings( self ):
+        """ Checks the json-lines download; issns match with or without the hyphen. """
+        response = self.client.get( '/tasks/downloads/holdings/', {'issn': ['2222222x', '1111-1111']} )
+        holdings = [ json.loads(line) for line in b''.join(response.streaming_content).splitlines() ]
+        self.assertEqual( ['k1', 'k2'], [holding['key'] for holding in holdings] )
+        self.assertEqual( {'key': 'k2', 'issn': '2222-222X', 'title': 'title_k2', 'url': 'url_k2', 'location': 'loc', 'building': 'Sci', 'call_number': 'QA1', 'start': 1990, 'end': 1991}, holdings[1] )
+
+    def test__query_streamer( self ):
+        """ Checks a filtered queryset streamed in one-row fetches matches django's own results. """
+        streamer = QueryStreamer()
+        streamer.fetch_size = 1
+        titles = PrintTitleDev.objects.filter( building='Rock', start__gte=1990 ).order_by( '-key' ).values_list( 'key', 'start' )
+        self.assertEqual( list(titles), [tuple(row) for row in streamer.iter_queryset(titles)] )
+        self.assertEqual( [(u'k3', 1990), (u'k1', 1990)], [tuple(row) for row in streamer.iter_queryset(titles, separate_connection=True)] )
+
+    # end class DownloadHelperTest
+
+
+class HoldingsApiTest( TestCase ):
+    """ Tests lib.viewhelper_api.HoldingsApiHelper, through its view. """
+
+    def setUp( self ):
+        """ Adds titles. """
+        for ( key, location, start, end ) in [ ('k1', 'sci', 1990, 1995), ('k2', 'rock', 1980, 1981), ('k3', 'sci', 2001, None), ('k4', 'sci', 1970, 1985), ('k5', 'sci', 1999, 2000) ]:
+            PrintTitleDev( key=key, issn='1234-5678', start=start, end=end, building='b', location=location, call_number='QA1', title='t', url='u' ).save()
+
+    def test__pages( self ):
+        """ Checks keyset pages follow on from each other, with filters and the year-overlap kept. """
+        ( keys, url ) = ( [], '/api/holdings/?location=sci&year_from=1984&year_to=2005&limit=2&fields=key,start' )
+        while url:
+            data = json.loads( self.client.get(url).content )
+            keys.extend( [result['key'] for result in data['results']] )
+            url = data['next_url']
+        self.assertEqual( ['k1', 'k3', 'k4', 'k5'], keys )
+        self.assertEqual( {'key': 'k5', 'start': 1999}, data['results'][-1] )
+
+    def test__fields_and_errors( self ):
+        """ Checks field-selection without the key, and 400s for bad params. """
+        data = json.loads( self.client.get('/api/holdings/', {'fields': 'location', 'limit': '1'}).content )
+        self.assertEqual( ([{'location': 'sci'}], 'k1'), (data['results'], data['next_after']) )
+        for params in [ {'limit': '0'}, {'fields': 'password'}, {'year_from': 'soon'} ]:
+            self.assertEqual( 400, self.client.get('/api/holdings/', params).status_code )
+
+    # end class HoldingsApiTest
+
+
+class UpdateTitlesHelperTest( TestCase ):
+    """ Tests lib.viewhelper_updatedb.UpdateTitlesHelper """
+
+    def setUp( self ):
+        """ Points the helper at a scratch easyA table in the test db. """
+        ( self.url, self.table, self.batch_size ) = ( settings_app.DB_CONNECTION_URL, os.environ['RAPID__TITLES_TABLE_NAME'], settings_app.DB_SYNC_BATCH_SIZE )
+        ( self.backup_mode, self.min_rows ) = ( settings_app.DB_BACKUP_MODE, settings_app.DB_SYNC_MIN_ROWS )
+        ( settings_app.DB_CONNECTION_URL, os.environ['RAPID__TITLES_TABLE_NAME'], settings_app.DB_SYNC_BATCH_SIZE ) = ( settings_app.TEST_DB_CONNECTION_URL, 'sync_test_table', 2 )
+        self.helper = UpdateTitlesHelper()
+        self.helper.db_handler.run_sql( 'CREATE TABLE `sync_test_table` ( `key` varchar(20) PRIMARY KEY, `issn` varchar(15), `start` int(11), `end` int(11), `location` varchar(25), `call_number` varchar(50) )', settings_app.DB_CONNECTION_URL )
+
+    def test__update_production_table( self ):
+        """ Checks adds and deletes are applied in chunks. """
+        for i in range( 5 ):
+            PrintTitleDev( key='k%s' % i, issn='1234-567%s' % i, start=1990, end=None, building='Rock', location='r', call_number='QA%s' % i ).save()
+        self.helper._add_rapid_entries( ['k0'], {'k0': ['1234-5670', 1990, None, 'Rock', 'QA0']} )
+        self.helper.db_handler.run_sql( "INSERT INTO `sync_test_table` ( `key` ) VALUES ( 'old1' ), ( 'old2' ), ( 'old3' )", settings_app.DB_CONNECTION_URL )
+        self.helper.db_handler.statement_timings = []
+        self.helper.update_production_table()
+        rows = self.helper.db_handler.run_sql( 'SELECT `key`, `location`, `end` FROM `sync_test_table` ORDER BY `key`', settings_app.DB_CONNECTION_URL )
+        self.assertEqual( [('k%s' % i, 'Rock', None) for i in range(5)], [tuple(row) for row in rows] )
+        summary = self.helper.db_handler.get_timing_summary()
+        self.assertEqual( (2, 2), (summary['INSERT']['count'], summary['DELETE']['count']) )  # 4 adds, 3 deletes; 2 per statement
+
+    def test__merge_diff( self ):
+        """ Checks the merge-join against unordered input, and that a changed row is updated in place. """
+        differ = TitlesMergeDiffer( self.helper.db_handler, settings_app.DB_CONNECTION_URL, 'sync_test_table' )
+        self.assertEqual(
+            [('delete', 'a'), ('add', 'b'), ('unchanged', 'c'), ('change', 'd'), ('add', 'e')],
+            [ (action, key) for (action, key, dev_row) in differ.merge(iter([('b', 1), ('c', 1), ('d', 1), ('e', 1)]), iter([('a', 1), ('c', 1), ('d', 2)])) ]
+            )
+        with self.assertRaises( Exception ):
+            list( differ.merge(iter([('b', 1), ('a', 1)]), iter([])) )
+        PrintTitleDev( key='k1', issn='1234-5671', start=1990, end=1995, building='Rock', location='r', call_number='QA1' ).save()
+        self.helper.db_handler.run_sql( "INSERT INTO `sync_test_table` VALUES ( 'k1', '1234-5671', 1990, 1996, 'Rock', 'QA1' ), ( 'k0', '', 1, 1, '', '' )", settings_app.DB_CONNECTION_URL )
+        delta = differ.diff()
+        self.assertEqual( (['k1'], ['k0'], [], 0), (delta['change'], delta['delete'], delta['add'], delta['unchanged']) )
+        self.assertEqual( {'added': 0, 'updated': 1, 'deleted': 1, 'unchanged': 0}, self.helper.update_production_table() )
+        rows = self.helper.db_handler.run_sql( 'SELECT * FROM `sync_test_table`', settings_app.DB_CONNECTION_URL )
+        self.assertEqual( [('k1', '1234-5671', 1990, 1995, 'Rock', 'QA1')], [tuple(row) for row in rows] )
+        self.assertEqual( {'added': 0, 'updated': 0, 'deleted': 0, 'unchanged': 1}, self.helper.update_production_table() )
+
+    def test__plan_and_apply( self ):
+        """ Checks a cached plan is applied as planned, even if easyA changed since, and that timing feeds the next estimate. """
+        for i in range( 3 ):
+            PrintTitleDev( key='k%s' % i, issn='1234-567%s' % i, start=1990, end=None, building='Rock', location='r', call_number='QA%s' % i ).save()
+        plan = self.helper.plan_update( None )
+        self.assertEqual( (3, 0, 0, 2, None), (plan.add_count, plan.change_count, plan.delete_count, plan.estimated_statements, plan.estimated_seconds) )  # 2 rows per statement
+        self.helper.db_handler.run_sql( "INSERT INTO `sync_test_table` ( `key` ) VALUES ( 'late' )", settings_app.DB_CONNECTION_URL )
+        self.assertEqual( {'added': 3, 'updated': 0, 'deleted': 0, 'unchanged': 0}, self.helper.apply_plan(plan) )
+        rows = self.helper.db_handler.run_sql( 'SELECT `key` FROM `sync_test_table` ORDER BY `key`', settings_app.DB_CONNECTION_URL )
+        self.assertEqual( ['k0', 'k1', 'k2', 'late'], [row[0] for row in rows] )
+        self.assertEqual( None, self.helper.sync_planner.get_pending_plan() )
+        self.assertTrue( self.helper.plan_update(None).estimated_seconds is not None )
+
+    def test__plan_values_and_reload( self ):
+        """ Checks a plan writes its planned values even if PrintTitleDev is edited since, that a failed apply writes nothing, and that a dev-table load supersedes the plan. """
+        defs_dct = { 'key': 0, 'issn': 1, 'title': 2, 'url': 3, 'location': 4, 'building': 5, 'callnumber': 6, 'year_start': 7, 'year_end': 8 }
+        holdings_lst = [ [u'k%s' % i, u'1234-567%s' % i, u't', u'u', u'r', u'Rock', u'QA%s' % i, 1990, 1991] for i in range(3) ]
+        DevDbUpdater( defs_dct ).update( holdings_lst )
+        plan = self.helper.plan_update( None )
+        PrintTitleDev.objects.filter( key='k0' ).update( end=2000 )
+        PrintTitleDev.objects.filter( key='k1' ).delete()
+        self.helper.db_handler.run_sql( "INSERT INTO `sync_test_table` ( `key` ) VALUES ( 'k2' )", settings_app.DB_CONNECTION_URL )  # the k2 insert will fail
+        with self.assertRaises( Exception ):
+            self.helper.apply_plan( plan )
+        rows = self.helper.db_handler.run_sql( 'SELECT `key` FROM `sync_test_table`', settings_app.DB_CONNECTION_URL )
+        self.assertEqual( ['k2'], [row[0] for row in rows] )  # the k0 and k1 inserts rolled back with it
+        self.helper.db_handler.run_sql( "DELETE FROM `sync_test_table`", settings_app.DB_CONNECTION_URL )
+        self.assertEqual( {'added': 3, 'updated': 0, 'deleted': 0, 'unchanged': 0}, self.helper.apply_plan(self.helper.sync_planner.get_pending_plan()) )
+        rows = self.helper.db_handler.run_sql( 'SELECT `key`, `end` FROM `sync_test_table` ORDER BY `key`', settings_app.DB_CONNECTION_URL )
+        self.assertEqual( [('k0', 1991), ('k1', 1991), ('k2', 1991)], [tuple(row) for row in rows] )  # as planned
+        self.helper.plan_update( None )
+        holdings_lst[0][8] = 1992
+        DevDbUpdater( defs_dct ).update( holdings_lst )
+        self.assertEqual( None, self.helper.sync_planner.get_pending_plan() )
+
+    def test__rotate( self ):
+        """ Checks publishing by rename, the row-count guard, rollback, and that a failed rotation leaves the tables as they were. """
+        rotator = self.helper.make_table_rotator()
+        rotator.min_rows = 2
+        keys_sql = 'SELECT `key` FROM `%s` ORDER BY `key`'
+        get_keys = lambda table: [ row[0] for row in self.helper.db_handler.run_sql(keys_sql % table, settings_app.DB_CONNECTION_URL) ]
+        PrintTitleDev( key='k1', issn='1234-5671', start=1990, end=None, building='Rock', location='r', call_number='QA1' ).save()
+        self.assertEqual( False, rotator.publish() )  # one row is below the guard
+        self.assertEqual( [], get_keys('sync_test_table') )
+        PrintTitleDev( key='k2', issn='1234-5672', start=1990, end=None, building='Rock', location='r', call_number='QA2' ).save()
+        self.assertEqual( True, rotator.publish() )
+        PrintTitleDev( key='k3', issn='1234-5673', start=1990, end=None, building='Rock', location='r', call_number='QA3' ).save()
+        rotator.create_like( 'sync_test_table_trash', replace=False )  # as left by a run that died after its rename
+        self.assertEqual( True, rotator.publish() )
+        self.assertEqual( False, rotator.table_exists('sync_test_table_trash') )
+        self.assertEqual( (['k1', 'k2', 'k3'], ['k1', 'k2'], []), (get_keys('sync_test_table'), get_keys('sync_test_table_backup'), get_keys('sync_test_table_backup_older')) )
+        rotator.rollback()
+        self.assertEqual( (['k1', 'k2'], []), (get_keys('sync_test_table'), get_keys('sync_test_table_backup')) )
+        with self.assertRaises( Exception ):
+            rotator.rename( [('sync_test_table', 'sync_test_table_moved'), ('sync_test_table_missing', 'sync_test_table')] )
+        self.assertEqual( ['k1', 'k2'], get_keys('sync_test_table') )  # the first rename was rolled back with the failed one
+
+    def test__rotate_plan( self ):
+        """ Checks a rotate-mode plan estimates the staging load, and that publishing marks it applied with its timing. """
+        ( settings_app.DB_BACKUP_MODE, settings_app.DB_SYNC_MIN_ROWS ) = ( 'rotate', 1 )
+        for i in range( 3 ):
+            PrintTitleDev( key='k%s' % i, issn='1234-567%s' % i, start=1990, end=None, building='Rock', location='r', call_number='QA%s' % i ).save()
+        plan = self.helper.plan_update( None )
+        self.assertEqual( 2 + TableRotator.fixed_statements, plan.estimated_statements )  # 3 staging rows, 2 per statement
+        self.helper.run_update( None )
+        plan = SyncPlan.objects.get( pk=plan.pk )
+        self.assertEqual( 'applied', plan.status )
+        self.assertTrue( plan.applied_seconds is not None )
+        self.assertEqual( None, self.helper.sync_planner.get_pending_plan() )
+        rows = self.helper.db_handler.run_sql( 'SELECT `key` FROM `sync_test_table` ORDER BY `key`', settings_app.DB_CONNECTION_URL )
+        self.assertEqual( ['k0', 'k1', 'k2'], [row[0] for row in rows] )
+
+    def tearDown( self ):
+        """ Drops the scratch tables; restores settings. """
+        for table in [ 'sync_test_table', 'sync_test_table_backup', 'sync_test_table_backup_older', 'sync_test_table_staging', 'sync_test_table_moved' ]:
+            self.helper.db_handler.run_sql( 'DROP TABLE IF EXISTS `%s`' % table, settings_app.DB_CONNECTION_URL )
+        ( settings_app.DB_CONNECTION_URL, os.environ['RAPID__TITLES_TABLE_NAME'], settings_app.DB_SYNC_BATCH_SIZE ) = ( self.url, self.table, self.batch_size )
+        ( settings_app.DB_BACKUP_MODE, settings_app.DB_SYNC_MIN_ROWS ) = ( self.backup_mode, self.min_rows )
+
+    # end class UpdateTitlesHelperTest
+
+
 class SqlAlchemyTest( TestCase ):
     """ Mostly serves as documentation for how to use sqlalchemy to execute basic sql. """
 
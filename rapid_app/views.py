@@ -5,20 +5,24 @@ import datetime, json, logging, os, pprint
 from django.conf import settings as project_settings
 from django.contrib.auth import logout
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render
 from rapid_app.lib.ss_builder import SSBuilder
-from rapid_app.lib.viewhelper_processfile import ProcessFileFromRapidHelper
+from rapid_app.lib.viewhelper_api import HoldingsApiHelper
+from rapid_app.lib.viewhelper_download import DownloadHelper
+from rapid_app.lib.viewhelper_processfile import JobStatusHelper, ProcessFileFromRapidHelper
 from rapid_app.lib.viewhelper_tasks import TasksHelper
 from rapid_app.lib.viewhelper_updatedb import UpdateTitlesHelper
-from rapid_app.models import PrintTitleDev
 
 
 log = logging.getLogger(__name__)
 tasks_hlpr = TasksHelper()
 process_file_from_rapid_hlper = ProcessFileFromRapidHelper()
+job_status_hlpr = JobStatusHelper()
 update_titles_hlpr = UpdateTitlesHelper()
 builder = SSBuilder()
+download_hlpr = DownloadHelper()
+holdings_api_hlpr = HoldingsApiHelper()
 
 
 def tasks( request ):
@@ -29,35 +33,69 @@ def tasks( request ):
     return response
 
 def process_file_from_rapid( request ):
-    """ Grabs and processes rapid extract file.
-        When done, shows titles admin. """
+    """ Queues processing of the rapid extract file.
+        Returns the job's id and status-url as json, or shows the tasks page. """
     log.debug( 'starting processing' )
     data = process_file_from_rapid_hlper.initiate_work( request )
     response = process_file_from_rapid_hlper.make_response( request, data )
     log.debug( 'response, ```%s```' % response )
     return response
 
+def job_status( request, job_id ):
+    """ Returns a processing job's status as json, for polling. """
+    data = job_status_hlpr.make_context( request, job_id )
+    return job_status_hlpr.make_response( request, data )
+
+def job_events( request, job_id ):
+    """ Streams a processing job's status as server-sent events, for the tasks page. """
+    return job_status_hlpr.make_events_response( request, job_id )
+
+def plan_titles_update( request ):
+    """ Diffs preview and easyA titles read-only, caching the plan for review on the tasks page. """
+    log.debug( 'starting plan_titles_update()' )
+    plan = update_titles_hlpr.plan_update( request )
+    if request.GET.get( 'format' ) == 'json':
+        output = json.dumps( update_titles_hlpr.sync_planner.make_plan_dct(plan), sort_keys=True, indent=2 )
+        return HttpResponse( output, content_type=u'application/javascript; charset=utf-8' )
+    return HttpResponseRedirect( reverse('tasks_url') )
+
 def update_titles_table( request ):
-    """ Backs up and updates easyAccess print-titles table. """
+    """ Backs up and updates easyAccess print-titles table, applying the pending sync-plan. """
     log.debug( 'starting update_titles()')
     update_titles_hlpr.run_update( request )
     log.debug( 'returning response' )
     return HttpResponseRedirect( reverse('tasks_url') )
 
 def create_ss_file( request ):
-    """ Creates file for serials-solutions. """
+    """ Creates files for serials-solutions: the full file and/or a delta since the last export; nothing if no titles changed.
+        `?full=true` writes the full file regardless. """
     log.debug( 'starting file-creation' )
-    ss_holder = []
-    titles = PrintTitleDev.objects.all()
-    for title in titles:
-        row_lst = builder.build_row( {
-            'issn': title.issn,
-            'year_start': title.start,
-            'year_end': title.end,
-            'building': title.building,
-            'callnumber': title.call_number,
-            'title': title.title,
-            'url': title.url } )
-        ss_holder.append( row_lst )
-    builder.save_file( lines_lst=ss_holder, path=os.environ['RAPID__TO_SS_FILEPATH']  )
+    generation = builder.export( path=os.environ['RAPID__TO_SS_FILEPATH'], force_full=(request.GET.get('full') == 'true') )
+    if generation is None:
+        return HttpResponse( 'no_changes' )
     return HttpResponse( 'file_saved' )
+
+def download_ss_file( request ):
+    """ Streams the serials-solutions csv; `?building=`, `?issn=`, and the other lib.titles_query params narrow it. """
+    log.debug( 'starting ss-file download' )
+    try:
+        return download_hlpr.make_ss_response( request )
+    except ValueError as e:
+        return HttpResponseBadRequest( unicode(e) )
+
+def download_holdings( request ):
+    """ Streams the processed holdings as json-lines; `?building=`, `?issn=`, and the other lib.titles_query params narrow them. """
+    log.debug( 'starting holdings download' )
+    try:
+        return download_hlpr.make_holdings_response( request )
+    except ValueError as e:
+        return HttpResponseBadRequest( unicode(e) )
+
+def holdings_api( request ):
+    """ Returns a keyset-paginated json page of processed holdings; params are described in lib.viewhelper_api. """
+    log.debug( 'starting holdings api' )
+    try:
+        data = holdings_api_hlpr.make_context( request )
+    except ValueError as e:
+        return holdings_api_hlpr.make_error_response( unicode(e) )
+    return holdings_api_hlpr.make_response( request, data )